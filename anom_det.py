@@ -1,447 +1,554 @@
 # ANOMALY DETECTION - USING VOTING METHOD -------------------------------------------------------------------------
 
 # Libraries
-import pickle
 import os
 import math
 import sys
 import json
-import pandas as pd
+import time
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from fastdtw import fastdtw
-from sklearn.cluster import AgglomerativeClustering
+from sklearn.cluster import AgglomerativeClustering, MiniBatchKMeans, Birch
+from sklearn.decomposition import PCA
+from scipy.stats import norm
+from scipy.cluster.hierarchy import linkage, fcluster
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from dtw import distance_matrix, distances_to_profiles
+from results import save_result
+from dataset import UserDays, load_dataset, day_labels
+from cache import cache_key, get_cached, put_cached
+from instrument import stage, stage_marks, report_stage
+
+# PARAMETERS OF THE SYSTEM
+
+# Anomaly threshold of the modules (% of days or max distance allowed), voting rule ('quorum' or 'weighted'),
+# minimum votes of a day to be an anomaly (voting), max days of a cluster considered as anomalies and
+# Sakoe-Chiba band of the DTW distances to the typical days (% of the day, None for no band)
+# The modules (features, clustering, number of clusters...) are in the registry of modules
+parameters = {'anom_threshold': 0.1, 'voting': 'quorum', 'min_votes': 3, 'min_days_in_cluster': 2, 'dtw_band': 0.1}
+
+# Version of the results (the cached results of previous versions are calculated again)
+results_version = 5
 
 # ANOMALY DETECTION FUNCTION
 
-def anom_det(user):
+# n_jobs: number of processes used for the modules (all the cpus by default, 1 to execute them in this process)
+def anom_det(user, plots=False, data=None, use_cache=True, n_jobs=None):
 
     #print('\n*ANOMALY DETECTION*')
     
     #print(f'\nUSER {user}')
 
-    # Read the data and obtain the variables
-    with open(f'datasets/data_user{user}.pkl', 'rb') as f:
-        data = pickle.load(f)
-    # Show all columns of the dataframe
-    pd.set_option('display.max_columns', None)
-    #print(data)
+    # Time, cpu time and peak memory of each stage (recorded only if the instrumentation is configured)
+    mark = stage_marks('anom_det', user=user)
+
+    # Read the data if it is not given (memory mapped arrays - one row for each day)
+    if data is None:
+        data = load_dataset(user)
+    elif not isinstance(data, UserDays):
+        data = UserDays(data)
+    mark('load_dataset', days=data.n_days, minutes=data.n_minutes)
+
+    # The results are only calculated if they are not in the cache (same data and parameters)
+    modules = enabled_modules()
+    key = result_key(data, modules)
+    result = get_cached(user, key) if use_cache else None
+    mark('cache', hit=result is not None)
+    if result is None:
+        with stage('anom_det.detect', user=user, days=data.n_days, modules=len(modules)):
+            result = detect(data, modules, n_jobs=n_jobs)
+        put_cached(user, key, result)
+        mark('put_cached')
+
+    # Store the result object - the figures are rendered from it when they are requested (the figures of the previous
+    # result are kept if the data and parameters are the same)
+    save_result('anom_det', user, result, key)
+    mark('save_result')
+
+    # Render all the figures only if they are requested
+    if plots:
+        from figures import plot_anom_det
+        plot_anom_det(user, result)
+        mark('plots', modules=len(result['modules']))
+
+    #print()
+
+    # Return anomalies in JSON format
+    anom_days_json = json.dumps(result['anom_days'])
+    return anom_days_json
 
-    # Variables of the system
-    day_time = data['Time'].tolist()
-    day_hr = data['HeartRate'].tolist()
-    day_int = data['Intensity'].tolist()
-    day_steps = data['Steps'].tolist()
+# Detect the anomalies of the days of a user - results of all the modules and of the voting system
+def detect(data, modules=None, n_jobs=None):
+
+    # Modules of the system (the ones turned on in the registry by default)
+    if modules is None:
+        modules = enabled_modules()
+
+    # Variables of the system (read only - shared by all the modules)
+    if not isinstance(data, UserDays):
+        data = UserDays(data)
+    inputs = {name: data[name] for name in ['hr', 'int', 'steps', 'start', 'stats']}
+    # Vectors with the resolutions of the modules (computed once for all the modules)
+    with stage('resolutions', days=data.n_days) as record:
+        arrays = resolution_inputs(inputs, modules)
+        inputs.update(arrays)
+        record['arrays'] = len(arrays)
+    day_hr = data['hr']
+    # Time of each sample of the days
+    day_time = data.times()
 
     # Calculate number of days
-    n_days = len(day_time)
+    n_days = data.n_days
     #print(f'Number of days: {n_days}')
 
-    # Compute distance matrix (DTW distances)
-    distance_matrix = np.zeros((len(day_hr), len(day_hr)))
-    for i in range(len(day_hr)):
-        for j in range(i, len(day_hr)):
-            distance_matrix[i, j] = fastdtw(day_hr[i], day_hr[j])[0]
-            distance_matrix[j, i] = distance_matrix[i, j]
-
-    # Store the average day of each cluster in a dataframe
-    av_profiles = pd.DataFrame()
-
-
-    # COMMON FUNCTIONS
-
-    # Function to apply format to the figures
-    def plot_format(fig_title, fig_name, folder=None, cl=None, k=None):
-
-        if cl is not None:
-            fig_title = f', Cluster {cl}{fig_title}'
-            fig_name = f'_cluster_{cl}{fig_name}'
-
-        # Format for the figure
-        plt.xlabel('Time')
-        plt.ylabel('Heart rate')
-        if folder is None:
-            plt.title(f'{fig_title}')
-        elif k is None:
-            plt.title(f'Isolation Forest{fig_title}')
-        else:
-            plt.title(f'Agglomerative Clustering k={k}{fig_title}')
-        plt.xticks(rotation=45)
-
-        # Format hh:mm
-        plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))  
-        plt.gca().xaxis.set_minor_formatter(mdates.DateFormatter('%H:%M'))  
-
-        plt.ylim(30, 220)
-        plt.grid(True)
-        plt.legend()
-
-        # Verify if the folder exists
-        if folder and not os.path.exists(f'figures/user{user}/{folder}'):
-            os.makedirs(f'figures/user{user}/{folder}')
-        # Save the figure
-        if folder is None:
-            plt.savefig(f'figures/user{user}/{fig_name}.png', bbox_inches='tight')
-        elif k is None:
-            plt.savefig(f'figures/user{user}/{folder}/iso{fig_name}.png', bbox_inches='tight')
-        else:
-            plt.savefig(f'figures/user{user}/{folder}/{k}_agglom{fig_name}.png', bbox_inches='tight')
-        #plt.show()
-        plt.clf()
-        return
-
-    # Function for the anomaly detection of the modules - from clustering results
-    def anom_det_module(k, k_labels, anom_threshold, folder):
-
-        #print(f'Anomaly threshold: {anom_threshold}')
-
-        # PLOT THE CLUSTERING RESULTS -----------------------------------------------------------
-
-        # One figure for each cluster
-        for cluster in np.unique(k_labels):
-
-            # The ids of the arrays of the cluster
-            cluster_ids = np.where(k_labels == cluster)[0]
-
-            # Create the figure
-            plt.figure(figsize=(20, 10))
-            # Plot for each day
-            for day_index in cluster_ids:
-                days = day_time[day_index]
-                # Store the date for each day
-                day = days[0].strftime('%m-%d')
-                # Put a common date for all the days - to make a representation of hh:min
-                times = [dt.replace(year=2000, month=1, day=1) for dt in days]
-
-                plt.plot(times, day_hr[day_index], label=f'{day}', alpha=0.5)    
-            
-            # Create a dataframe with the days of the cluster 
-            df = pd.DataFrame({'Date': [day_time[i] for i in cluster_ids], 'HeartRate': [day_hr[i] for i in cluster_ids]})
-
-            # Calculate the AVERAGE PROFILE of the cluster
-
-            # Expand the values of dates and heartrates to have one sample for each date/hr
-            df_expanded = df.explode(['Date', 'HeartRate'])
-            # Put a common date for all the days - to take into consideration only hh:min
-            df_expanded['Time'] = df_expanded['Date'].apply(lambda x: x.replace(year=2000, month=1, day=1))
-
-            # Calculate an average value of hr for each value of time (each min)
-            average_profile = df_expanded.groupby('Time')['HeartRate'].mean()
-            # Maintain the names of the original columns
-            average_profile = average_profile.reset_index()
-            # Obtain the arrays with the time and hr values
-            average_times = average_profile['Time'].tolist()
-            average_hrs = average_profile['HeartRate'].tolist()
-
-            # Store the average profile variables
-            av_profiles[f'Cluster{cluster}Time'] = average_profile['Time']
-            av_profiles[f'Cluster{cluster}HR'] = average_profile['HeartRate']
-
-            # Plot the average profile (in the same figure)
-            plt.plot(average_times, average_hrs, label='Average profile', linewidth=2, color='black')
-
-            # Apply format to the figure
-            plot_format(fig_title='', fig_name='', folder=folder, cl=cluster, k=k)
-
-        # PLOT THE AVERAGE PROFILES OF ALL CLUSTERS ---------------------------------------------
-        for cluster in np.unique(k_labels):
-            plt.plot(av_profiles[f'Cluster{cluster}Time'], av_profiles[f'Cluster{cluster}HR'], label=f'Cluster {cluster}', alpha=0.5)  
-
-        # Apply format to the figure
-        plot_format(fig_title=', Average Profiles', fig_name='_avg', folder=folder, k=k)
-
-    # Calculate DISTANCES TO CLUSTER --------------------------------------------------------
-
-        # Store distances from each day to its nearest cluster
-        dist_to_cluster = []
-        # Store hrs and times of all days in the clusters order
-        dist_hrs = []
-        dist_times = []
-
-        for cluster in np.unique(k_labels):
-            # The ids of the arrays for the cluster
-            cluster_ids = np.where(k_labels == cluster)[0]
-            # The variables with the days hr and time values
-            cluster_days_hr = [day_hr[i] for i in cluster_ids]
-            cluster_days_time = [day_time[i] for i in cluster_ids]
-            # Heart rate vector of typical day in the cluster
-            typical_day_hr = av_profiles[f'Cluster{cluster}HR'].tolist()
-            # Calculate x most distant days from the typical one - using fastdtw distances
-            dtw_dist = [fastdtw(typical_day_hr, day)[0] for day in cluster_days_hr]
-            # Store the days with their distances in the dataframe
-            dist_to_cluster.extend(dtw_dist)
-            dist_hrs.extend(cluster_days_hr)
-            dist_times.extend(cluster_days_time)
-
-        # PLOT MOST DISTANT DAYS FROM ALL CLUSTERS ----------------------------------------------
-        
-        # Check the values of the distances to select a good anomaly threshold
-        #print([int(x) for x in sorted(dist_to_cluster)])
-
-        # Calculate the ids of the most distant days - using an anomaly threshold
-        # If anomaly threshold is a % of days
-        if anom_threshold < 1:
-            # Number of anomalies - rounded up
-            n_anom = math.ceil(n_days * anom_threshold)
-            most_distant_days_ids = sorted(range(len(dist_to_cluster)), key=lambda i: dist_to_cluster[i], reverse=True)[:n_anom]
-        # If anomaly threshold is max distance allowed
-        else:
-            most_distant_days_ids = [id for id, value in enumerate(dist_to_cluster) if value > anom_threshold]
-
-        # Obtain dates of anomalous days
-        anom_dates = [dist_times[i][0].date() for i in most_distant_days_ids]
-
-        # If a cluster has less than 3 days it can be considered as an anomaly
-        min_days_in_cluster = 2
-        ids = [id for id, label in enumerate(k_labels) if np.bincount(k_labels)[label] <= min_days_in_cluster]
-        anom_dates.extend(day_time[i][0].date() for i in ids)
-
-        # Obtain hr and time values for anomalous days
-        most_distant_days_time = [day for day in day_time if day[0].date() in anom_dates]
-        most_distant_days_hr = [hr for day, hr in zip(day_time, day_hr) if day[0].date() in anom_dates]
-
-        # Print those days (month-day)
-        #print(f"Anomalies: {len(most_distant_days_ids)}")
-        anom_days = [day[0].strftime('%m-%d') for day in most_distant_days_time]
-        #print(anom_days)
-
-        # For each day from the list of most distants
-        for day, hr in zip(most_distant_days_time, most_distant_days_hr):
-            # Adjust the date to be the same in all vectors - only use of hh:min
-            time = [dt.replace(year=2000, month=1, day=1) for dt in day]
-            # Plot most distant days
-            plt.plot(time, hr, label=f"{day[0].strftime('%m-%d')}", alpha=0.5)
-        
-        # Apply format to the figure
-        plot_format(fig_title=', Most Distant Days', fig_name='_most_dist', folder=folder, k=k)
-
-        return anom_days
-        
     #print('\nANOMALY DETECTION SYSTEMS:')
 
-    # -----------------------------------------------------------------------------------------------------------
-    # ANOMALY DETECTION - AGGLOMERATIVE CLUSTERING AND DTW DISTANCES --------------------------------------------
-    ## USING HEART RATE
-
-    # Function to detect anomalies with clustering by heart rate data
-    def anom_det_hr(k, anom_threshold):
-        
-        # CLUSTERING using Agglomerative Clustering ---------------------------------------------
-        
-        # Clustering with heart rate distance matrix
-        def cluster_dst_mtx():
-            # For introducing distance matrix - affinity='precomputed'
-            clustering = AgglomerativeClustering(n_clusters=k, affinity='precomputed', linkage='ward')
-            k_labels = clustering.fit_predict(distance_matrix)
-            #print('Features used: HeartRate (distance matrix)')
-            return k_labels
-
-        # Clustering with heart rate vectors
-        def cluster_hr_vectors():
-            clustering = AgglomerativeClustering(n_clusters=k, linkage='ward')
-            X = np.array(day_hr)
-            k_labels = clustering.fit_predict(X)
-            #print('\nFeatures used: HeartRate (vectors)')
-            return k_labels
-        
-        # Clustering with all statistics of heart rate (including medical ones)
-        def cluster_all_stats():
-            clustering = AgglomerativeClustering(n_clusters=k, linkage='ward')
-            X = data[['Max', 'Min', 'Mean', 'Median', 'Std_dev', 'RMSSD', 'pNN50']]
-            X = np.array(X)
-            k_labels = clustering.fit_predict(X)
-            #print('\nFeatures used: HeartRate (Max, Min, Mean, Median, Std_dev, RMSSD, pNN50)')
-            return k_labels
-
-        # ANOMALY DETECTION from clustering results  --------------------------------------------
-        k_labels_1 = cluster_hr_vectors()
-        anom_days_1 = anom_det_module(k, k_labels_1, anom_threshold, '1_hr_vec')
-
-        k_labels_2 = cluster_all_stats()
-        anom_days_2 = anom_det_module(k, k_labels_2, anom_threshold, '2_hr_stats')
-
-        return anom_days_1, anom_days_2
-
-    # Clustering with k = 3, 10% of anomalies
-    anom_days_hr_1, anom_days_hr_2 = anom_det_hr(k=4, anom_threshold=0.1)
-
-    # -----------------------------------------------------------------------------------------------------------
-    ## USING INTENSITIES ----------------------------------------------------------------------------------------
-
-    # Function to detect anomalies with clustering by intensity data
-    def anom_det_int(k, anom_threshold):
-        
-        # CLUSTERING using Agglomerative Clustering ---------------------------------------------
-
-        # Clustering with intensity vectors
-        def cluster_int_vectors():
-            clustering = AgglomerativeClustering(n_clusters=k, linkage='ward')
-            X = np.array(day_int)
-            k_labels = clustering.fit_predict(X)
-            #print('\nFeatures used: Intensity (vectors)')
-            return k_labels
-        k_labels = cluster_int_vectors()
-
-        # ANOMALY DETECTION from clustering results  --------------------------------------------
-        anom_days = anom_det_module(k, k_labels, anom_threshold, '3_int')
-
-        return anom_days
-        
-    # Clustering with k = 3
-    anom_days_int = anom_det_int(k=4, anom_threshold=0.1)
-
-    # -----------------------------------------------------------------------------------------------------------
-    ## USING STEPS ----------------------------------------------------------------------------------------------
-
-    # Function to detect anomalies with clustering by steps data
-    def anom_det_steps(k, anom_threshold):
-        
-        # CLUSTERING using Agglomerative Clustering ---------------------------------------------
-
-        # Clustering with steps vectors
-        def cluster_step_vectors():
-            clustering = AgglomerativeClustering(n_clusters=k, linkage='ward')
-            X = np.array(day_steps)
-            k_labels = clustering.fit_predict(X)
-            #print('\nFeatures used: Steps (vectors)')
-            return k_labels
-        k_labels = cluster_step_vectors()
-
-        # ANOMALY DETECTION from clustering results  --------------------------------------------
-        anom_days = anom_det_module(k, k_labels, anom_threshold, '4_steps')
-
-        return anom_days
-        
-    # Clustering with k = 3
-    anom_days_steps = anom_det_steps(k=5, anom_threshold=0.1)
-
-    # -----------------------------------------------------------------------------------------------------------
-    ## USING HEART RATE / STEPS ---------------------------------------------------------------------------------
-
-    # Function to detect anomalies with clustering by steps data
-    def anom_det_hr_steps(k, anom_threshold):
-        
-        # CLUSTERING using Agglomerative Clustering ---------------------------------------------
-
-        # Clustering with steps vectors
-        def cluster_hr_step_vectors():
-            day_hr_steps = [ [hr / step if step != 0 else hr for hr, step in zip(hrs, steps)]
-                            for hrs, steps in zip(day_hr, day_steps) ]
-            clustering = AgglomerativeClustering(n_clusters=k, linkage='ward')
-            X = np.array(day_hr_steps)
-            k_labels = clustering.fit_predict(X)
-            #print('\nFeatures used: HeartRate/Steps (vectors)')
-            return k_labels
-        k_labels = cluster_hr_step_vectors()
-
-        # ANOMALY DETECTION from clustering results  --------------------------------------------
-        anom_days = anom_det_module(k, k_labels, anom_threshold, '5_hr_steps')
-
-        return anom_days
-        
-    # Clustering with k = 3
-    anom_days_hr_steps = anom_det_hr_steps(k=3, anom_threshold=0.1)
-
-
-    # -----------------------------------------------------------------------------------------------------------
-    # VOTING SYSTEM ---------------------------------------------------------------------------------------------
-
-    # As we have different methods, we have to get the best results considering all
-
-    def voting(anom_days_1, anom_days_2, anom_days_3, anom_days_4, anom_days_5):
-        #print('\nVOTING SYSTEM')
-        # Combine the lists with all the possible anomalous days
-        poss_anom_days = anom_days_1 + anom_days_2 + anom_days_3 + anom_days_4 + anom_days_5
-        # Count the frequency of each day
-        day_counts = Counter(poss_anom_days)
-        # Consider as anomaly if a day appears at least 3 times (majority)
-        anom_days = sorted([day for day, count in day_counts.items() if count >= 3])
-        #print(f'\nAnomalies found:\n{anom_days}')
-        return anom_days
-
-    anom_days = voting(anom_days_hr_1, anom_days_hr_2, anom_days_int, anom_days_steps, anom_days_hr_steps)
-
-    # Create a figure with the anomalies
-    def plot_anomalies(anom_days):
-        hr_anom = [hr for day, hr in zip(day_time, day_hr) if day[0].strftime('%m-%d') in anom_days]
-        time_anom = [day for day in day_time if day[0].strftime('%m-%d') in anom_days]
-        # Create the figure
-        #plt.figure(figsize=(20, 10))
-        for day, hr in zip(time_anom, hr_anom):
-            # Adjust the date to be the same in all vectors - only use of hh:min
-            time = [dt.replace(year=2000, month=1, day=1) for dt in day]
-            # Plot most distant days
-            plt.plot(time, hr, label=f"{day[0].strftime('%m-%d')}", alpha=0.5)
-        # Apply format to the figure
-        plot_format(fig_title='Anomalous Days', fig_name='_anom_days')
-
-    plot_anomalies(anom_days)
-
-    # Create a figure with the anomalies of all modules
-    def plot_all_anomalies(anom_days, anom_days_hr_1, anom_days_hr_2, anom_days_int, anom_days_steps, anom_days_hr_steps):
-
-        # Create a list with all the anomalies dates
-        all_anom_days = set(anom_days + anom_days_hr_1 + anom_days_hr_2 + anom_days_int + anom_days_steps + 
-                            anom_days_hr_steps)
-        # Get the unique dates and sort them
-        all_dates = sorted(set(day[0].replace(year=2000, hour=0, minute=0, second=0) for day in day_time 
-                            if day[0].strftime('%m-%d') in all_anom_days))    
-
-        # Final system
-        days_anom = [day[0] for day in day_time if day[0].strftime('%m-%d') in anom_days]
-        dates = [day.replace(year=2000, hour=0, minute=0, second=0) for day in days_anom]
-        plt.scatter(dates, np.zeros(len(dates)), s=100, color='firebrick')
-        # Module 1: hr vectors
-        days_anom = [day[0] for day in day_time if day[0].strftime('%m-%d') in anom_days_hr_1]
-        dates = [day.replace(year=2000, hour=0, minute=0, second=0) for day in days_anom]
-        plt.scatter(dates, np.ones(len(anom_days_hr_1)), s=100, color='tomato')
-        # Module 2: hr stats
-        days_anom = [day[0] for day in day_time if day[0].strftime('%m-%d') in anom_days_hr_2]
-        dates = [day.replace(year=2000, hour=0, minute=0, second=0) for day in days_anom]
-        plt.scatter(dates, np.full(len(anom_days_hr_2), 2), s=100, color='tomato')
-        # Module 3: int vectors
-        days_anom = [day[0] for day in day_time if day[0].strftime('%m-%d') in anom_days_int]
-        dates = [day.replace(year=2000, hour=0, minute=0, second=0) for day in days_anom]
-        plt.scatter(dates, np.full(len(anom_days_int), 3), s=100, color='tomato')
-        # Module 4: steps vectors
-        days_anom = [day[0] for day in day_time if day[0].strftime('%m-%d') in anom_days_steps]
-        dates = [day.replace(year=2000, hour=0, minute=0, second=0) for day in days_anom]
-        plt.scatter(dates, np.full(len(anom_days_steps), 4), s=100, color='tomato')
-        # Module 5: hr/steps vectors
-        days_anom = [day[0] for day in day_time if day[0].strftime('%m-%d') in anom_days_hr_steps]
-        dates = [day.replace(year=2000, hour=0, minute=0, second=0) for day in days_anom]
-        plt.scatter(dates, np.full(len(anom_days_hr_steps), 5), s=100, color='tomato')
-
-        # Apply format to the figure
-        plt.xlabel('Days')
-        plt.title('Anomalous Days')
-        plt.xticks(rotation=45)
-        # Format mm-dd
-        plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%m-%d'))
-        plt.gca().xaxis.set_minor_formatter(mdates.DateFormatter('%m-%d'))
-        # Set the ticks for each unique date with its value
-        plt.gca().set_xticks(all_dates)
-        plt.gca().set_xticklabels([date.strftime('%m-%d') for date in all_dates])
-
-        plt.gca().invert_yaxis()
-        # Establecer etiquetas descriptivas en el eje y
-        y_labels = ['FINAL SYSTEM', 'Module 1: HR vectors', 'Module 2: HR statistics', 'Module 3: INT vectors', 
-                    'Module 4: STEPS vectors', 'Module 5: HR/STEPS vectors']
-        plt.yticks(range(len(y_labels)), y_labels)
-
-        plt.grid(True)
-        plt.savefig(f'figures/user{user}/_all_anom_days.png', bbox_inches='tight')
-        plt.clf()
-
-    plot_all_anomalies(anom_days, anom_days_hr_1, anom_days_hr_2, anom_days_int, anom_days_steps, anom_days_hr_steps)
-
-    #print()
-
-    # Return anomalies in JSON format
-    anom_days_json = json.dumps(anom_days)
-    return anom_days_json
+    # Each module is an independent task (executed in parallel) - the results are joined in the voting system
+    modules = run_modules(modules, inputs, n_jobs)
+    # Time of each module (also in the result of the module)
+    for module in modules:
+        report_stage('module', folder=module['folder'], wall=module['time'])
+
+    # Voting system with the results of all the modules
+    with stage('voting', modules=len(modules)) as record:
+        anom_days = voting(modules, parameters)
+        record['anom_days'] = len(anom_days)
+
+    # Result object (anomalies and results of each module)
+    return {'day_time': day_time, 'day_hr': np.array(day_hr), 'modules': modules, 'anom_days': anom_days}
+
+
+# -----------------------------------------------------------------------------------------------------------------
+# COMMON FUNCTIONS OF THE MODULES ---------------------------------------------------------------------------------
+
+# Average day of each cluster - mean heart rate of each minute of the day (one row for each cluster and one column
+# for each minute, NaN in the minutes without samples in the cluster), all the clusters at once
+def average_profiles(day_hr, day_minutes, k_labels):
+    n_clusters = k_labels.max() + 1
+    ids = (k_labels[:, None] * (24 * 60) + day_minutes).ravel()
+    sums = np.bincount(ids, weights=np.asarray(day_hr, dtype=float).ravel(), minlength=n_clusters * 24 * 60)
+    counts = np.bincount(ids, minlength=n_clusters * 24 * 60)
+    with np.errstate(invalid='ignore'):
+        return (sums / counts).reshape(n_clusters, 24 * 60)
+
+# Function for the anomaly detection of the modules - from clustering results
+# Returns the average profiles of the clusters, the anomalous days (month-day) and the distance to the profile from
+# which a day is an anomaly (used by the online detection)
+# resolution: minutes of each value of the heart rate vectors compared with DTW (the profiles are always by minute)
+def anom_det_module(inputs, k_labels, anom_threshold, parameters, resolution=1):
+
+    #print(f'Anomaly threshold: {anom_threshold}')
+
+    day_hr = inputs['hr']
+    n_days = len(day_hr)
+    # Date of each day (month-day) and minute of the day of each sample (0 to 1439)
+    day_dates = day_labels(inputs['start'])
+    day_minutes = (np.asarray(inputs['start'])[:, None] + np.arange(day_hr.shape[1])) % (24 * 60)
+
+    # Calculate the AVERAGE PROFILE of each cluster (indexed by the minute of the day)
+    profiles = average_profiles(day_hr, day_minutes, k_labels)
+
+# Calculate DISTANCES TO CLUSTER --------------------------------------------------------
+
+    # Heart rate vector of the typical day of each cluster (only the minutes with samples)
+    typical_days_hr = {cluster: profiles[cluster][~np.isnan(profiles[cluster])] for cluster in np.unique(k_labels)}
+    # Heart rate vectors of the days with the resolution of the module
+    if resolution > 1:
+        day_hr = inputs[resolution_key('hr', resolution)]
+
+    # MOST DISTANT DAYS FROM ALL CLUSTERS ---------------------------------------------------
+
+    # Calculate the ids of the most distant days - using an anomaly threshold
+    # Distance from each day to the typical day of its cluster - with a fixed threshold only the distances needed for
+    # the threshold are calculated exactly (the rest are bounds of the distance)
+    # If anomaly threshold is a % of days
+    if anom_threshold < 1:
+        # Number of anomalies - rounded up
+        n_anom = math.ceil(n_days * anom_threshold)
+        dist_to_cluster = score_days(typical_days_hr, k_labels, day_hr, resolution, parameters)
+        # The learned threshold is halfway between the least distance of the n_anom most distant days and the next
+        # distance (with ties between them fewer days are over the threshold, never more than n_anom)
+        sorted_distances = np.sort(dist_to_cluster)[::-1]
+        next_distance = sorted_distances[n_anom] if n_anom < n_days else 0
+        distance_threshold = (sorted_distances[n_anom - 1] + next_distance) / 2 if n_anom else np.inf
+    # If anomaly threshold is max distance allowed
+    else:
+        dist_to_cluster = score_days(typical_days_hr, k_labels, day_hr, resolution, parameters, threshold=anom_threshold)
+        distance_threshold = anom_threshold
+
+    # Check the values of the distances to select a good anomaly threshold
+    #print([int(x) for x in sorted(dist_to_cluster)])
+
+    # Obtain ids of anomalous days (the most distant days and the days of the small clusters)
+    anom_ids = set(module_anomalies(dist_to_cluster, distance_threshold, np.bincount(k_labels)[k_labels],
+                                    parameters).tolist())
+
+    # Print those days (month-day)
+    #print(f"Anomalies: {len(most_distant_days_ids)}")
+    anom_days = [day_dates[i] for i in range(n_days) if i in anom_ids]
+    #print(anom_days)
+
+    return profiles, anom_days, float(distance_threshold)
+
+# Key of the result of the anomaly detection: hash of the dataset, the parameters and the modules (the cache and the
+# figures of the result are identified by it)
+def result_key(data, modules):
+    return cache_key(data, dict(parameters, modules=modules, version=results_version))
+
+# Decision rule of the modules: a day is an anomaly when its distance to the typical day of its cluster is greater
+# than the threshold (fixed or learned) or when its cluster has min_days_in_cluster days or less
+# cluster_sizes: number of days of the cluster of each day
+def module_anomalies(distances, distance_threshold, cluster_sizes, parameters):
+    over = distances > distance_threshold
+    return np.flatnonzero(over | (np.asarray(cluster_sizes) <= parameters['min_days_in_cluster']))
+
+# Anomaly threshold of a module (the one of the parameters if the module has not its own)
+def module_threshold(module, parameters):
+    return parameters['anom_threshold'] if module['threshold'] is None else module['threshold']
+
+# DTW distances from the days to the typical day of their cluster (heart rate of the minutes with samples), with the
+# days at a resolution of several minutes (the typical days are aggregated in the same way)
+# The distances are multiplied by the resolution: the same scale as the distances by minute (the thresholds learned
+# with a resolution can be compared with the distances of the online detection, approximately)
+def score_days(typical_days_hr, k_labels, day_hr, resolution, parameters, threshold=None):
+    if resolution > 1:
+        typical_days_hr = {cluster: multi_resolution(profile[None, :], [resolution])[resolution][0]
+                           for cluster, profile in typical_days_hr.items()}
+        threshold = None if threshold is None else threshold / resolution
+    # DTW distances with a Sakoe-Chiba band (by default 10% of the day, the same as the distance matrix)
+    window = None if parameters['dtw_band'] is None else max(1, int(day_hr.shape[1] * parameters['dtw_band']))
+    return distances_to_profiles(typical_days_hr, k_labels, day_hr, window, threshold=threshold) * resolution
+
+# CLUSTERING ------------------------------------------------------------------------------------------------------
+
+# Agglomerative Clustering (ward) with the vectors of features of the days - O(n^2) memory in the number of days
+def cluster_vectors(X, k):
+    clustering = AgglomerativeClustering(n_clusters=k, linkage='ward')
+    k_labels = clustering.fit_predict(X)
+    return k_labels
+
+# Clustering with the distance matrix of the vectors (DTW distances with a Sakoe-Chiba band of 10% of the day)
+def cluster_dst_mtx(X, k):
+    window = max(1, len(X[0]) // 10)
+    # Ward needs euclidean distances - with the condensed DTW matrix we use average linkage
+    Z = linkage(distance_matrix(X, window=window), method='average')
+    k_labels = fcluster(Z, t=k, criterion='maxclust') - 1
+    return k_labels
+
+# Mini-batch k-means with the vectors of features of the days - linear in the number of days (for long histories)
+def cluster_minibatch_kmeans(X, k):
+    clustering = MiniBatchKMeans(n_clusters=k, batch_size=1024, n_init=3, random_state=0)
+    k_labels = clustering.fit_predict(X)
+    return k_labels
+
+# BIRCH with the vectors of features of the days - the days are summarized in a CF-tree and its subclusters are joined
+# with Agglomerative Clustering (the radius of the subclusters is a fraction of the mean distance to the mean day)
+def cluster_birch(X, k):
+    X = np.asarray(X, dtype=float)
+    threshold = 0.25 * np.sqrt(((X - X.mean(axis=0)) ** 2).sum(axis=1)).mean()
+    clustering = Birch(n_clusters=AgglomerativeClustering(n_clusters=min(k, len(X)), linkage='ward'),
+                       threshold=max(threshold, 1e-6))
+    k_labels = clustering.fit_predict(X)
+    return k_labels
+
+# Clustering methods available for the modules
+clustering_methods = {'ward': cluster_vectors, 'dtw': cluster_dst_mtx, 'minibatch_kmeans': cluster_minibatch_kmeans,
+                      'birch': cluster_birch}
+
+# DIMENSIONALITY REDUCTION (optional, before the clustering) ------------------------------------------------------
+
+# Each method returns the reduced vectors and its fitted state (None if the method has no state), and it reduces other
+# vectors in the same way with that state (e.g. the new days scored with a model)
+
+# Piecewise Aggregate Approximation: mean of each of the dims segments of the vectors
+def reduce_paa(X, dims, state=None):
+    X = np.asarray(X, dtype=float)
+    bounds = np.linspace(0, X.shape[1], min(dims, X.shape[1]) + 1).astype(int)
+    return np.add.reduceat(X, bounds[:-1], axis=1) / np.diff(bounds), None
+
+# Principal Component Analysis: projection of the vectors on their first dims components
+def reduce_pca(X, dims, state=None):
+    X = np.asarray(X, dtype=float)
+    if state is not None:
+        return state.transform(X), state
+    pca = PCA(n_components=min(dims, *X.shape), random_state=0)
+    return pca.fit_transform(X), pca
+
+# Symbolic Aggregate approXimation: PAA of the vectors normalized (mean 0 and std 1 for each day) and each segment
+# replaced by its symbol (0 to sax_alphabet - 1, the breakpoints split the normal distribution in equiprobable parts)
+sax_alphabet = 8
+
+def reduce_sax(X, dims, state=None):
+    X = np.asarray(X, dtype=float)
+    std = X.std(axis=1, keepdims=True)
+    X = (X - X.mean(axis=1, keepdims=True)) / np.where(std > 0, std, 1)
+    breakpoints = norm.ppf(np.arange(1, sax_alphabet) / sax_alphabet)
+    return np.searchsorted(breakpoints, reduce_paa(X, dims)[0]).astype(float), None
+
+# Reduction methods available for the modules
+reduction_methods = {'paa': reduce_paa, 'pca': reduce_pca, 'sax': reduce_sax}
+
+# FEATURES OF THE MODULES -----------------------------------------------------------------------------------------
+
+# Heart rate vectors
+def features_hr(inputs):
+    #print('\nFeatures used: HeartRate (vectors)')
+    return np.array(inputs['hr'])
+
+# All statistics of heart rate (including medical ones)
+def features_hr_stats(inputs):
+    #print('\nFeatures used: HeartRate (Max, Min, Mean, Median, Std_dev, RMSSD, pNN50)')
+    return np.column_stack([inputs['stats'][name] for name in ['Max', 'Min', 'Mean', 'Median', 'Std_dev', 'RMSSD', 'pNN50']])
+
+# Intensity vectors
+def features_int(inputs):
+    #print('\nFeatures used: Intensity (vectors)')
+    return np.array(inputs['int'])
+
+# Steps vectors
+def features_steps(inputs):
+    #print('\nFeatures used: Steps (vectors)')
+    return np.array(inputs['steps'])
+
+# Heart rate / steps vectors (the heart rate when there are no steps)
+def features_hr_steps(inputs):
+    #print('\nFeatures used: HeartRate/Steps (vectors)')
+    day_hr = np.asarray(inputs['hr'], dtype=float)
+    day_steps = np.asarray(inputs['steps'], dtype=float)
+    return np.where(day_steps != 0, day_hr / np.where(day_steps != 0, day_steps, 1), day_hr)
+
+# Sources of features available for the modules: function that obtains the features and arrays of the dataset that
+# it needs (the functions must be defined at module level to be executed in the processes of the modules)
+feature_sources = {
+    'hr': (features_hr, ['hr']),
+    'hr_stats': (features_hr_stats, ['stats']),
+    'int': (features_int, ['int']),
+    'steps': (features_steps, ['steps']),
+    'hr_steps': (features_hr_steps, ['hr', 'steps']),
+}
+
+# MULTI-RESOLUTION VECTORS ----------------------------------------------------------------------------------------
+
+# The vectors by minute (heart rate, intensity, steps and heart rate / steps) can be used by a module with a lower
+# resolution: mean of each block of consecutive minutes (e.g. 5, 15 or 60 minutes). The clustering and the DTW
+# distances of the module are computed with the blocks (the cost of the DTW is quadratic in the length of the vectors)
+# All the resolutions needed by the modules are computed before executing them, in one pass for each source
+
+# Sources of features that are vectors by minute
+series_sources = ['hr', 'int', 'steps', 'hr_steps']
+
+# Name of the array of a source with a resolution (e.g. hr_15m)
+def resolution_key(name, resolution):
+    return f'{name}_{resolution}m'
+
+# Mean of the blocks of consecutive minutes of the vectors for each resolution (the last block can be shorter) - all
+# the resolutions from one cumulative sum of the vectors
+def multi_resolution(X, resolutions):
+    X = np.asarray(X, dtype=float)
+    n = X.shape[1]
+    cumsum = np.zeros((len(X), n + 1))
+    np.cumsum(X, axis=1, out=cumsum[:, 1:])
+    vectors = {}
+    for resolution in resolutions:
+        bounds = np.append(np.arange(0, n, resolution), n)
+        vectors[resolution] = X if resolution == 1 else (cumsum[:, bounds[1:]] - cumsum[:, bounds[:-1]]) / np.diff(bounds)
+    return vectors
+
+# Arrays with the resolutions needed by the modules (the heart rate of the DTW distances and the features of the
+# modules that are vectors by minute)
+def resolution_inputs(inputs, modules):
+    needed = {}
+    for module in modules:
+        if module['resolution'] > 1:
+            needed.setdefault('hr', set()).add(module['resolution'])
+            if module['features'] in series_sources:
+                needed.setdefault(module['features'], set()).add(module['resolution'])
+    arrays = {}
+    for name, resolutions in needed.items():
+        features, _ = feature_sources[name]
+        for resolution, X in multi_resolution(features(inputs), sorted(resolutions)).items():
+            arrays[resolution_key(name, resolution)] = X
+    return arrays
+
+# Features of the days for a module (with its resolution, if the features are vectors by minute)
+def module_features(module, inputs):
+    if module['resolution'] > 1 and module['features'] in series_sources:
+        key = resolution_key(module['features'], module['resolution'])
+        if key in inputs:
+            return np.array(inputs[key])
+        features, _ = feature_sources[module['features']]
+        return multi_resolution(features(inputs), [module['resolution']])[module['resolution']]
+    features, _ = feature_sources[module['features']]
+    return features(inputs)
+
+# Features of the days clustered by a module (with its reduction) and the state of the reduction
+# state: state of the reduction fitted with other days (the days are reduced in the same way)
+def reduced_features(module, inputs, state=None):
+    X = np.asarray(module_features(module, inputs), dtype=float)
+    if module.get('reduction') is None:
+        return X, None
+    return reduction_methods[module['reduction']](X, module['dims'], state)
+
+# REGISTRY OF MODULES ---------------------------------------------------------------------------------------------
+
+# Each module declares the folder and title of its figures, its source of features, its reduction of the features
+# (method and number of dimensions, None for the features without reduction), its clustering method, its number of
+# clusters, its anomaly threshold (None for the one of the parameters), its weight in the voting system, if it is
+# executed and its resolution (minutes of each value of the vectors clustered and compared with DTW)
+modules_registry = [
+    {'folder': '1_hr_vec', 'title': 'HR vectors', 'features': 'hr', 'reduction': None, 'dims': None,
+     'clustering': 'ward', 'k': 4, 'threshold': None, 'weight': 1, 'enabled': True, 'resolution': 1},
+    {'folder': '2_hr_stats', 'title': 'HR statistics', 'features': 'hr_stats', 'reduction': None, 'dims': None,
+     'clustering': 'ward', 'k': 4, 'threshold': None, 'weight': 1, 'enabled': True, 'resolution': 1},
+    {'folder': '3_int', 'title': 'INT vectors', 'features': 'int', 'reduction': None, 'dims': None,
+     'clustering': 'ward', 'k': 4, 'threshold': None, 'weight': 1, 'enabled': True, 'resolution': 1},
+    {'folder': '4_steps', 'title': 'STEPS vectors', 'features': 'steps', 'reduction': None, 'dims': None,
+     'clustering': 'ward', 'k': 5, 'threshold': None, 'weight': 1, 'enabled': True, 'resolution': 1},
+    {'folder': '5_hr_steps', 'title': 'HR/STEPS vectors', 'features': 'hr_steps', 'reduction': None, 'dims': None,
+     'clustering': 'ward', 'k': 3, 'threshold': None, 'weight': 1, 'enabled': True, 'resolution': 1},
+]
+
+# Add a module to the registry (or replace the module with the same folder)
+def register_module(folder, title, features, clustering='ward', k=4, threshold=None, weight=1, enabled=True,
+                    reduction=None, dims=None, resolution=1):
+    if features not in feature_sources:
+        raise ValueError(f'Unknown source of features: {features}')
+    if reduction is not None and (reduction not in reduction_methods or not dims):
+        raise ValueError(f'Unknown reduction method or number of dimensions: {reduction} {dims}')
+    if clustering not in clustering_methods:
+        raise ValueError(f'Unknown clustering method: {clustering}')
+    if int(resolution) != resolution or resolution < 1:
+        raise ValueError(f'The resolution must be a number of minutes: {resolution}')
+    module = {'folder': folder, 'title': title, 'features': features, 'reduction': reduction, 'dims': dims,
+              'clustering': clustering, 'k': k, 'threshold': threshold, 'weight': weight, 'enabled': enabled,
+              'resolution': int(resolution)}
+    for i, registered in enumerate(modules_registry):
+        if registered['folder'] == folder:
+            modules_registry[i] = module
+            return
+    modules_registry.append(module)
+
+# Turn a module on or off (the modules turned off are not executed)
+def enable_module(folder, enabled=True):
+    for module in modules_registry:
+        if module['folder'] == folder:
+            module['enabled'] = enabled
+            return
+    raise ValueError(f'Unknown module: {folder}')
+
+# Modules executed by the system
+def enabled_modules():
+    return [dict(module) for module in modules_registry if module['enabled']]
+
+# Execute one module - clustering and anomaly detection (results used by the voting system and the figures)
+def run_module(module, inputs, parameters):
+    start = time.perf_counter()
+    mark = stage_marks('module', folder=module['folder'])
+    X, _ = reduced_features(module, inputs)
+    mark('features', days=len(X), dims=X.shape[1] if X.ndim > 1 else 1)
+    k_labels = clustering_methods[module['clustering']](X, module['k'])
+    mark('clustering', days=len(X), k=module['k'], method=module['clustering'])
+    anom_threshold = module_threshold(module, parameters)
+    profiles, anom_days, distance_threshold = anom_det_module(inputs, k_labels, anom_threshold, parameters,
+                                                              module['resolution'])
+    mark('scoring', days=len(k_labels), anom_days=len(anom_days))
+    return {'folder': module['folder'], 'title': module['title'], 'k': module['k'], 'weight': module['weight'],
+            'labels': k_labels, 'profiles': profiles, 'anom_days': anom_days, 'distance_threshold': distance_threshold,
+            'time': round(time.perf_counter() - start, 3)}
+
+# Arrays of the dataset that a module needs (read only) - the heart rate and the start of the days are always needed
+# for the distances to the average profiles (and the vectors with the resolution of the module)
+def module_inputs(module):
+    if module['resolution'] > 1:
+        names = ['hr', 'start', resolution_key('hr', module['resolution'])]
+        if module['features'] in series_sources:
+            return sorted(set(names + [resolution_key(module['features'], module['resolution'])]))
+        return sorted(set(names + feature_sources[module['features']][1]))
+    return sorted(set(['hr', 'start'] + feature_sources[module['features']][1]))
+
+# VOTING SYSTEM ---------------------------------------------------------------------------------------------------
+
+# As we have different methods, we have to get the best results considering all
+# quorum: number of modules that detect a day, weighted: sum of the weights of the modules that detect a day
+# A day is an anomaly if it has at least min_votes (if min_votes < 1, fraction of the modules or of the total weight)
+def voting(modules, parameters):
+    #print('\nVOTING SYSTEM')
+    weighted = parameters['voting'] == 'weighted'
+    day_votes = Counter()
+    for module in modules:
+        for day in module['anom_days']:
+            day_votes[day] += module['weight'] if weighted else 1
+    min_votes = parameters['min_votes']
+    if min_votes < 1:
+        min_votes *= sum(module['weight'] for module in modules) if weighted else len(modules)
+    anom_days = sorted([day for day, votes in day_votes.items() if votes >= min_votes])
+    #print(f'\nAnomalies found:\n{anom_days}')
+    return anom_days
+
+# PARALLEL EXECUTION OF THE MODULES -------------------------------------------------------------------------------
+
+# Copy the arrays to shared memory blocks (the processes of the modules use them without copying them)
+def share_arrays(arrays):
+    blocks = []
+    descriptors = {}
+    for name, values in arrays.items():
+        values = np.ascontiguousarray(values)
+        block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)[...] = values
+        blocks.append(block)
+        descriptors[name] = (block.name, values.shape, np.lib.format.dtype_to_descr(values.dtype))
+    return blocks, descriptors
+
+# Execute one module in a process of the pool - with the arrays of the shared memory blocks
+def run_module_shared(module, descriptors, parameters):
+    blocks = []
+    inputs = {}
+    for name in module_inputs(module):
+        block_name, shape, descr = descriptors[name]
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        inputs[name] = np.ndarray(shape, dtype=np.lib.format.descr_to_dtype(descr), buffer=block.buf)
+    try:
+        return run_module(module, inputs, parameters)
+    finally:
+        # The arrays have to be released before closing the blocks
+        inputs.clear()
+        for block in blocks:
+            block.close()
+
+# Pool of processes of the modules (created once and used by all the executions)
+executor = {'pool': None, 'workers': 0}
+
+def get_executor(n_workers):
+    if executor['pool'] is None or executor['workers'] != n_workers:
+        if executor['pool'] is not None:
+            executor['pool'].shutdown()
+        executor['pool'] = ProcessPoolExecutor(max_workers=n_workers)
+        executor['workers'] = n_workers
+    return executor['pool']
+
+# Execute the modules (in parallel if there are several cpus) - results in the same order as the modules
+def run_modules(modules, inputs, n_jobs=None):
+
+    # Number of processes (all the cpus by default)
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    n_jobs = min(n_jobs, len(modules))
+    if n_jobs <= 1:
+        return [run_module(module, inputs, parameters) for module in modules]
+
+    # Only the arrays used by some module are shared
+    names = sorted(set(name for module in modules for name in module_inputs(module)))
+    blocks, descriptors = share_arrays({name: inputs[name] for name in names})
+    try:
+        pool = get_executor(n_jobs)
+        futures = [pool.submit(run_module_shared, module, descriptors, parameters) for module in modules]
+        return [future.result() for future in futures]
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
 
 # AVAILABLE USERS
 
@@ -450,7 +557,7 @@ users = [2022484408, 2026352035, 2347167796, 4020332650, 4388161847, 4558609924,
 
 # MAIN FUNCTION
 
-def main(user, show_output):
+def main(user, show_output, plots):
 
     # Change standard output:
     # Store the standard output
@@ -460,7 +567,7 @@ def main(user, show_output):
         sys.stdout = open(os.devnull, 'w')
 
     # Call preprocess function with the parameters user and data files
-    anom_days_json = anom_det(user)
+    anom_days_json = anom_det(user, plots=plots)
 
     # Restore standard output
     sys.stdout = original_stdout
@@ -478,12 +585,17 @@ if __name__ == '__main__':
         show_output_input = sys.argv[2].lower() == "true"
         show_output = show_output_input
         if show_output_input: show_output = show_output_input
+    # plots is predefined as False (only the results are computed, the figures are rendered on demand)
+    plots = False
+    # Verify if there is an argument for plots
+    if len(sys.argv) > 3:
+        plots = sys.argv[3].lower() == "true"
     # Verify if there is an argument for the user
     if len(sys.argv) > 1:
         # Convert the argument to type int
         user = int(sys.argv[1])
         # Verify if the user id is valid
-        if user in users: main(user, show_output)
+        if user in users: main(user, show_output, plots)
         else: print("The user argument provided is not valid.")
     else:
         print("No user argument was provided.")
@@ -1,17 +1,66 @@
 const express = require('express');
 const path = require('path');
+const fs = require('fs');
+const readline = require('readline');
 const cors = require('cors');
-const { exec, spawn } = require('child_process');
-const { promisify } = require('util');
+const { spawn } = require('child_process');
 const app = express();
 const port = 3003;
 
-// Promisify exec to use with async/await
-const execPromise = promisify(exec);
-
 // Base of the paths of the python scripts
 const basePath = 'c:/Users/eleju/Desktop/TFM/';
 
+// PYTHON WORKER: one process that keeps the libraries and the data in memory
+// Each request is a line of JSON in its input and each response a line of JSON in its output
+let worker = null;
+let nextId = 1;
+const pending = new Map();
+
+// Start the worker (again if it has stopped)
+function startWorker() {
+  worker = spawn('python', [`${basePath}worker.py`]);
+  readline.createInterface({ input: worker.stdout }).on('line', (line) => {
+    let response;
+    try {
+      response = JSON.parse(line);
+    } catch (parseError) {
+      console.error(`Parse Error: ${parseError.message}`);
+      return;
+    }
+    const request = pending.get(response.id);
+    if (!request) return;
+    pending.delete(response.id);
+    clearTimeout(request.timer);
+    if (response.error) request.reject(new Error(response.error));
+    else request.resolve(response.result);
+  });
+  worker.stderr.on('data', (data) => console.error(`Stderr: ${data}`));
+  worker.on('exit', (code) => {
+    console.error(`Python worker stopped (code ${code})`);
+    worker = null;
+    // The requests without response fail
+    for (const request of pending.values()) {
+      clearTimeout(request.timer);
+      request.reject(new Error('The python worker stopped.'));
+    }
+    pending.clear();
+  });
+}
+
+// Call an operation of the worker and wait for the result
+function callWorker(method, params, timeout = 600000) { // timeout of 10min (600000 ms = 10 min)
+  if (!worker) startWorker();
+  const id = nextId++;
+  return new Promise((resolve, reject) => {
+    const timer = setTimeout(() => {
+      pending.delete(id);
+      reject(new Error(`Timeout of the method ${method}`));
+    }, timeout);
+    pending.set(id, { resolve, reject, timer });
+    worker.stdin.write(JSON.stringify({ id, method, params }) + '\n');
+  });
+}
+
 // Use the CORS middleware
 app.use(cors({
   origin: 'http://localhost:3000' // Only allow requests from http://localhost:3000
@@ -20,13 +69,28 @@ app.use(cors({
 // Define the directory for serving images
 const imageDirectory = path.join(__dirname, 'figures');
 
+// Render the figures on demand (the python scripts only compute the results)
+app.use('/figures', async (req, res, next) => {
+  // Path of the figure: /user{userId}/{figure}.png
+  const match = req.path.match(/^\/user(\d+)\/([\w\-\/]+)\.png$/);
+  // Serve it directly if it is not a figure or it has already been rendered
+  if (!match || fs.existsSync(path.join(imageDirectory, req.path))) {
+    return next();
+  }
+  try {
+    await callWorker('figure', { user: match[1], figure: match[2] });
+  } catch (error) {
+    console.error(`Error: ${error.message}`);
+  }
+  next();
+});
+
 // Use Express static middleware to serve the image directory
 app.use('/figures', express.static(imageDirectory));
 
-// Path to execute the PREPROCESS python script
-app.get('/preprocess', async (req, res) => {
-  try {
-
+// Path to execute an operation of the python worker (PREPROCESS or ANOMALY DETECTION)
+function workerRoute(method) {
+  return async (req, res) => {
     // Capture userId from query string
     const userId = req.query.userId;
 
@@ -35,64 +99,31 @@ app.get('/preprocess', async (req, res) => {
         return res.status(400).json({ error: 'userId is required' });
     }
 
-    // Execute the script and wait for the result
-    const { stdout, stderr } = await execPromise(`python ${basePath}preprocess.py ${userId}`, { 
-      timeout: 600000, // timeout of 10min (600000 ms = 10 min)
-      maxBuffer: 1024 * 1024 * 20 }); // increase buffer length to handle the large ammount of data
-    
-    if (stderr) {
-        console.error(`Stderr: ${stderr}`);
-        return res.status(500).json({ error: 'Error output from the script.' });
-    }
-
     try {
-        // Parse the standard output (stdout) as JSON
-        const result = JSON.parse(stdout);
+        // Execute the operation and wait for the result
+        const result = await callWorker(method, { user: userId });
         res.json(result);
-    } catch (parseError) {
-        console.error(`Parse Error: ${parseError.message}`);
-        res.status(500).json({ error: 'Failed to parse the script output.' });
+    } catch (error) {
+        console.error(`Error: ${error.message}`);
+        res.status(500).json({ error: 'An error occurred while executing the script.' });
     }
-  } catch (error) {
-      console.error(`Error: ${error.message}`);
-      res.status(500).json({ error: 'An error occurred while executing the script.' });
-  }
-});
-
-// Path to execute the ANOMALY DETECTION python script
-app.get('/anomdet', async (req, res) => {
-  try {
+  };
+}
 
-    // Capture userId from query string
-    const userId = req.query.userId;
+// Path to execute the PREPROCESS
+app.get('/preprocess', workerRoute('preprocess'));
 
-    // Validate that userId exists
-    if (!userId) {
-        return res.status(400).json({ error: 'userId is required' });
-    }
+// Path to execute the ANOMALY DETECTION
+app.get('/anomdet', workerRoute('anom_det'));
 
-    // Execute the script and wait for the result
-    const { stdout, stderr } = await execPromise(`python ${basePath}anom_det.py ${userId}`, { timeout: 600000 }); // timeout of 10min (600000 ms = 10 min)
-    
-    if (stderr) {
-        console.error(`Stderr: ${stderr}`);
-        return res.status(500).json({ error: 'Error output from the script.' });
-    }
+// Path to execute both phases in the same request (the preprocessed days are passed in memory)
+app.get('/run', workerRoute('run'));
 
-    try {
-        // Parse the standard output (stdout) as JSON
-        const result = JSON.parse(stdout);
-        res.json(result);
-    } catch (parseError) {
-        console.error(`Parse Error: ${parseError.message}`);
-        res.status(500).json({ error: 'Failed to parse the script output.' });
-    }
-  } catch (error) {
-      console.error(`Error: ${error.message}`);
-      res.status(500).json({ error: 'An error occurred while executing the script.' });
-  }
-});
+// Path to know the figures of a user already rendered in the background (ready, pending and errors)
+app.get('/figures_status', workerRoute('figures_status'));
 
 app.listen(port, () => {
   console.log(`Server running at http://localhost:${port}`);
-});
\ No newline at end of file
+  // Start the worker with the server (the libraries are loaded before the first request)
+  startWorker();
+});
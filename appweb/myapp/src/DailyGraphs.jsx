@@ -61,8 +61,9 @@ function DailyGraphs() {
         throw new Error('Error executing the script');
       }
       const result = await response.json();
-      setData(result);
-      const extractedDays = result.map(item => item.Date); // Extract Date column (YYYY-MM-DD)
+      // Days preprocessed (the days dropped for missing intensity or steps values are in result.dropped_days)
+      setData(result.days);
+      const extractedDays = result.days.map(item => item.Date); // Extract Date column (YYYY-MM-DD)
       setDays(extractedDays);
     } catch (err) {
       setError(err.message);
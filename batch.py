@@ -0,0 +1,137 @@
+# BATCH EXECUTION - PREPROCESS AND ANOMALY DETECTION OF SEVERAL USERS IN PARALLEL ---------------------------------
+
+# Libraries
+import os
+import sys
+import time
+import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import preprocess as pre
+from anom_det import anom_det
+
+# Phases that can be executed
+phases_available = ['preprocess', 'anom_det']
+
+# Execute the phases of one user (in a process of the pool)
+def run_user(user, data_user, phases):
+
+    # The comments of the phases are not shown (only the report)
+    original_stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+
+    report = {'user': user, 'status': 'ok'}
+    try:
+        # Days of the user preprocessed (passed in memory to the anomaly detection)
+        user_days = None
+        if 'preprocess' in phases:
+            start = time.perf_counter()
+            data_hr_user, data_int_user, data_steps_user = data_user
+            # The dataset is written before returning (the processes of the pool do not wait for background writes)
+            user_days, _ = pre.preprocess_days(user, data_hr_user, data_int_user, data_steps_user, write_dataset='sync')
+            report['time_preprocess'] = round(time.perf_counter() - start, 3)
+        if 'anom_det' in phases:
+            start = time.perf_counter()
+            # The modules are executed in this process (the users are already executed in parallel)
+            report['anom_days'] = json.loads(anom_det(user, data=user_days, n_jobs=1))
+            report['time_anom_det'] = round(time.perf_counter() - start, 3)
+    except Exception as error:
+        report['status'] = 'error'
+        report['error'] = f'{type(error).__name__}: {error}'
+    finally:
+        # Restore standard output
+        sys.stdout.close()
+        sys.stdout = original_stdout
+
+    return report
+
+# BATCH FUNCTION
+
+def batch(users, n_workers=None, phases=phases_available):
+
+    print('\n*BATCH EXECUTION*')
+    reports = []
+    data_users = {}
+
+    # Read the CSV files only once (only the rows of the users) and split the data by user
+    if 'preprocess' in phases:
+        start = time.perf_counter()
+        data_hr, data_int, data_steps = pre.load_data(pre.file_hr_1, pre.file_hr_2, pre.file_min_int_1, pre.file_min_int_2,
+                                                      pre.file_min_steps_1, pre.file_min_steps_2, users=users)
+        data_users = pre.partition_data(data_hr, data_int, data_steps)
+        # The data of all the users is not needed anymore
+        del data_hr, data_int, data_steps
+        time_load = round(time.perf_counter() - start, 3)
+        print(f'\nData loaded in {time_load} s')
+    else:
+        time_load = 0
+
+    # Users without data can not be preprocessed
+    users_ok = []
+    for user in users:
+        if 'preprocess' in phases and user not in data_users:
+            reports.append({'user': user, 'status': 'error', 'error': 'No data for the user in the CSV files'})
+        else:
+            users_ok.append(user)
+
+    # Number of processes (all the cpus by default)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = max(1, min(n_workers, len(users_ok)))
+
+    # Each user is executed in a process of the pool
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(run_user, user, data_users.get(user), phases) for user in users_ok]
+        for future in as_completed(futures):
+            report = future.result()
+            print(f"USER {report['user']}: {report['status']}", report.get('error', ''))
+            reports.append(report)
+
+    # Report of the execution (users in the same order as requested)
+    reports.sort(key=lambda report: users.index(report['user']))
+    return {'time_load': time_load, 'time_total': round(time_load + time.perf_counter() - start, 3), 'workers': n_workers,
+            'users': reports}
+
+# MAIN FUNCTION
+
+def main(users, n_workers, phases, show_output):
+
+    # Change standard output:
+    # Store the standard output
+    original_stdout = sys.stdout
+    # If we don't want to show the output (prints), output changes to null
+    if not show_output:
+        sys.stdout = open(os.devnull, 'w')
+
+    # Execute the phases for all the users
+    report = batch(users, n_workers, phases)
+
+    # Restore standard output
+    sys.stdout = original_stdout
+
+    # Return the report in JSON format
+    print(json.dumps(report))
+
+if __name__ == '__main__':
+    # Users: 'all' or the ids separated by commas (e.g. 2022484408,2347167796)
+    users = pre.users
+    if len(sys.argv) > 1 and sys.argv[1].lower() != 'all':
+        users = [int(user) for user in sys.argv[1].split(',')]
+    # Number of processes (all the cpus by default)
+    n_workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    # Phases: 'all', 'preprocess' or 'anom_det'
+    phases = phases_available
+    if len(sys.argv) > 3 and sys.argv[3].lower() != 'all':
+        phases = [sys.argv[3]]
+    # show_output is predefined as False
+    show_output = len(sys.argv) > 4 and sys.argv[4].lower() == "true"
+
+    # Verify if the arguments are valid
+    if any(user not in pre.users for user in users):
+        print("The user argument provided is not valid.")
+    elif any(phase not in phases_available for phase in phases):
+        print("The phases argument provided is not valid.")
+    else:
+        main(users, n_workers, phases, show_output)
+
+# -----------------------------------------------------------------------------------------------------------------
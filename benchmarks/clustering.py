@@ -0,0 +1,47 @@
+# BENCHMARK OF THE CLUSTERING METHODS OF THE MODULES - SCALING WITH THE NUMBER OF DAYS ----------------------------
+
+# Execute in the main folder: python benchmarks/clustering.py [days separated by commas]
+# Ward (the default of the modules) needs O(n^2) memory and time in the number of days. Mini-batch k-means and BIRCH
+# (with PAA or PCA of the minute vectors) are linear. The agreement with ward is the adjusted Rand index of the labels
+
+# Libraries
+import os
+import sys
+import time
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+main_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, main_folder)
+sys.path.insert(0, os.path.join(main_folder, 'benchmarks'))
+from anom_det import clustering_methods, reduction_methods
+from synthetic_data import user_days
+
+# Methods compared: name, reduction (method and dimensions) and clustering method
+methods = [
+    ('ward', None, 'ward'),
+    ('ward + PAA 60', ('paa', 60), 'ward'),
+    ('mini-batch k-means', None, 'minibatch_kmeans'),
+    ('mini-batch k-means + PAA 60', ('paa', 60), 'minibatch_kmeans'),
+    ('BIRCH + PCA 10', ('pca', 10), 'birch'),
+]
+
+# MAIN FUNCTION
+
+def main(sizes):
+    for n_days in sizes:
+        day_hr = user_days(n_days)
+        print(f'\n{n_days} days of {day_hr.shape[1]} minutes')
+        ward_labels = None
+        for name, reduction, clustering in methods:
+            start = time.perf_counter()
+            X = day_hr if reduction is None else reduction_methods[reduction[0]](day_hr, reduction[1])[0]
+            k_labels = clustering_methods[clustering](X, 4)
+            elapsed = time.perf_counter() - start
+            if ward_labels is None:
+                ward_labels = k_labels
+            print(f'{name:30} {elapsed:8.3f} s   agreement with ward: {adjusted_rand_score(ward_labels, k_labels):.3f}')
+
+if __name__ == '__main__':
+    main([int(n) for n in sys.argv[1].split(',')] if len(sys.argv) > 1 else [250, 1000, 4000])
+
+# -----------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,68 @@
+# BENCHMARK OF THE DISTANCES FROM THE DAYS TO THE TYPICAL DAY OF THEIR CLUSTER ------------------------------------
+
+# Execute in the main folder: python benchmarks/dtw_scoring.py [days]
+# Previous version: fastdtw for each day. New version: DTW of all the days of a cluster at once, with LB_Keogh lower
+# bounds and early abandoning with a fixed threshold (only the distances needed to select the anomalies are calculated
+# exactly)
+# The new version computes the exact DTW inside a Sakoe-Chiba band, not the approximation of fastdtw (without band), so
+# the days selected can differ from the previous version: the bounds are checked against the exact banded DTW (same
+# days), and the change of the selection is measured against fastdtw (days also selected by the previous version)
+
+# Libraries
+import os
+import sys
+import math
+import time
+import numpy as np
+from fastdtw import fastdtw
+from sklearn.cluster import AgglomerativeClustering
+main_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, main_folder)
+sys.path.insert(0, os.path.join(main_folder, 'benchmarks'))
+from dtw import dtw_batch, distances_to_profiles
+from synthetic_data import user_days
+
+# MAIN FUNCTION
+
+def main(n_days):
+    day_hr = user_days(n_days)
+    window = max(1, day_hr.shape[1] // 10)
+    k_labels = AgglomerativeClustering(n_clusters=4, linkage='ward').fit_predict(day_hr)
+    profiles = {cluster: day_hr[k_labels == cluster].mean(axis=0) for cluster in np.unique(k_labels)}
+    n_anom = math.ceil(n_days * 0.1)
+    print(f'{n_days} days of {day_hr.shape[1]} minutes, band of {window} minutes')
+
+    # Previous version
+    start = time.perf_counter()
+    previous = np.array([fastdtw(profiles[label].tolist(), day)[0] for label, day in zip(k_labels, day_hr)])
+    time_previous = time.perf_counter() - start
+    print(f'fastdtw for each day: {time_previous:.2f} s')
+
+    # All the distances calculated exactly (reference of the new version)
+    start = time.perf_counter()
+    exact = np.zeros(n_days)
+    for cluster, profile in profiles.items():
+        exact[k_labels == cluster] = dtw_batch(profile, day_hr[k_labels == cluster], window)
+    time_exact = time.perf_counter() - start
+    print(f'Batched DTW, all the distances: {time_exact:.2f} s ({time_previous / time_exact:.1f}x faster)')
+
+    # Top n_anom days (percentage of anomalies: all the distances are calculated exactly)
+    top = set(np.argsort(-exact, kind='stable')[:n_anom])
+    top_previous = set(np.argsort(-previous, kind='stable')[:n_anom])
+    print(f'Top {n_anom} days also selected by fastdtw: {len(top & top_previous)}/{n_anom}')
+
+    # Fixed threshold (the distance of the 90th percentile)
+    threshold = np.percentile(exact, 90)
+    start = time.perf_counter()
+    distances = distances_to_profiles(profiles, k_labels, day_hr, window, threshold=threshold)
+    time_threshold = time.perf_counter() - start
+    same = np.array_equal(distances > threshold, exact > threshold)
+    selected, selected_previous = distances > threshold, previous > threshold
+    print(f'Batched DTW, fixed threshold: {time_threshold:.2f} s ({time_previous / time_threshold:.1f}x faster), '
+          f'same days as the exact banded DTW: {same}, also selected by fastdtw: '
+          f'{(selected & selected_previous).sum()}/{selected.sum()} (fastdtw: {selected_previous.sum()})')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 90)
+
+# -----------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,88 @@
+# BENCHMARK OF THE FILLING OF MISSING VALUES - PREVIOUS (ONE DAY AT A TIME) AND VECTORIZED VERSIONS ---------------
+
+# Execute in the main folder: python benchmarks/gap_filling.py [days]
+
+# Libraries
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+main_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, main_folder)
+sys.path.insert(0, os.path.join(main_folder, 'benchmarks'))
+from preprocess import fill_missing_values
+from synthetic_data import user_minutes
+
+# PREVIOUS VERSION (one dataframe for each day and a loop over all the minutes)
+
+def fill_missing_values_previous(minutes, hrs, max_mins_missing):
+    times = pd.to_datetime(minutes, unit='m')
+    min_hr = pd.DataFrame({'ActivityMinute': times, 'HeartRate': hrs})
+    day_hr = min_hr.groupby(min_hr['ActivityMinute'].dt.date)['HeartRate'].apply(list).tolist()
+    day_time = min_hr.groupby(min_hr['ActivityMinute'].dt.date)['ActivityMinute'].apply(list).tolist()
+
+    def fill_missing_values_with_nan(day_time, day_hr):
+        day_time_with_nan = []
+        day_hr_with_nan = []
+        for day, hr in zip(day_time, day_hr):
+            df = pd.DataFrame({'Time': day, 'HR': hr})
+            dates_range = pd.date_range(start=df['Time'].min(), end=df['Time'].max(), freq='min')
+            df = df.set_index('Time').reindex(dates_range).reset_index()
+            df.rename(columns={'index': 'Time'}, inplace=True)
+            df = df.fillna(np.nan)
+            day_time_with_nan.append(df['Time'].tolist())
+            day_hr_with_nan.append(df['HR'].tolist())
+        return day_time_with_nan, day_hr_with_nan
+
+    day_time_with_nan, day_hr_with_nan = fill_missing_values_with_nan(day_time, day_hr)
+
+    for hrs in day_hr_with_nan:
+        num_nans = 0
+        for i, hr in enumerate(hrs):
+            if np.isnan(hr) and i < len(hrs) - 1:
+                num_nans += 1
+            else:
+                if num_nans > 0 and num_nans <= max_mins_missing:
+                    start_id = i - num_nans
+                    end_id = i - 1
+                    prev_next_val = []
+                    prev_next_val.append(hrs[start_id - 1]) if start_id - 1 >= 0 else None
+                    prev_next_val.append(hrs[end_id + 1]) if end_id + 1 <= len(hrs) - 1 else None
+                    if len(prev_next_val) == 1:
+                        fill_value = prev_next_val[0]
+                    if len(prev_next_val) == 2:
+                        fill_value = (prev_next_val[0] + prev_next_val[1]) / 2
+                    hrs[start_id:end_id+1] = [fill_value] * (end_id - start_id + 1)
+                num_nans = 0
+
+    return day_time_with_nan, day_hr_with_nan
+
+# MAIN FUNCTION
+
+def main(n_days):
+    minutes, hrs = user_minutes(n_days)
+    print(f'{n_days} days, {len(minutes)} minutes with samples')
+
+    start = time.perf_counter()
+    day_time_previous, day_hr_previous = fill_missing_values_previous(minutes, hrs, 60)
+    time_previous = time.perf_counter() - start
+
+    start = time.perf_counter()
+    all_minutes, all_hrs, day_starts = fill_missing_values(minutes, hrs, 60)
+    time_vectorized = time.perf_counter() - start
+
+    # The results must be exactly the same (NaN in the same positions)
+    same_minutes = np.array_equal(all_minutes, pd.to_datetime(np.concatenate(day_time_previous)).to_numpy()
+                                  .astype('datetime64[m]').astype(np.int64))
+    same_hrs = np.array_equal(all_hrs, np.concatenate(day_hr_previous), equal_nan=True)
+    same_days = np.array_equal(np.diff(day_starts), [len(day) for day in day_hr_previous])
+
+    print(f'Previous version: {time_previous:.3f} s')
+    print(f'Vectorized version: {time_vectorized:.4f} s ({time_previous / time_vectorized:.0f}x faster)')
+    print(f'Same results: {same_minutes and same_hrs and same_days}')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 90)
+
+# -----------------------------------------------------------------------------------------------------------------
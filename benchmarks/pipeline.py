@@ -0,0 +1,129 @@
+# END TO END BENCHMARK - PREPROCESS AND ANOMALY DETECTION WITH SYNTHETIC SMARTWATCH DATA --------------------------
+
+# Execute in the main folder: python benchmarks/pipeline.py [days] [users] [rates] [report]
+# days, users and rates (seconds between the heart rate samples) can be lists separated by commas (e.g. 30,90,365,1000)
+# Each combination is executed in a new process in a temporary folder (the peak memory is the one of that execution):
+# the CSV files are generated, and the time of each stage and the peak memory (RSS) after it are measured. The time of
+# the stages inside the phases (preprocess.fill_missing_values, anom_det.detect.module.scoring...) is taken from the
+# records of the instrumentation (instrument.py), added for all the users. The report (JSON) is written in the report
+# file (benchmark_report.json by default) to compare executions, with all the records
+
+# Libraries
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+# Peak memory of the process (only available in POSIX systems - None in Windows)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Folder of the system (the benchmark is executed in a temporary folder)
+main_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Peak memory of the process until now (bytes - ru_maxrss is in kilobytes in Linux, None if it is not available)
+def peak_rss():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# EXECUTION OF ONE COMBINATION (in the temporary folder)
+
+def run(n_days, n_users, rate):
+    sys.path.insert(0, main_folder)
+    sys.path.insert(0, os.path.join(main_folder, 'benchmarks'))
+    from synthetic_data import generate, user_ids
+    import preprocess as pre
+    from anom_det import anom_det
+    from instrument import configure, settings
+
+    stages = []
+    # Records of the stages inside the phases (only the ones of this process)
+    configure(settings['output'], collect=True)
+
+    # Measure the time of a stage and the peak memory after it
+    def stage(name, function, *args, **kwargs):
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            value = function(*args, **kwargs)
+        stages.append({'stage': name, 'time': round(time.perf_counter() - start, 4), 'peak_rss': peak_rss()})
+        return value
+
+    users = user_ids[:n_users]
+    files, anomalies = stage('generate', generate, '.', n_users, n_days, rate)
+    data_hr, data_int, data_steps = stage('load_data', pre.load_data, *files, users=users)
+    stages[-1]['rows'] = len(data_hr)
+    data_users = stage('partition_data', pre.partition_data, data_hr, data_int, data_steps)
+    del data_hr, data_int, data_steps
+
+    detection = {'injected': 0, 'detected': 0, 'anom_days': 0}
+    for user in users:
+        stage(f'preprocess_user {user}', pre.preprocess_user, user, *data_users[user])
+        anom_days = json.loads(stage(f'anom_det {user}', anom_det, user, use_cache=False))
+        injected = set(anomalies.get(user, []))
+        detection['injected'] += len(injected)
+        detection['detected'] += len(injected & set(anom_days))
+        detection['anom_days'] += len(anom_days)
+
+    # Time of each stage inside the phases, added for all the users (the modules separately)
+    inner_stages = {}
+    for record in settings['records']:
+        name = record['stage'] + (f" {record['folder']}" if 'folder' in record else '')
+        inner_stage = inner_stages.setdefault(name, {'stage': name, 'time': 0, 'count': 0})
+        inner_stage['time'] = round(inner_stage['time'] + record['wall'], 4)
+        inner_stage['count'] += 1
+
+    return {'days': n_days, 'users': n_users, 'rate': rate, 'stages': stages, 'peak_rss': peak_rss(),
+            'time_total': round(sum(stage['time'] for stage in stages), 4), 'inner_stages': list(inner_stages.values()),
+            'detection': detection, 'records': settings['records']}
+
+# MAIN FUNCTION
+
+def main(days, users, rates, report_path):
+    report = {'python': sys.version.split()[0], 'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'runs': []}
+    for n_days in days:
+        for n_users in users:
+            for rate in rates:
+                folder = tempfile.mkdtemp(prefix='benchmark_')
+                try:
+                    process = subprocess.run([sys.executable, os.path.abspath(__file__), 'run', str(n_days),
+                                              str(n_users), str(rate)], cwd=folder, capture_output=True, text=True)
+                finally:
+                    shutil.rmtree(folder, ignore_errors=True)
+                if process.returncode != 0:
+                    result = {'days': n_days, 'users': n_users, 'rate': rate, 'error': process.stderr.strip()[-2000:]}
+                    print(f'{n_days} days, {n_users} users, {rate} s: ERROR')
+                else:
+                    result = json.loads(process.stdout.strip().splitlines()[-1])
+                    memory = 'not available' if result['peak_rss'] is None else f"{result['peak_rss'] / 2 ** 20:.0f} MB"
+                    print(f"{n_days} days, {n_users} users, {rate} s: {result['time_total']} s, peak memory {memory}")
+                    for stage in result['stages']:
+                        print(f"    {stage['stage']:30} {stage['time']:9.3f} s")
+                    print('    Stages inside the phases (all the users):')
+                    for stage in result['inner_stages']:
+                        print(f"        {stage['stage']:50} {stage['time']:9.3f} s ({stage['count']})")
+                report['runs'].append(result)
+
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Report written in {report_path}')
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'run':
+        # Execution of one combination (in a new process)
+        print(json.dumps(run(int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]))))
+    else:
+        # Arguments: days, users and rates (lists separated by commas) and path of the report
+        days = [int(n) for n in sys.argv[1].split(',')] if len(sys.argv) > 1 else [30, 90, 365]
+        users = [int(n) for n in sys.argv[2].split(',')] if len(sys.argv) > 2 else [1]
+        rates = [int(n) for n in sys.argv[3].split(',')] if len(sys.argv) > 3 else [10]
+        report_path = sys.argv[4] if len(sys.argv) > 4 else 'benchmark_report.json'
+        main(days, users, rates, report_path)
+
+# -----------------------------------------------------------------------------------------------------------------
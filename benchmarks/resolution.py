@@ -0,0 +1,89 @@
+# BENCHMARK OF THE RESOLUTION OF THE MODULES - TIME AND RECALL OF THE ANOMALIES -----------------------------------
+
+# Execute in the main folder: python benchmarks/resolution.py [days] [users]
+# The synthetic CSV files (with anomalous days) are generated and preprocessed in a temporary folder, and the anomaly
+# detection is executed with all the modules at each resolution (minutes of each value of the vectors clustered and
+# compared with DTW) and with SAX. For each one: time of the anomaly detection, recall of the anomalous days injected
+# (detected / injected), recall lost compared with the vectors by minute, and agreement with the anomalies detected by
+# minute (share of them also detected)
+
+# Libraries
+import os
+import sys
+import time
+import shutil
+import tempfile
+from contextlib import redirect_stdout
+main_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, main_folder)
+sys.path.insert(0, os.path.join(main_folder, 'benchmarks'))
+import anom_det as ad
+import preprocess as pre
+from synthetic_data import generate, user_ids
+
+# Configurations compared: name, resolution (minutes) and reduction of the vectors (method and dimensions)
+configurations = [
+    ('1 minute', 1, None),
+    ('5 minutes', 5, None),
+    ('15 minutes', 15, None),
+    ('60 minutes', 60, None),
+    ('SAX 5 minutes, 48 segments', 5, ('sax', 48)),
+]
+
+# Anomalies of the users with all the modules at a resolution - anomalous days and time of each user
+def detect_users(users, resolution, reduction):
+    registry = [dict(module) for module in ad.modules_registry]
+    for module in ad.modules_registry:
+        module['resolution'] = resolution
+        if reduction is not None and module['features'] in ad.series_sources:
+            module['reduction'], module['dims'] = reduction
+    try:
+        anomalies, times = {}, {}
+        for user in users:
+            start = time.perf_counter()
+            result = ad.detect(ad.load_dataset(user), ad.enabled_modules(), n_jobs=1)
+            times[user] = time.perf_counter() - start
+            anomalies[user] = set(result['anom_days'])
+        return anomalies, times
+    finally:
+        ad.modules_registry[:] = registry
+
+# MAIN FUNCTION
+
+def main(n_days, n_users):
+    folder = tempfile.mkdtemp(prefix='benchmark_')
+    current_folder = os.getcwd()
+    os.chdir(folder)
+    try:
+        users = user_ids[:n_users]
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            files, injected = generate('.', n_users, n_days)
+            data_users = pre.partition_data(*pre.load_data(*files, users=users))
+            for user in users:
+                pre.preprocess_user(user, *data_users[user])
+        n_injected = sum(len(days) for days in injected.values())
+        print(f'{n_days} days, {n_users} users, {n_injected} anomalous days injected\n')
+
+        reference = None
+        for name, resolution, reduction in configurations:
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                anomalies, times = detect_users(users, resolution, reduction)
+            detected = sum(len(anomalies[user] & set(injected.get(user, []))) for user in users)
+            recall = detected / max(n_injected, 1)
+            if reference is None:
+                reference = {'anomalies': anomalies, 'recall': recall, 'time': sum(times.values())}
+            found = sum(len(reference['anomalies'][user]) for user in users)
+            agreement = sum(len(anomalies[user] & reference['anomalies'][user]) for user in users) / max(found, 1)
+            print(f'{name:28} {sum(times.values()):8.3f} s ({reference["time"] / sum(times.values()):5.1f}x)   '
+                  f'recall {recall:.3f} (lost {reference["recall"] - recall:+.3f})   '
+                  f'agreement with 1 minute {agreement:.3f}')
+    finally:
+        os.chdir(current_folder)
+        shutil.rmtree(folder, ignore_errors=True)
+
+if __name__ == '__main__':
+    n_days = int(sys.argv[1]) if len(sys.argv) > 1 else 90
+    n_users = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    main(n_days, n_users)
+
+# -----------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,152 @@
+# SYNTHETIC SMARTWATCH DATA - CSV FILES WITH THE SAME FORMAT AS THE FITABASE FILES --------------------------------
+
+# Execute in the main folder: python benchmarks/synthetic_data.py [folder] [users] [days] [seconds between samples]
+# Two folders are generated (first and second half of the days, like the two Fitabase folders), each one with
+# heartrate_seconds_merged.csv, minuteIntensitiesNarrow_merged.csv and minuteStepsNarrow_merged.csv
+# The days have gaps (short ones, filled by the preprocess, and long ones, that remove the day) and some anomalous
+# days (heart rate much higher than usual for some hours), returned to measure the detection
+# The benchmarks of single stages use the same days in memory (heart rate of each minute, or of the days in the same
+# range of time)
+
+# Libraries
+import os
+import sys
+import json
+import numpy as np
+import pandas as pd
+
+# First day of the data and ids of the users (the ids of the Fitabase users first)
+first_day = np.datetime64('2016-03-12')
+user_ids = [2022484408, 2347167796, 5553957443, 8877689391, 2026352035, 4020332650, 4388161847, 4558609924,
+            5577150313, 6117666160, 6391747486, 6775888955, 6962181067, 7007744171, 8792009665]
+
+# Probability of an anomalous day and of a day with a long gap (more than 60 minutes without samples)
+prob_anomaly = 0.05
+prob_long_gap = 0.03
+
+# TIMES WITH THE FITABASE FORMAT
+
+# Text of each second of the day ('%I:%M:%S %p')
+seconds_text = np.array([f'{(s // 3600) % 12 or 12:02d}:{s // 60 % 60:02d}:{s % 60:02d} {"AM" if s < 43200 else "PM"}'
+                         for s in range(24 * 60 * 60)], dtype='S11')
+
+# Times with the format '%m/%d/%Y %I:%M:%S %p' (seconds from 1970-01-01) - the text is built from the bytes of the date
+# of each day and of the second of the day
+def fitabase_times(seconds):
+    days, inverse = np.unique(seconds // (24 * 60 * 60), return_inverse=True)
+    dates_text = np.array([pd.Timestamp(day, unit='D').strftime('%m/%d/%Y ') for day in days], dtype='S11')
+    text = np.empty((len(seconds), 22), dtype=np.uint8)
+    text[:, :11] = dates_text[inverse].view(np.uint8).reshape(-1, 11)
+    text[:, 11:] = seconds_text[seconds % (24 * 60 * 60)].view(np.uint8).reshape(-1, 11)
+    return text.view('S22').ravel().astype(str)
+
+# DAYS OF A USER
+
+# Heart rate samples, intensity and steps of each minute of one day (seconds and minutes from 1970-01-01)
+def synthetic_day(rng, day, baseline, rate, anomalous):
+    start = day * 24 * 60 * 60
+    # Samples from ~07:00 to ~22:30 every rate seconds (with a small jitter)
+    first = int(rng.integers(6 * 3600 + 1800, 7 * 3600 + 1800))
+    last = int(rng.integers(22 * 3600, 23 * 3600))
+    seconds = np.arange(first, last, rate) + rng.integers(0, max(rate // 2, 1), (last - first - 1) // rate + 1)
+
+    # Short gaps (filled by the preprocess) and sometimes a long gap
+    keep = np.ones(len(seconds), dtype=bool)
+    for _ in range(rng.integers(0, 6)):
+        gap = int(rng.integers(0, len(seconds)))
+        keep[gap:gap + int(rng.integers(60, 30 * 60)) // rate] = False
+    if rng.random() < prob_long_gap:
+        gap = int(rng.integers(0, len(seconds) // 2))
+        keep[gap:gap + 3 * 60 * 60 // rate] = False
+    keep[[0, -1]] = True
+    seconds = seconds[keep]
+
+    # Activity: two or three peaks of the day (walks, sport)
+    minutes = np.arange(24 * 60)
+    activity = np.zeros(24 * 60)
+    for _ in range(rng.integers(2, 4)):
+        activity += np.exp(-((minutes - rng.integers(8 * 60, 21 * 60)) / rng.integers(15, 60)) ** 2)
+    steps = np.round(np.clip(activity * 110 + rng.normal(0, 5, 24 * 60), 0, None) * (activity > 0.05)).astype(int)
+    intensity = np.digitize(steps, [1, 40, 90])
+
+    # Heart rate: baseline, daily cycle, activity and noise (anomalous days much higher for some hours)
+    sample_minutes = seconds // 60
+    hr = baseline + 8 * np.sin((seconds / 3600 - 9) / 24 * 2 * np.pi) + 45 * activity[sample_minutes]
+    if anomalous:
+        onset = rng.integers(9 * 60, 18 * 60)
+        hr += 30 * ((sample_minutes >= onset) & (sample_minutes < onset + rng.integers(180, 360)))
+    hr = np.round(hr + rng.normal(0, 4, len(hr))).astype(int)
+
+    return start + seconds, hr, day * 24 * 60 + minutes, intensity, steps
+
+# DAYS IN MEMORY (benchmarks of single stages)
+
+# Heart rate of the minutes with samples of one user (minutes from 1970-01-01, sorted - the gaps are not filled)
+def user_minutes(n_days, seed=0):
+    rng = np.random.default_rng(seed)
+    baseline = rng.integers(60, 80)
+    seconds, hrs = [], []
+    for day in first_day.astype(np.int64) + np.arange(n_days):
+        day_seconds, hr, _, _, _ = synthetic_day(rng, int(day), baseline, 60, rng.random() < prob_anomaly)
+        seconds.append(day_seconds)
+        hrs.append(hr)
+    # One sample for each minute (the first one)
+    minutes, ids = np.unique(np.concatenate(seconds) // 60, return_index=True)
+    return minutes, np.concatenate(hrs)[ids].astype(float)
+
+# Heart rate of the days of one user in the same range of time (one row for each day, n_minutes from 07:30 - the gaps
+# are interpolated)
+def user_days(n_days, n_minutes=870, seed=0):
+    minutes, hrs = user_minutes(n_days, seed)
+    first = (first_day.astype(np.int64) + np.arange(n_days)) * 24 * 60 + 7 * 60 + 30
+    return np.round(np.interp(first[:, None] + np.arange(n_minutes), minutes, hrs))
+
+# Write the CSV files of the users (two folders: data_1 and data_2) - returns the paths of the files (in the order of
+# the arguments of preprocess) and the anomalous days of each user
+def generate(folder, n_users, n_days, rate=10, seed=0):
+    rng = np.random.default_rng(seed)
+    days = first_day.astype(np.int64) + np.arange(n_days)
+    parts = [days[:(n_days + 1) // 2], days[(n_days + 1) // 2:]]
+    files = {'hr': [], 'int': [], 'steps': []}
+    anomalies = {}
+
+    for part, part_days in enumerate(parts, start=1):
+        part_folder = f'{folder}/data_{part}'
+        if not os.path.exists(part_folder):
+            os.makedirs(part_folder)
+        hr_frames, int_frames, steps_frames = [], [], []
+        for user in user_ids[:n_users]:
+            baseline = rng.integers(60, 80)
+            samples = []
+            for day in part_days:
+                anomalous = rng.random() < prob_anomaly
+                if anomalous:
+                    anomalies.setdefault(user, []).append(str(np.datetime64(int(day), 'D'))[5:])
+                samples.append(synthetic_day(rng, int(day), baseline, rate, anomalous))
+            seconds, hr, minutes, intensity, steps = (np.concatenate(values) for values in zip(*samples))
+            hr_frames.append(pd.DataFrame({'Id': user, 'Time': fitabase_times(seconds), 'Value': hr}))
+            minute_times = fitabase_times(minutes * 60)
+            int_frames.append(pd.DataFrame({'Id': user, 'ActivityMinute': minute_times, 'Intensity': intensity}))
+            steps_frames.append(pd.DataFrame({'Id': user, 'ActivityMinute': minute_times, 'Steps': steps}))
+        for name, frames, file in [('hr', hr_frames, 'heartrate_seconds_merged.csv'),
+                                   ('int', int_frames, 'minuteIntensitiesNarrow_merged.csv'),
+                                   ('steps', steps_frames, 'minuteStepsNarrow_merged.csv')]:
+            path = f'{part_folder}/{file}'
+            if frames:
+                pd.concat(frames).to_csv(path, index=False)
+            files[name].append(path)
+
+    return files['hr'] + files['int'] + files['steps'], anomalies
+
+# MAIN FUNCTION
+
+if __name__ == '__main__':
+    # Arguments: folder, number of users, number of days and seconds between the heart rate samples
+    folder = sys.argv[1] if len(sys.argv) > 1 else 'synthetic'
+    n_users = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    n_days = int(sys.argv[3]) if len(sys.argv) > 3 else 30
+    rate = int(sys.argv[4]) if len(sys.argv) > 4 else 10
+    files, anomalies = generate(folder, n_users, n_days, rate)
+    print(json.dumps({'files': files, 'anomalies': anomalies}))
+
+# -----------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,73 @@
+# CACHE OF THE ANOMALY DETECTION RESULTS - KEYED BY THE CONTENT OF THE DATASET AND THE PARAMETERS -----------------
+
+# Libraries
+import pickle
+import os
+import json
+import hashlib
+import numpy as np
+
+# Folder of the cache and maximum size (the least recently used results are removed first)
+cache_folder = 'cache'
+cache_max_size = 100 * 1024 * 1024
+
+# Key of a result: hash of the arrays of the dataset and of the parameters of the system
+def cache_key(data, parameters):
+    key = hashlib.sha256()
+    for name in sorted(data):
+        values = np.ascontiguousarray(data[name])
+        key.update(f'{name}{values.dtype.str}{values.shape}'.encode())
+        key.update(values.tobytes())
+    key.update(json.dumps(parameters, sort_keys=True).encode())
+    return key.hexdigest()
+
+# Path of a result in the cache (the user is in the name to remove the results of a user)
+def cache_path(user, key):
+    return f'{cache_folder}/user{user}_{key}.pkl'
+
+# Read a result from the cache (None if it is not stored)
+def get_cached(user, key):
+    path = cache_path(user, key)
+    try:
+        with open(path, 'rb') as f:
+            result = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    # Update the time of last use
+    os.utime(path)
+    return result
+
+# Store a result in the cache and remove the least recently used ones if the cache is too big
+def put_cached(user, key, result):
+    # Verify if the folder exists
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+    # Write in a temporary file first (a reader never finds a file half written)
+    path = cache_path(user, key)
+    with open(f'{path}.tmp', 'wb') as f:
+        pickle.dump(result, f)
+    os.replace(f'{path}.tmp', path)
+    evict()
+
+# Remove the least recently used results until the cache is smaller than the maximum size
+def evict(max_size=None):
+    if max_size is None:
+        max_size = cache_max_size
+    files = [entry for entry in os.scandir(cache_folder) if entry.name.endswith('.pkl')]
+    files.sort(key=lambda entry: entry.stat().st_mtime)
+    size = sum(entry.stat().st_size for entry in files)
+    for entry in files:
+        if size <= max_size:
+            break
+        size -= entry.stat().st_size
+        os.remove(entry.path)
+
+# Remove all the results of a user (when its dataset changes)
+def invalidate_user(user):
+    if not os.path.exists(cache_folder):
+        return
+    for entry in os.scandir(cache_folder):
+        if entry.name.startswith(f'user{user}_'):
+            os.remove(entry.path)
+
+# -----------------------------------------------------------------------------------------------------------------
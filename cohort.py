@@ -0,0 +1,155 @@
+# POPULATION (COHORT) ANOMALY DETECTION - THE DAYS OF ALL THE USERS COMPARED AT ONCE ------------------------------
+
+# The days of all the users are stacked in one array (one row for each day, one column for each minute of the day
+# from 00:00 to 23:59, NaN outside of the range of time of its user) with the user of each day. Each day is summarized
+# with the mean heart rate of segments of the day and compared with:
+# - its user: distance to the mean day of the user (the usual days of the user)
+# - the cohort: distance to the nearest centroid of the clusters of the days of all the users (mini-batch k-means,
+#   linear in the number of days), with the heart rate of each user centered on its mean (only the shape of the day)
+# A day is an anomaly when it is one of the most distant days both for its user and for the cohort
+
+# Libraries
+import os
+import sys
+import json
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from dataset import load_dataset, dataset_path, day_labels, arrays_marker
+from anom_det import users as available_users
+
+# PARAMETERS OF THE COHORT MODE
+
+# Number of segments of the day (48: 30 minutes), number of clusters of the cohort, anomaly threshold (% of the days
+# of each user for the user, % of all the days for the cohort) and if the heart rate of each user is centered
+cohort_parameters = {'segments': 48, 'k': 6, 'anom_threshold': 0.1, 'normalize': True}
+
+# DAYS OF THE COHORT
+
+# Stack the days of the users - memory linear in the total number of days (float32 with NaN outside of the days)
+def load_cohort(users):
+    users = [user for user in users if os.path.exists(arrays_marker(dataset_path(user)))]
+    datasets = [load_dataset(user) for user in users]
+    n_days = sum(data.n_days for data in datasets)
+
+    day_hr = np.full((n_days, 24 * 60), np.nan, dtype=np.float32)
+    user_ids = np.zeros(n_days, dtype=np.int32)
+    start = np.zeros(n_days, dtype=np.int64)
+    row = 0
+    for i, data in enumerate(datasets):
+        n = data.n_days
+        # Column of each sample of the days of the user (minute of the day)
+        day_hr[np.arange(row, row + n)[:, None], data.minute_of_day()] = data['hr']
+        user_ids[row:row + n] = i
+        start[row:row + n] = data['start']
+        row += n
+
+    return {'users': users, 'user': user_ids, 'start': start, 'hr': day_hr}
+
+# Mean heart rate of each segment of the days (NaN if the segment has no samples)
+def segment_means(day_hr, segments):
+    bounds = np.linspace(0, day_hr.shape[1], segments + 1).astype(int)
+    valid = ~np.isnan(day_hr)
+    sums = np.add.reduceat(np.where(valid, day_hr, 0), bounds[:-1], axis=1, dtype=np.float64)
+    counts = np.add.reduceat(valid, bounds[:-1], axis=1)
+    with np.errstate(invalid='ignore'):
+        return sums / counts
+
+# Euclidean distance from each row of X to the row of C, only with the segments with values in both (scaled to all
+# the segments)
+def masked_distances(X, C):
+    diff = X - C
+    valid = ~np.isnan(diff)
+    n_valid = np.maximum(valid.sum(axis=1), 1)
+    return np.sqrt((np.where(valid, diff, 0) ** 2).sum(axis=1) * X.shape[1] / n_valid)
+
+# Ids of the most distant days (anomaly threshold: % of the days, rounded up)
+def most_distant(distances, anom_threshold):
+    n_anom = int(np.ceil(len(distances) * anom_threshold))
+    return np.argsort(-distances, kind='stable')[:n_anom]
+
+# COHORT ANOMALY DETECTION
+
+def cohort_anom_det(users, parameters=None):
+
+    if parameters is None:
+        parameters = cohort_parameters
+    cohort = load_cohort(users)
+    user_ids = cohort['user']
+    n_users = len(cohort['users'])
+    print(f"Cohort: {n_users} users, {len(user_ids)} days")
+
+    X = segment_means(cohort['hr'], parameters['segments'])
+    # The whole days are not needed anymore
+    del cohort['hr']
+    # Only the segments with samples in some day (the nights are usually empty)
+    X = X[:, ~np.isnan(X).all(axis=0)]
+    valid = ~np.isnan(X)
+
+    # Mean day of each user (mean of each segment of its days)
+    sums = np.zeros((n_users, X.shape[1]))
+    counts = np.zeros((n_users, X.shape[1]))
+    np.add.at(sums, user_ids, np.where(valid, X, 0))
+    np.add.at(counts, user_ids, valid)
+    with np.errstate(invalid='ignore'):
+        user_means = sums / counts
+
+    # Distance of each day to the mean day of its user
+    user_distances = masked_distances(X, user_means[user_ids])
+
+    # Days of the cohort centered on the mean heart rate of their user, and the segments without values with the mean
+    # of the segment in the cohort (needed by the clustering)
+    if parameters['normalize']:
+        user_levels = np.nansum(sums, axis=1) / np.maximum(counts.sum(axis=1), 1)
+        X = X - user_levels[user_ids][:, None]
+    X_filled = np.where(valid, X, np.nanmean(X, axis=0))
+    clustering = MiniBatchKMeans(n_clusters=min(parameters['k'], len(X)), batch_size=1024, n_init=3, random_state=0)
+    k_labels = clustering.fit_predict(X_filled)
+    cohort_distances = masked_distances(X, clustering.cluster_centers_[k_labels])
+
+    # Anomalies for the cohort (% of all the days) and for each user (% of the days of the user)
+    cohort_anom = np.zeros(len(X), dtype=bool)
+    cohort_anom[most_distant(cohort_distances, parameters['anom_threshold'])] = True
+    user_anom = np.zeros(len(X), dtype=bool)
+    for i in range(n_users):
+        ids = np.flatnonzero(user_ids == i)
+        user_anom[ids[most_distant(user_distances[ids], parameters['anom_threshold'])]] = True
+
+    # Result of each user (month-day)
+    dates = np.array(day_labels(cohort['start']))
+    result = {}
+    for i, user in enumerate(cohort['users']):
+        ids = user_ids == i
+        result[user] = {'anom_days': dates[ids & user_anom & cohort_anom].tolist(),
+                        'user_anom_days': dates[ids & user_anom].tolist(),
+                        'cohort_anom_days': dates[ids & cohort_anom].tolist()}
+    return result
+
+# MAIN FUNCTION
+
+def main(users, show_output):
+
+    # Change standard output:
+    # Store the standard output
+    original_stdout = sys.stdout
+    # If we don't want to show the output (prints), output changes to null
+    if not show_output:
+        sys.stdout = open(os.devnull, 'w')
+
+    result = cohort_anom_det(users)
+
+    # Restore standard output
+    sys.stdout = original_stdout
+
+    # Return the anomalies of each user in JSON format
+    print(json.dumps(result))
+
+if __name__ == '__main__':
+    # Users: 'all' (the users with a dataset) or the ids separated by commas (e.g. 2022484408,2347167796)
+    users = available_users
+    if len(sys.argv) > 1 and sys.argv[1].lower() != 'all':
+        users = [int(user) for user in sys.argv[1].split(',')]
+    # show_output is predefined as False
+    show_output = len(sys.argv) > 2 and sys.argv[2].lower() == 'true'
+    main(users, show_output)
+
+# -----------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,224 @@
+# DATASETS OF THE USERS - COLUMNAR FORMAT WITH MEMORY MAPPED ARRAYS -----------------------------------------------
+
+# Libraries
+import pickle
+import os
+import sys
+import json
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from cache import invalidate_user
+
+# Arrays of the dataset (one file for each one) and their types
+# hr, int and steps: one row for each day and one column for each minute
+# start: first minute of each day (minutes from 1970-01-01)
+arrays_types = {'hr': np.int16, 'int': np.uint8, 'steps': np.int16, 'start': np.int64}
+# Statistics of heart rate of each day (stored in a separate file)
+stats_types = [('Max', np.int16), ('Min', np.int16), ('Mean', np.float64), ('Median', np.float64),
+               ('Std_dev', np.float64), ('RMSSD', np.float64), ('pNN50', np.float64)]
+
+# DAYS OF A USER - ALIGNED ARRAYS WITH ONE ROW FOR EACH DAY AND ONE COLUMN FOR EACH MINUTE OF THE RANGE OF TIME
+
+# Arrays: hr (int16, or float32 with NaN in the minutes without samples), int (uint8), steps (int16), start (first
+# minute of each day, minutes from 1970-01-01), stats (statistics of heart rate of each day, optional) and valid
+# (minutes with samples, calculated from hr if it is not given)
+# It is a dictionary of arrays (the arrays are used by name), with vectorized accessors for the times of the days
+class UserDays(dict):
+
+    def __init__(self, arrays):
+        super().__init__(arrays)
+        if 'valid' not in self:
+            hr = np.asarray(self['hr'])
+            self['valid'] = ~np.isnan(hr) if hr.dtype.kind == 'f' else np.ones(hr.shape, dtype=bool)
+
+    # Number of days and number of minutes of each day
+    @property
+    def n_days(self):
+        return len(self['start'])
+
+    @property
+    def n_minutes(self):
+        return self['hr'].shape[1]
+
+    # Minute of the day of each sample (0 to 1439)
+    def minute_of_day(self):
+        return (np.asarray(self['start'])[:, None] + np.arange(self.n_minutes)) % (24 * 60)
+
+    # Date of each day
+    def dates(self):
+        return np.asarray(self['start']).astype('datetime64[m]').astype('datetime64[D]')
+
+    # Dates of the days (month-day)
+    def labels(self):
+        return day_labels(self['start'])
+
+    # Time of each sample of the days
+    def times(self):
+        return day_times(self['start'], self.n_minutes)
+
+    # Arrays of one day (one row of each array)
+    def day(self, id):
+        return {name: values[id] for name, values in self.items()}
+
+    # Days selected (ids or boolean mask)
+    def select(self, ids):
+        return UserDays({name: np.asarray(values)[ids] for name, values in self.items()})
+
+# ARRAYS OF A FOLDER - ONE FILE FOR EACH ARRAY AND A MANIFEST WITH THE VERSION OF THE LAST COMPLETE WRITE
+
+# Path of the manifest of the arrays of a folder
+def manifest_path(folder):
+    return f'{folder}/manifest.json'
+
+# Version of the arrays of a folder (None if the arrays were stored without a manifest, in files without version)
+def arrays_version(folder):
+    if not os.path.exists(manifest_path(folder)):
+        return None
+    with open(manifest_path(folder)) as f:
+        return json.load(f)['version']
+
+# Path of the file of an array
+def array_path(folder, name, version):
+    return f'{folder}/{name}.npy' if version is None else f'{folder}/{name}.{version}.npy'
+
+# File written last by each write of the arrays of a folder (the manifest, or the hr array if there is no manifest)
+def arrays_marker(folder):
+    return manifest_path(folder) if os.path.exists(manifest_path(folder)) else f'{folder}/hr.npy'
+
+# Write the arrays in the files of a new version and then the manifest (a reader never finds a file half written, nor
+# arrays of different writes mixed after a crash) - the files of the previous versions are removed after the manifest
+def write_arrays(folder, arrays):
+    version = (arrays_version(folder) or 0) + 1
+    for name, values in arrays.items():
+        np.save(array_path(folder, name, version), values)
+    with open(f'{manifest_path(folder)}.tmp', 'w') as f:
+        json.dump({'version': version, 'arrays': sorted(arrays)}, f)
+    os.replace(f'{manifest_path(folder)}.tmp', manifest_path(folder))
+    files = {f'{name}.{version}.npy' for name in arrays}
+    for entry in os.scandir(folder):
+        if entry.is_file() and entry.name.endswith('.npy') and entry.name not in files:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                # In Windows the files mapped by a reader can not be removed (they are removed by the next write)
+                pass
+
+# Read the arrays of a folder (the version of the manifest)
+def read_arrays(folder, names, mmap_mode=None):
+    version = arrays_version(folder)
+    try:
+        return {name: np.load(array_path(folder, name, version), mmap_mode=mmap_mode) for name in names}
+    except FileNotFoundError:
+        # The arrays were replaced by another process after reading the manifest
+        if arrays_version(folder) == version:
+            raise
+        return read_arrays(folder, names, mmap_mode)
+
+# DATASETS OF THE USERS
+
+# Folder of the dataset of a user
+def dataset_path(user):
+    return f'datasets/user{user}'
+
+# Store the dataset of a user (days of the user)
+# wait: False to write the files in the background (the days are usually used from memory by the anomaly detection
+# of the same request) - the readers of this process wait for the files of the user
+def save_dataset(user, days, wait=True):
+
+    # All the samples of the days must have values
+    if not np.all(days['valid']):
+        raise ValueError('The days have minutes without heart rate samples')
+
+    arrays = {name: np.asarray(days[name], dtype=arrays_types[name]) for name in arrays_types}
+    arrays['stats'] = np.asarray(days['stats'], dtype=stats_types)
+
+    # The previous writes of the user finish first
+    wait_dataset(user)
+    # Verify if the folder exists
+    folder = dataset_path(user)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    # The cached results of the user are not valid anymore (before the results of the new days are cached)
+    invalidate_user(user)
+    if wait:
+        write_arrays(folder, arrays)
+    else:
+        if writer['pool'] is None:
+            writer['pool'] = ThreadPoolExecutor(max_workers=1)
+        writer['pending'][user] = writer['pool'].submit(write_arrays, folder, arrays)
+
+# Thread that writes the datasets in the background and write of each user not finished yet
+writer = {'pool': None, 'pending': {}}
+
+# Wait until the dataset of a user is written (the errors of the write are raised here)
+def wait_dataset(user):
+    future = writer['pending'].pop(user, None)
+    if future is not None:
+        future.result()
+
+# True if the dataset of a user is still being written
+def dataset_pending(user):
+    return user in writer['pending'] and not writer['pending'][user].done()
+
+# Read the dataset of a user - memory mapped arrays (the values are only read when they are used)
+def load_dataset(user):
+    wait_dataset(user)
+    return UserDays(read_arrays(dataset_path(user), list(arrays_types) + ['stats'], mmap_mode='r'))
+
+# PROCESSED DAYS (BEFORE ADJUSTING THE TIME RANGE) - USED BY THE INCREMENTAL PREPROCESS
+
+# Arrays of the processed days and their types
+# date: day of each row (days from 1970-01-01)
+# hr, int and steps: one column for each minute of the day (00:00 to 23:59) - hr is NaN and int and steps are -1
+# outside of the samples of the day
+# last: time of the last sample of heart rate processed (seconds from 1970-01-01)
+days_types = {'date': np.int64, 'hr': np.float64, 'int': np.int16, 'steps': np.int16, 'last': np.int64}
+
+# Folder of the processed days of a user
+def days_path(user):
+    return f'{dataset_path(user)}/days'
+
+# Store the processed days of a user
+def save_days(user, days):
+    folder = days_path(user)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    arrays = {name: np.asarray(days[name], dtype=days_types[name]) for name in days_types}
+    arrays['stats'] = np.asarray(days['stats'], dtype=stats_types)
+    write_arrays(folder, arrays)
+
+# Read the processed days of a user (None if they are not stored)
+def load_days(user):
+    folder = days_path(user)
+    if not os.path.exists(arrays_marker(folder)):
+        return None
+    return read_arrays(folder, list(days_types) + ['stats'])
+
+# Times of the samples of each day (one row for each day)
+def day_times(start, n_minutes):
+    return (np.asarray(start)[:, None] + np.arange(n_minutes)).astype('datetime64[m]')
+
+# Dates of the days (month-day)
+def day_labels(start):
+    return [date[5:] for date in np.datetime_as_string(np.asarray(start).astype('datetime64[m]'), unit='D')]
+
+# Convert a dataset stored with the previous format (pickled dataframe) to the columnar format
+def convert_pickle(user):
+    with open(f'datasets/data_user{user}.pkl', 'rb') as f:
+        data = pickle.load(f)
+    save_dataset(user, UserDays({'hr': np.array(data['HeartRate'].tolist(), dtype=np.int16),
+                                 'int': np.array(data['Intensity'].tolist(), dtype=np.uint8),
+                                 'steps': np.array(data['Steps'].tolist(), dtype=np.int16),
+                                 'start': [np.datetime64(day[0], 'm').astype(np.int64) for day in data['Time']],
+                                 'stats': np.array(list(zip(*(data[name] for name, _ in stats_types))), dtype=stats_types)}))
+
+# MAIN FUNCTION
+
+if __name__ == '__main__':
+    # Convert the pickled dataset of the user to the columnar format
+    if len(sys.argv) > 1:
+        convert_pickle(int(sys.argv[1]))
+    else:
+        print("No user argument was provided.")
+
+# -----------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,170 @@
+# DTW DISTANCES - VECTORIZED AND PARALLEL -------------------------------------------------------------------------
+
+# Libraries
+import os
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from concurrent.futures import ProcessPoolExecutor
+from instrument import stage
+
+# DTW FUNCTIONS
+
+# DTW distance from one series (x) to a batch of series (Y, one per row) - with a Sakoe-Chiba band
+# max_dist: early abandoning - the series are abandoned when all the paths are longer than max_dist (their result is
+# a lower bound of the distance, greater than max_dist)
+def dtw_batch(x, Y, window=None, max_dist=None):
+
+    x = np.asarray(x, dtype=float)
+    Y = np.atleast_2d(np.asarray(Y, dtype=float))
+    n = len(x)
+    n_series, m = Y.shape
+
+    # Width of the band (it has to reach the last cell when the lengths are different)
+    window = band_width(n, m, window)
+
+    # Accumulated cost of the previous row, only the columns of its band (from column prev_lo) - row 0 only has the
+    # border of the matrix (column 0)
+    prev = np.zeros((n_series, 1))
+    prev_lo = 0
+    # Series still computed and result of each series
+    active = np.arange(n_series)
+    distances = np.zeros(n_series)
+
+    for i in range(1, n + 1):
+        curr, lo, hi = dtw_row(prev, prev_lo, x[i-1], Y, i, window)
+        prev, prev_lo = curr, lo
+
+        # All the paths go through every row - the minimum of the row is a lower bound of the distance
+        # (checked every few rows, the check costs almost the same as a row)
+        if max_dist is not None and i % 16 == 0:
+            row_min = curr.min(axis=1)
+            abandoned = row_min > max_dist
+            if abandoned.any():
+                distances[active[abandoned]] = row_min[abandoned]
+                active, Y, prev = active[~abandoned], Y[~abandoned], prev[~abandoned]
+                if not len(active):
+                    break
+
+    # The band of the last row always reaches the last column
+    if len(active):
+        distances[active] = prev[:, m - prev_lo]
+    return distances
+
+# Row i of the accumulated cost matrix (value xi of the series x) from the previous row - only the columns inside the
+# band are calculated and stored (columns lo to hi, column j in position j - lo), so each row costs O(band)
+# prev: previous row (its band, from column prev_lo)
+def dtw_row(prev, prev_lo, xi, Y, i, window):
+    m = Y.shape[1]
+    lo = max(1, i - window)
+    hi = min(m, i + window)
+    # Cost of each cell of the row (absolute difference, same as fastdtw for 1-D series)
+    cost = np.abs(Y[:, lo-1:hi] - xi)
+    # Previous row in the columns lo-1 to hi (infinite outside of its band)
+    above = np.full((len(Y), hi - lo + 2), np.inf)
+    first = max(prev_lo, lo - 1)
+    last = min(prev_lo + prev.shape[1] - 1, hi)
+    if first <= last:
+        above[:, first-lo+1:last-lo+2] = prev[:, first-prev_lo:last-prev_lo+1]
+    # Best of the diagonal and vertical moves
+    prev_best = np.minimum(above[:, :-1], above[:, 1:])
+    # The horizontal moves depend on the same row: D[i,j] = S[j] + min(prev_best[j'] - S[j'-1]) for j' <= j
+    cum_cost = np.cumsum(cost, axis=1)
+    curr = cum_cost + np.minimum.accumulate(prev_best - (cum_cost - cost), axis=1)
+    return curr, lo, hi
+
+# Width of the band used for two series of lengths n and m (at least the difference of the lengths)
+def band_width(n, m, window=None):
+    if window is None:
+        window = max(n, m)
+    return max(window, abs(n - m))
+
+# LB_Keogh lower bound of the DTW distance from one series (x) to a batch of series (Y) - each value of a series is
+# compared with the envelope (max and min) of the values of x inside the band
+def lb_keogh(x, Y, window=None):
+
+    x = np.asarray(x, dtype=float)
+    Y = np.atleast_2d(np.asarray(Y, dtype=float))
+    n = len(x)
+    m = Y.shape[1]
+    window = band_width(n, m, window)
+
+    # Envelope of x for each position of the series
+    right = max(m - n, 0) + window
+    upper = np.concatenate([np.full(window, -np.inf), x, np.full(right, -np.inf)])
+    lower = np.concatenate([np.full(window, np.inf), x, np.full(right, np.inf)])
+    upper = sliding_window_view(upper, 2 * window + 1)[:m].max(axis=1)
+    lower = sliding_window_view(lower, 2 * window + 1)[:m].min(axis=1)
+
+    return (np.maximum(Y - upper, 0) + np.maximum(lower - Y, 0)).sum(axis=1)
+
+# SCORING OF THE DAYS
+
+# DTW distances from each series (rows of Y) to the profile of its cluster - with a threshold, only the distances
+# needed to know if the series are greater than it are calculated exactly (the series whose lower bound is above the
+# threshold keep the bound, and the calculation of the rest is abandoned when it exceeds the threshold)
+def distances_to_profiles(profiles, labels, Y, window=None, threshold=None):
+
+    Y = np.asarray(Y, dtype=float)
+    groups = {cluster: np.flatnonzero(labels == cluster) for cluster in profiles}
+
+    # Series whose exact distance is needed
+    distances = np.zeros(len(Y))
+    pending = np.ones(len(Y), dtype=bool)
+    if threshold is not None:
+        # Above the lower bound the series is selected without calculating its distance
+        for cluster, ids in groups.items():
+            distances[ids] = lb_keogh(profiles[cluster], Y[ids], window)
+        pending = distances <= threshold
+
+    for cluster, ids in groups.items():
+        ids = ids[pending[ids]]
+        if len(ids):
+            distances[ids] = dtw_batch(profiles[cluster], Y[ids], window, max_dist=threshold)
+
+    return distances
+
+# Days shared with the worker processes (sent only once to each process)
+_shared_days = None
+
+def _init_worker(X):
+    global _shared_days
+    _shared_days = X
+
+# DTW distances of one day (row) to all the following days - one row of the condensed matrix
+def _distance_row(i, window):
+    return dtw_batch(_shared_days[i], _shared_days[i+1:], window)
+
+# Compute the condensed DTW distance matrix (upper triangle, same order as scipy's squareform)
+def distance_matrix(X, window=None, n_jobs=None):
+
+    X = np.asarray(X, dtype=float)
+    n = len(X)
+    if n < 2:
+        return np.zeros(0)
+
+    # Number of processes (all the cpus by default)
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    n_jobs = min(n_jobs, n - 1)
+
+    rows_ids = range(n - 1)
+    windows = [window] * (n - 1)
+    with stage('distance_matrix', days=n, pairs=n * (n - 1) // 2, n_jobs=n_jobs):
+        if n_jobs > 1:
+            # Each row is computed in a different process
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(X,)) as executor:
+                rows = list(executor.map(_distance_row, rows_ids, windows))
+        else:
+            _init_worker(X)
+            rows = [_distance_row(i, window) for i in rows_ids]
+
+    # The rows are consecutive in the condensed matrix
+    return np.concatenate(rows)
+
+# Obtain the index of the pair of days (i, j) in the condensed matrix
+def condensed_index(n, i, j):
+    if i > j:
+        i, j = j, i
+    return n * i - i * (i + 1) // 2 + (j - i - 1)
+
+# -----------------------------------------------------------------------------------------------------------------
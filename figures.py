@@ -0,0 +1,485 @@
+# FIGURES - RENDERED ON DEMAND FROM THE CACHED RESULTS ------------------------------------------------------------
+
+# Each figure is described by a specification (lightweight and picklable): the user, the name of the figure (path
+# inside figures/user{user}, without extension), its size and, for each subplot, the calls to the methods of its axes
+# with the arrays of the series (e.g. ('plot', (x, y), {'label': 'HeartRate'})). The specifications are rendered
+# with the object oriented API of matplotlib (a Figure with an Agg canvas, without the global state of pyplot), in a
+# pool of processes: the figures of a phase are rendered concurrently, and in the worker without blocking the
+# requests (the web app asks for the figures ready of a user with figures_status)
+
+# Libraries
+import os
+import sys
+import numpy as np
+import matplotlib
+# Headless backend (no window is needed to save the figures)
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import matplotlib.dates as mdates
+from concurrent.futures import ProcessPoolExecutor
+from results import load_result
+from instrument import stage
+
+# SPECIFICATIONS OF THE FIGURES
+
+# New figure of a user (without subplots)
+def new_figure(user, fig_name='', size=(20, 10)):
+    return {'user': user, 'name': fig_name, 'size': size, 'axes': [], 'tight_layout': False}
+
+# Add a subplot (position: rows, columns and index) - returns the function that adds the calls to the methods of its
+# axes, e.g. ax('scatter', x, y, alpha=0.5)
+def add_axes(figure, position=(1, 1, 1)):
+    calls = []
+    figure['axes'].append({'position': position, 'calls': calls})
+    def ax(method, *args, **kwargs):
+        calls.append((method, args, kwargs))
+    return ax
+
+# Path of the file of a figure
+def figure_path(spec):
+    return f"figures/user{spec['user']}/{spec['name']}.png"
+
+# Render a figure and save it in the folder of the user (in any process - only the specification is needed)
+def render(spec):
+    with stage('figures.render', user=spec['user'], figure=spec['name']):
+        figure = Figure(figsize=spec['size'])
+        FigureCanvasAgg(figure)
+        for axes in spec['axes']:
+            ax = figure.add_subplot(*axes['position'])
+            for method, args, kwargs in axes['calls']:
+                # Format of the dates of the x axis (e.g. hh:mm)
+                if method == 'date_format':
+                    ax.xaxis.set_major_formatter(mdates.DateFormatter(*args))
+                    ax.xaxis.set_minor_formatter(mdates.DateFormatter(*args))
+                else:
+                    getattr(ax, method)(*args, **kwargs)
+        if spec['tight_layout']:
+            figure.tight_layout()
+        # Verify if the folder exists
+        path = figure_path(spec)
+        folder = os.path.dirname(path)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        # Save the figure
+        figure.savefig(path, bbox_inches='tight')
+    return spec['name']
+
+# RENDER QUEUE
+
+# Pool of processes that render the figures (created once) and figures of the last request of each user and phase
+# that is not waited for (name and future, by (user, phase))
+# wait: the functions that render all the figures of a phase wait for them (False in the worker)
+renderer = {'pool': None, 'workers': 0, 'jobs': {}, 'wait': True}
+
+def get_renderer(n_workers=None):
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    if renderer['pool'] is None or renderer['workers'] != n_workers:
+        if renderer['pool'] is not None:
+            renderer['pool'].shutdown()
+        renderer['pool'] = ProcessPoolExecutor(max_workers=n_workers)
+        renderer['workers'] = n_workers
+    return renderer['pool']
+
+# Add the figures of a phase to the queue of the renderer (waiting for them if wait is True, by default
+# renderer['wait']) - the figures not waited for replace the previous ones of the same users and phase (the ones not
+# started yet are cancelled)
+def render_specs(specs, wait=None, n_workers=None, phase=None):
+    pool = get_renderer(n_workers)
+    if wait is None:
+        wait = renderer['wait']
+    jobs = {}
+    for spec in specs:
+        jobs.setdefault((spec['user'], phase), {})[spec['name']] = pool.submit(render, spec)
+    if wait:
+        for user_jobs in jobs.values():
+            for future in user_jobs.values():
+                future.result()
+        return
+    for key, user_jobs in jobs.items():
+        for future in renderer['jobs'].get(key, {}).values():
+            future.cancel()
+        renderer['jobs'][key] = user_jobs
+
+# Figures requested of a user (last request of each phase): number of figures, figures ready, figures pending and
+# figures with errors
+def figures_status(user):
+    jobs = {}
+    for (job_user, _), user_jobs in renderer['jobs'].items():
+        if job_user == user:
+            jobs.update({name: future for name, future in user_jobs.items() if not future.cancelled()})
+    ready = [name for name, future in jobs.items() if future.done() and future.exception() is None]
+    errors = {name: f'{type(future.exception()).__name__}: {future.exception()}' for name, future in jobs.items()
+              if future.done() and future.exception() is not None}
+    return {'total': len(jobs), 'ready': ready, 'pending': len(jobs) - len(ready) - len(errors), 'errors': errors}
+
+# PREPROCESS FIGURES ----------------------------------------------------------------------------------------------
+
+# Visualize ALL the data
+def visualize_all_data(user, result):
+
+    data_hr_user = result['data_hr_user']
+    figure = new_figure(user, 'all')
+    ax = add_axes(figure)
+    x = data_hr_user['Time']
+    y = data_hr_user['HeartRate']
+    ax('scatter', x.to_numpy(), y.to_numpy())
+
+    # The regular values are between 60 and 100
+    ax('axhline', y=60, color='red', linestyle='--', label='60 bpm')
+    ax('axhline', y=100, color='red', linestyle='--', label='100 bpm')
+
+    ax('set_xlabel', '\nTime')
+    ax('set_ylabel', 'bpm\n')
+    ax('set_title', f'HeartRate of user {user} from {x.iloc[0].date()} to {x.iloc[-1].date()}')
+    ax('set_ylim', 30, 220)
+    return figure
+
+# Visualize the data of one day (all the samples)
+def visualize_day_data(user, result, day):
+
+    data_hr_user = result['data_hr_user']
+    data_hr_user_1day = data_hr_user[data_hr_user['Time'].dt.date == day]
+    figure = new_figure(user, f'{day}')
+    ax = add_axes(figure)
+    x = data_hr_user_1day['Time']
+    y = data_hr_user_1day['HeartRate']
+    ax('scatter', x.to_numpy(), y.to_numpy())
+    ax('axhline', y=60, color='red', linestyle='--', label='60 bpm')
+    ax('axhline', y=100, color='red', linestyle='--', label='100 bpm')
+    ax('set_xlabel', '\nTime')
+    ax('set_ylabel', 'bpm\n')
+    ax('set_title', f'HeartRate of user {user} on {day}')
+    ax('set_ylim', 30, 220)
+    return figure
+
+# Plot HeartRate / Intensity (or Steps) of one day
+def relation_hr_feature(user, result, day, feature):
+
+    id = result['dates'].index(day)
+    x = result['day_hr'][id]
+    y = result[f'day_{feature}'][id]
+    name = 'intensities' if feature == 'int' else 'steps'
+    # Check if the lengths of the features match
+    if len(x) != len(y):
+        print(f'*Lengths of heart rates and {name} do not match - graphic not created')
+        return None
+    figure = new_figure(user, f'hr_{feature if feature == "int" else "step"}_{day}')
+    ax = add_axes(figure)
+    ax('scatter', x, y, alpha=0.5)
+    ax('set_xlabel', '\nHeartRate (bpm)')
+    ax('set_xlim', 30, 220)
+    if feature == 'int':
+        ax('set_ylabel', 'Intensity (0: sedentary - 3: very active)\n')
+        ax('set_title', f'HeartRate/Intensity of user {user} on {day}')
+        ax('set_ylim', -0.5, 3.5)
+        ax('set_yticks', [0, 1, 2, 3])
+    else:
+        ax('set_ylabel', 'Steps\n')
+        ax('set_title', f'HeartRate/Steps of user {user} on {day}')
+        ax('set_ylim', -5, 155)
+    ax('grid', True)
+    return figure
+
+# Plot HeartRate and Intensity (or Steps) by Time of one day
+def relation_hr_feature_time(user, result, day, feature):
+
+    id = result['dates'].index(day)
+    x = result['day_time'][id]
+    y = result[f'day_{feature}'][id]
+    name = 'intensities' if feature == 'int' else 'steps'
+    # Check if the lengths of the features match
+    if len(x) != len(y):
+        print(f'*Lengths of heart rates and {name} do not match - graphic not created')
+        return None
+    figure = new_figure(user, f'hr_{feature if feature == "int" else "step"}_time_{day}')
+    # Intensity (or Steps) plot
+    ax = add_axes(figure, (2, 1, 2))
+    if feature == 'int':
+        ax('scatter', x, y, color='purple', label='Intensity', alpha=0.5)
+        ax('set_ylabel', 'Intensity (0: sedentary - 3: very active)\n')
+        ax('set_ylim', -0.5, 3.5)
+    else:
+        ax('plot', x, y, label='Steps', color='purple', alpha=0.5)
+        ax('set_ylabel', 'Steps\n')
+        ax('set_ylim', -5, 155)
+    ax('set_xlabel', '\nTime')
+    ax('grid', True)
+    ax('legend')
+    # HeartRate plot
+    ax = add_axes(figure, (2, 1, 1))
+    ax('plot', x, result['day_hr'][id], label='HeartRate', alpha=0.5)
+    ax('set_xlabel', '\nTime')
+    ax('set_ylabel', 'HeartRate (bpm)\n')
+    ax('set_title', f'HR and {"Intensity" if feature == "int" else "Steps"} of user {user} on {day}')
+    ax('set_ylim', 30, 220)
+    ax('grid', True)
+    ax('legend')
+    # Adjust space between subplots
+    figure['tight_layout'] = True
+    return figure
+
+# All the figures of the preprocess phase
+def preprocess_figures(user, result):
+    figures = [visualize_all_data(user, result)]
+    for day in result['data_hr_user']['Time'].dt.date.unique().tolist():
+        figures.append(visualize_day_data(user, result, day))
+    for day in result['dates']:
+        figures.append(relation_hr_feature(user, result, day, 'int'))
+        figures.append(relation_hr_feature_time(user, result, day, 'int'))
+        figures.append(relation_hr_feature(user, result, day, 'steps'))
+        figures.append(relation_hr_feature_time(user, result, day, 'steps'))
+    return [figure for figure in figures if figure is not None]
+
+# Render all the figures of the preprocess phase
+def plot_preprocess(user, result, wait=None):
+    render_specs(preprocess_figures(user, result), wait=wait, phase='preprocess')
+
+
+# ANOMALY DETECTION FIGURES ---------------------------------------------------------------------------------------
+
+# Date of a day (month-day) - from the times of its samples
+def day_label(day):
+    return str(day[0].astype('datetime64[D]'))[5:]
+
+# Put a common date for all the days - to make a representation of hh:min
+def common_date(day):
+    return np.datetime64('2000-01-01') + (day - day.astype('datetime64[D]'))
+
+# Put a common year for all the days - to make a representation of mm-dd
+def common_year(day):
+    return np.datetime64(f'2000-{day_label(day)}')
+
+# Times (common date) and heart rates of an average profile - only the minutes of the day with samples
+def profile_values(profile):
+    minutes = np.flatnonzero(~np.isnan(profile))
+    return np.datetime64('2000-01-01T00:00') + minutes.astype('timedelta64[m]'), profile[minutes]
+
+# Function to apply format to the figures (and give them their name)
+def plot_format(figure, ax, fig_title, fig_name, folder=None, cl=None, k=None):
+
+    if cl is not None:
+        fig_title = f', Cluster {cl}{fig_title}'
+        fig_name = f'_cluster_{cl}{fig_name}'
+
+    # Format for the figure
+    ax('set_xlabel', 'Time')
+    ax('set_ylabel', 'Heart rate')
+    if folder is None:
+        ax('set_title', f'{fig_title}')
+    elif k is None:
+        ax('set_title', f'Isolation Forest{fig_title}')
+    else:
+        ax('set_title', f'Agglomerative Clustering k={k}{fig_title}')
+    ax('tick_params', axis='x', labelrotation=45)
+
+    # Format hh:mm
+    ax('date_format', '%H:%M')
+
+    ax('set_ylim', 30, 220)
+    ax('grid', True)
+    ax('legend')
+
+    # Name of the figure
+    if folder is None:
+        figure['name'] = fig_name
+    elif k is None:
+        figure['name'] = f'{folder}/iso{fig_name}'
+    else:
+        figure['name'] = f'{folder}/{k}_agglom{fig_name}'
+    return figure
+
+# Figure of one cluster of a module (days of the cluster and average profile)
+def plot_cluster(user, result, module, cluster):
+
+    day_time = result['day_time']
+    day_hr = result['day_hr']
+    k_labels = module['labels']
+
+    figure = new_figure(user)
+    ax = add_axes(figure)
+    # Plot for each day
+    for day_index in np.where(k_labels == cluster)[0]:
+        days = day_time[day_index]
+        ax('plot', common_date(days), np.asarray(day_hr[day_index]), label=f'{day_label(days)}', alpha=0.5)
+
+    # Plot the average profile (in the same figure)
+    average_times, average_hrs = profile_values(module['profiles'][cluster])
+    ax('plot', average_times, average_hrs, label='Average profile', linewidth=2, color='black')
+
+    # Apply format to the figure
+    return plot_format(figure, ax, fig_title='', fig_name='', folder=module['folder'], cl=cluster, k=module['k'])
+
+# Figure with the average profiles of all clusters of a module
+def plot_avg_profiles(user, module):
+    figure = new_figure(user)
+    ax = add_axes(figure)
+    for cluster in np.unique(module['labels']):
+        average_times, average_hrs = profile_values(module['profiles'][cluster])
+        ax('plot', average_times, average_hrs, label=f'Cluster {cluster}', alpha=0.5)
+    # Apply format to the figure
+    return plot_format(figure, ax, fig_title=', Average Profiles', fig_name='_avg', folder=module['folder'], k=module['k'])
+
+# Figure with the most distant days of a module
+def plot_most_distant(user, result, module):
+    figure = new_figure(user)
+    ax = add_axes(figure)
+    for day, hr in zip(result['day_time'], result['day_hr']):
+        if day_label(day) in module['anom_days']:
+            ax('plot', common_date(day), np.asarray(hr), label=f'{day_label(day)}', alpha=0.5)
+    # Apply format to the figure
+    return plot_format(figure, ax, fig_title=', Most Distant Days', fig_name='_most_dist', folder=module['folder'],
+                       k=module['k'])
+
+# Figure with the anomalies of the system
+def plot_anomalies(user, result):
+    figure = new_figure(user)
+    ax = add_axes(figure)
+    for day, hr in zip(result['day_time'], result['day_hr']):
+        if day_label(day) in result['anom_days']:
+            # Adjust the date to be the same in all vectors - only use of hh:min
+            ax('plot', common_date(day), np.asarray(hr), label=f'{day_label(day)}', alpha=0.5)
+    # Apply format to the figure
+    return plot_format(figure, ax, fig_title='Anomalous Days', fig_name='_anom_days')
+
+# Figure with the anomalies of all modules
+def plot_all_anomalies(user, result):
+
+    day_time = result['day_time']
+    anom_days = result['anom_days']
+    modules = result['modules']
+
+    # Create a list with all the anomalies dates
+    all_anom_days = set(anom_days).union(*(module['anom_days'] for module in modules))
+    # Get the unique dates and sort them
+    all_dates = sorted(set(common_year(day) for day in day_time if day_label(day) in all_anom_days))
+
+    figure = new_figure(user, '_all_anom_days')
+    ax = add_axes(figure)
+    # Final system (row 0) and one row for each module
+    rows = [anom_days] + [module['anom_days'] for module in modules]
+    for row, row_anom_days in enumerate(rows):
+        dates = np.array([common_year(day) for day in day_time if day_label(day) in row_anom_days], dtype='datetime64[D]')
+        ax('scatter', dates, np.full(len(dates), row), s=100, color='firebrick' if row == 0 else 'tomato')
+
+    # Apply format to the figure
+    ax('set_xlabel', 'Days')
+    ax('set_title', 'Anomalous Days')
+    ax('tick_params', axis='x', labelrotation=45)
+    # Format mm-dd
+    ax('date_format', '%m-%d')
+    # Set the ticks for each unique date with its value
+    ax('set_xticks', all_dates)
+    ax('set_xticklabels', [str(date)[5:] for date in all_dates])
+
+    ax('invert_yaxis')
+    # Descriptive labels in the y axis (with the weight of the module in the voting system if it is not 1)
+    y_labels = ['FINAL SYSTEM'] + [f'Module {i}: {module["title"]}' + (f' (weight {module["weight"]})' if module.get('weight', 1) != 1 else '')
+                                   for i, module in enumerate(modules, start=1)]
+    ax('set_yticks', range(len(y_labels)), y_labels)
+
+    ax('grid', True)
+    return figure
+
+# All the figures of the anomaly detection phase
+def anom_det_figures(user, result):
+    figures = []
+    for module in result['modules']:
+        for cluster in np.unique(module['labels']):
+            figures.append(plot_cluster(user, result, module, cluster))
+        figures.append(plot_avg_profiles(user, module))
+        figures.append(plot_most_distant(user, result, module))
+    figures.append(plot_anomalies(user, result))
+    figures.append(plot_all_anomalies(user, result))
+    return figures
+
+# Render all the figures of the anomaly detection phase
+def plot_anom_det(user, result, wait=None):
+    render_specs(anom_det_figures(user, result), wait=wait, phase='anom_det')
+
+
+# RENDER ONE FIGURE -----------------------------------------------------------------------------------------------
+
+# Specification of the figure with the name used by the web app (path inside figures/user{user}, without extension)
+# - None if the figure is not available
+def figure_spec(user, fig_name):
+
+    # Anomaly detection figures
+    if fig_name.startswith('_') or '/' in fig_name:
+        result = load_result('anom_det', user)
+        if result is None:
+            return None
+        if fig_name == '_anom_days':
+            return plot_anomalies(user, result)
+        if fig_name == '_all_anom_days':
+            return plot_all_anomalies(user, result)
+        folder, name = fig_name.split('/', 1)
+        for module in result['modules']:
+            if module['folder'] != folder or not name.startswith(f"{module['k']}_agglom_"):
+                continue
+            name = name[len(f"{module['k']}_agglom_"):]
+            if name == 'avg':
+                return plot_avg_profiles(user, module)
+            elif name == 'most_dist':
+                return plot_most_distant(user, result, module)
+            elif name.startswith('cluster_'):
+                # The number of the cluster comes from the path requested (it may not be a number)
+                cluster = name[len('cluster_'):]
+                if cluster.isdigit() and int(cluster) in module['labels']:
+                    return plot_cluster(user, result, module, int(cluster))
+            return None
+        return None
+
+    # Preprocess figures
+    result = load_result('preprocess', user)
+    if result is None:
+        return None
+    if fig_name == 'all':
+        return visualize_all_data(user, result)
+    # Figures of one day (the date is at the end of the name)
+    prefix, _, day = fig_name.rpartition('_') if '_' in fig_name else ('', '', fig_name)
+    days = {f'{date}': date for date in result['data_hr_user']['Time'].dt.date.unique().tolist()}
+    if day not in days:
+        return None
+    day = days[day]
+    if prefix == '':
+        return visualize_day_data(user, result, day)
+    elif day not in result['dates']:
+        return None
+    elif prefix == 'hr_int':
+        return relation_hr_feature(user, result, day, 'int')
+    elif prefix == 'hr_int_time':
+        return relation_hr_feature_time(user, result, day, 'int')
+    elif prefix == 'hr_step':
+        return relation_hr_feature(user, result, day, 'steps')
+    elif prefix == 'hr_step_time':
+        return relation_hr_feature_time(user, result, day, 'steps')
+    return None
+
+# Render one figure in this process (if the figure is in the queue of the renderer, it waits for it - and it is
+# rendered again if its file was removed by a new result)
+def render_figure(user, fig_name):
+    for (job_user, _), user_jobs in renderer['jobs'].items():
+        future = user_jobs.get(fig_name) if job_user == user else None
+        if future is not None and not future.cancelled() and future.exception() is None:
+            if os.path.exists(figure_path({'user': user, 'name': fig_name})):
+                return True
+    spec = figure_spec(user, fig_name)
+    if spec is None:
+        return False
+    render(spec)
+    return True
+
+# MAIN FUNCTION
+
+if __name__ == '__main__':
+    # Arguments: user and name of the figure (e.g. hr_int_2016-04-02 or all)
+    if len(sys.argv) > 2:
+        user = int(sys.argv[1])
+        if not render_figure(user, sys.argv[2]):
+            print("The figure requested is not available.")
+    else:
+        print("The user and figure arguments were not provided.")
+
+# -----------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,97 @@
+# INSTRUMENTATION - TIME, CPU TIME AND MEMORY OF EACH STAGE OF THE PHASES -----------------------------------------
+
+# Each stage writes one record (JSON line) with its name, wall time, cpu time, peak memory of the process and the
+# number of items processed (rows, days...), e.g.:
+#   {"stage": "preprocess.fill_missing_values", "wall": 0.012, "cpu": 0.011, "peak_rss": 157286400, "minutes": 31250}
+# The records are written to the standard error or to a file (separated from the results of the standard output),
+# only if the output is configured (environment variable INSTRUMENT_OUTPUT: 'stderr' or the path of a file). Only the
+# clock and the peak memory are read for each stage, so it can be used in production
+# The stages of the modules executed in other processes are recorded by those processes (same output, other pid)
+
+# Libraries
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+# Peak memory of the process (only available in POSIX systems - None in Windows)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Output of the records: None (not recorded), 'stderr' or the path of a file (the records are added at the end)
+# records: list where the records are also stored (None if they are not stored)
+settings = {'output': os.environ.get('INSTRUMENT_OUTPUT') or None, 'records': None}
+
+# Names of the stages being executed (the name of a stage includes the stages that contain it)
+stack = []
+
+# Change the output of the records (collect: store them in settings['records'] too)
+def configure(output=None, collect=False):
+    settings['output'] = output
+    settings['records'] = [] if collect else None
+
+def enabled():
+    return settings['output'] is not None or settings['records'] is not None
+
+# Peak memory of the process until now (bytes - ru_maxrss is in kilobytes in Linux, None if it is not available)
+def peak_rss():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+# Write a record
+def emit(record):
+    if settings['records'] is not None:
+        settings['records'].append(record)
+    if settings['output'] == 'stderr':
+        sys.stderr.write(json.dumps(record) + '\n')
+        sys.stderr.flush()
+    elif settings['output'] is not None:
+        with open(settings['output'], 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+# Record of a stage that took the time since (wall, cpu)
+def stage_record(name, wall, cpu, fields):
+    return dict({'stage': name, 'wall': round(time.perf_counter() - wall, 6), 'cpu': round(time.process_time() - cpu, 6),
+                 'peak_rss': peak_rss(), 'pid': os.getpid()}, **fields)
+
+# STAGES
+
+# Stage that contains a block of code: with stage('load_data', user=user) as record: ... record['rows'] = n
+# (the fields and the items added to the record are written with the times)
+@contextmanager
+def stage(name, **fields):
+    if not enabled():
+        yield {}
+        return
+    stack.append(name)
+    full_name = '.'.join(stack)
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield fields
+    except BaseException as error:
+        fields['error'] = type(error).__name__
+        raise
+    finally:
+        stack.pop()
+        emit(stage_record(full_name, wall, cpu, fields))
+
+# Record of a stage measured somewhere else (e.g. the time of a module executed in another process)
+def report_stage(name, **fields):
+    if enabled():
+        emit(dict({'stage': '.'.join(stack + [name]), 'pid': os.getpid()}, **fields))
+
+# Consecutive stages of a long function - each call of the returned function records the stage that ends there:
+# mark = stage_marks('preprocess', user=user) ... mark('fill_missing_values', minutes=n)
+def stage_marks(prefix, **fields):
+    last = {'wall': time.perf_counter(), 'cpu': time.process_time()}
+    def mark(name, **items):
+        if enabled():
+            emit(stage_record('.'.join(stack + [prefix, name]), last['wall'], last['cpu'], dict(fields, **items)))
+        last['wall'], last['cpu'] = time.perf_counter(), time.process_time()
+    return mark
+
+# -----------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,188 @@
+# MODELS OF THE USERS - FITTED ONCE AND USED TO SCORE THE NEW DAYS WITHOUT CLUSTERING AGAIN -----------------------
+
+# The model of a user stores for each module the clusters of the days, the centroid of each cluster (features of the
+# module, after its reduction), the average profile of each cluster and the distance from which a day is an anomaly. A
+# new day is assigned to the nearest centroid (the days used to fit the model keep their cluster) and it is an anomaly
+# with the same decision rule as the anomaly detection (distance to the profile of that cluster over the threshold, or
+# a cluster with min_days_in_cluster days or less). The model is fitted again only when the new days drift away from it
+# (or when it is not valid for the dataset anymore)
+
+# Libraries
+import os
+import sys
+import json
+import time
+import pickle
+import numpy as np
+from results import save_result
+from dataset import UserDays, load_dataset
+from anom_det import parameters, results_version, enabled_modules, detect, voting, result_key
+from anom_det import reduced_features, multi_resolution, score_days, module_anomalies
+
+# Version of the format of the models (the models of previous versions are fitted again)
+model_version = 3
+
+# Limits of the drift of the new days - the model is fitted again when they are exceeded:
+# max_new_days: new days scored with the model (fraction of the days used to fit it)
+# max_anom_rate: fraction of the new days detected as anomalies (the model is expected to detect anom_threshold)
+drift_parameters = {'max_new_days': 0.2, 'max_anom_rate': 0.3}
+
+# Path of the model of a user
+def model_path(user):
+    return f'models/model_user{user}.pkl'
+
+# Store the model of a user
+def save_model(user, model):
+    # Verify if the folder exists
+    if not os.path.exists('models'):
+        os.makedirs('models')
+    # Write in a temporary file first (a reader never finds a file half written)
+    path = model_path(user)
+    with open(f'{path}.tmp', 'wb') as f:
+        pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f'{path}.tmp', path)
+
+# Read the model of a user (None if it is not stored or if it was stored with another version)
+def load_model(user):
+    try:
+        with open(model_path(user), 'rb') as f:
+            model = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    if model.get('version') != (model_version, results_version):
+        return None
+    return model
+
+# FIT
+
+# Fit the model of a user with all the days of its dataset
+def fit_model(user, data=None, n_jobs=None):
+
+    if data is None:
+        data = load_dataset(user)
+    elif not isinstance(data, UserDays):
+        data = UserDays(data)
+
+    modules = enabled_modules()
+    result = detect(data, modules, n_jobs=n_jobs)
+    # The figures are rendered from the result of the last fit
+    save_result('anom_det', user, result, result_key(data, modules))
+
+    inputs = {name: data[name] for name in ['hr', 'int', 'steps', 'start', 'stats']}
+    model_modules = []
+    for module, module_result in zip(modules, result['modules']):
+        # Centroid of each cluster with the features of the module, reduced as in the clustering (one row for each
+        # cluster), and the cluster of each day of the fit (position in clusters)
+        X, reduction_state = reduced_features(module, inputs)
+        k_labels = module_result['labels']
+        clusters, labels, sizes = np.unique(k_labels, return_inverse=True, return_counts=True)
+        centroids = np.array([X[labels == i].mean(axis=0) for i in range(len(clusters))])
+        model_modules.append(dict(module, clusters=clusters, sizes=sizes, labels=labels, centroids=centroids,
+                                  reduction_state=reduction_state, profiles=module_result['profiles'][clusters],
+                                  distance_threshold=module_result['distance_threshold']))
+
+    model = {'version': (model_version, results_version), 'fit_time': time.time(), 'parameters': dict(parameters),
+             'n_days': data.n_days, 'n_minutes': data.n_minutes, 'last_start': int(data['start'][-1]),
+             'starts': np.array(data['start']), 'registry': modules, 'modules': model_modules,
+             'anom_days': result['anom_days'], 'new_days': {}}
+    save_model(user, model)
+    return model
+
+# SCORE
+
+# Anomalies of new days (days of the user, same format as the dataset) - without clustering again
+# Returns the anomalous days (month-day) and the days detected by each module
+def score(model, new_days):
+
+    if not isinstance(new_days, UserDays):
+        new_days = UserDays(new_days)
+    inputs = {name: new_days[name] for name in ['hr', 'int', 'steps', 'start', 'stats']}
+    day_hr = np.asarray(inputs['hr'], dtype=float)
+    if not len(day_hr):
+        return [], {}
+    if day_hr.shape[1] != model['n_minutes']:
+        raise ValueError('The days have a different number of samples than the days of the model.')
+    dates = new_days.labels()
+    # Position of the days in the days used to fit the model (-1 for the new days)
+    fit_ids = {int(start): i for i, start in enumerate(model['starts'])}
+    fit_ids = np.array([fit_ids.get(int(start), -1) for start in inputs['start']])
+    fitted = fit_ids >= 0
+
+    modules = []
+    for module in model['modules']:
+        # Nearest centroid of each day (features reduced as in the fit) - the days of the fit keep their cluster
+        X, _ = reduced_features(module, inputs, module['reduction_state'])
+        nearest = ((X[:, None, :] - module['centroids'][None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+        nearest[fitted] = module['labels'][fit_ids[fitted]]
+        # Distance to the profile of the cluster (only the minutes with samples) - exact only if it is needed
+        profiles = {i: profile[~np.isnan(profile)] for i, profile in enumerate(module['profiles'])}
+        threshold = module['distance_threshold']
+        # Heart rate of the days with the resolution of the module
+        resolution = module['resolution']
+        module_hr = multi_resolution(day_hr, [resolution])[resolution]
+        distances = score_days(profiles, nearest, module_hr, resolution, parameters, threshold=threshold)
+        # Same decision rule as the anomaly detection
+        anom_ids = module_anomalies(distances, threshold, module['sizes'][nearest], model['parameters'])
+        modules.append({'folder': module['folder'], 'weight': module['weight'],
+                        'anom_days': [dates[i] for i in anom_ids]})
+
+    anom_days = voting(modules, parameters)
+    return anom_days, {module['folder']: module['anom_days'] for module in modules}
+
+# Drift of the new days scored with the model - True if the model has to be fitted again
+def drift_exceeded(model):
+    n_new = len(model['new_days'])
+    if n_new > drift_parameters['max_new_days'] * model['n_days']:
+        return True
+    n_anom = sum(model['new_days'].values())
+    # A few days are not enough to estimate the rate of anomalies
+    return n_new >= 5 and n_anom / n_new > drift_parameters['max_anom_rate']
+
+# UPDATE (SCHEDULED)
+
+# Anomalies of the user with its model: the days added to the dataset after the fit are scored, and the model is fitted
+# again if it is not valid for the dataset (different parameters, modules or range of time) or if the drift exceeds the limits
+def update(user, data=None, n_jobs=None):
+
+    if data is None:
+        data = load_dataset(user)
+    elif not isinstance(data, UserDays):
+        data = UserDays(data)
+    model = load_model(user)
+
+    if model is not None and (model['parameters'] != parameters or model['registry'] != enabled_modules()
+                              or model['n_minutes'] != data.n_minutes):
+        model = None
+
+    if model is not None:
+        new = np.flatnonzero(np.asarray(data['start']) > model['last_start'])
+        new_days = data.select(new)
+        anom_days, _ = score(model, new_days)
+        for date in new_days.labels():
+            model['new_days'][date] = date in anom_days
+        model['last_start'] = int(data['start'][-1])
+        if not drift_exceeded(model):
+            save_model(user, model)
+            new_anom_days = [date for date, anomaly in model['new_days'].items() if anomaly]
+            return {'fitted': False, 'new_days': len(new), 'anom_days': sorted(model['anom_days'] + new_anom_days)}
+
+    model = fit_model(user, data, n_jobs=n_jobs)
+    return {'fitted': True, 'new_days': 0, 'anom_days': model['anom_days']}
+
+# MAIN FUNCTION
+
+if __name__ == '__main__':
+    # Arguments: user and operation (fit: fit the model again, update: score the new days - by default)
+    if len(sys.argv) > 1:
+        user = int(sys.argv[1])
+        operation = sys.argv[2] if len(sys.argv) > 2 else 'update'
+        if operation == 'fit':
+            print(json.dumps(fit_model(user)['anom_days']))
+        elif operation == 'update':
+            print(json.dumps(update(user)))
+        else:
+            print("The operation argument provided is not valid.")
+    else:
+        print("No user argument was provided.")
+
+# -----------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,131 @@
+# ONLINE ANOMALY DETECTION - THE CURRENT DAY IS SCORED MINUTE BY MINUTE -------------------------------------------
+
+# The average profiles of the clusters and the learned thresholds of each module are read from the results of the
+# anomaly detection. Each new minute of heart rate adds one row to the DTW matrix of the day with each profile (only
+# the cells inside the Sakoe-Chiba band are computed and kept, so a minute costs O(band) for each profile), and the
+# minimum of the row is a lower bound of the distance of the whole day: when it exceeds the threshold of a module, the
+# day is an anomaly for that module whatever the rest of the day
+
+# Libraries
+import sys
+import json
+import numpy as np
+from dtw import dtw_row, band_width
+from results import load_result
+from dataset import load_dataset
+from anom_det import parameters, voting
+
+# STATE OF THE DAY
+
+# Start the scoring of a day (date: 'YYYY-MM-DD') with the results of the anomaly detection of the user
+# first_minute: first minute of the range of time of the day (minutes from 00:00, the most usual of the days by default)
+def start_day(user, date, result=None, first_minute=None):
+
+    if result is None:
+        result = load_result('anom_det', user)
+        if result is None:
+            raise ValueError('No anomaly detection results for the user.')
+
+    # Range of time of the days: same number of minutes as the days of the results
+    day_time = result['day_time']
+    n_minutes = day_time.shape[1]
+    if first_minute is None:
+        first_minutes = (day_time[:, 0] - day_time[:, 0].astype('datetime64[D]')).astype(int)
+        first_minute = int(np.bincount(first_minutes).argmax())
+    window = None if parameters['dtw_band'] is None else max(1, int(n_minutes * parameters['dtw_band']))
+
+    modules = []
+    for module in result['modules']:
+        # Heart rate vector of the typical day of each cluster (only the minutes with samples) - the profiles with the
+        # same length are computed together
+        groups = {}
+        for cluster in np.unique(module['labels']):
+            profile = module['profiles'][cluster]
+            groups.setdefault(int((~np.isnan(profile)).sum()), []).append((int(cluster), profile[~np.isnan(profile)]))
+        module_groups = []
+        for m, profiles in groups.items():
+            # Last row of the DTW matrices (only its band, from the column prev_lo) - row 0 is the border (column 0)
+            module_groups.append({'clusters': [cluster for cluster, _ in profiles],
+                                  'profiles': np.array([profile for _, profile in profiles]),
+                                  'window': band_width(n_minutes, m, window), 'prev': np.zeros((len(profiles), 1)),
+                                  'prev_lo': 0, 'lower': np.zeros(len(profiles))})
+        modules.append({'folder': module['folder'], 'title': module['title'], 'weight': module.get('weight', 1),
+                        'threshold': module['distance_threshold'], 'groups': module_groups})
+
+    start = np.datetime64(date, 'D') + np.timedelta64(first_minute, 'm')
+    return {'user': user, 'date': str(np.datetime64(date, 'D')), 'start': start, 'n_minutes': n_minutes,
+            'rows': 0, 'last_hr': None, 'modules': modules}
+
+# Add one row to the DTW matrices of all the profiles - O(band) for each profile
+def add_row(state, hr):
+    state['rows'] += 1
+    row = state['rows']
+    for module in state['modules']:
+        for group in module['groups']:
+            curr, lo, hi = dtw_row(group['prev'], group['prev_lo'], hr, group['profiles'], row, group['window'])
+            group['prev'], group['prev_lo'] = curr, lo
+            # At the end of the day the distance is exact (the band of the last row reaches the last column)
+            if row == state['n_minutes']:
+                group['lower'] = curr[:, hi - lo]
+            else:
+                group['lower'] = curr.min(axis=1)
+    state['last_hr'] = hr
+
+# Add the heart rate of a minute of the day (time: datetime64 or string) - the minutes outside of the range of time
+# of the days or already added are ignored, and the missing minutes before it are filled with the previous value
+def add_minute(state, time, hr):
+    i = int((np.datetime64(time, 'm') - state['start']) / np.timedelta64(1, 'm'))
+    if i < state['rows'] or i >= state['n_minutes'] or np.isnan(hr):
+        return day_status(state)
+    for _ in range(state['rows'], i):
+        add_row(state, hr if state['last_hr'] is None else state['last_hr'])
+    add_row(state, float(hr))
+    return day_status(state)
+
+# Provisional result of the day: distance of each module to the nearest profile (lower bound of the distance of the
+# whole day, exact when the day is complete) and anomaly flags (of each module and of the voting system)
+def day_status(state):
+    modules = []
+    for module in state['modules']:
+        clusters = [cluster for group in module['groups'] for cluster in group['clusters']]
+        lower = np.concatenate([group['lower'] for group in module['groups']])
+        nearest = int(np.argmin(lower))
+        modules.append({'folder': module['folder'], 'title': module['title'], 'weight': module['weight'],
+                        'cluster': clusters[nearest], 'distance': round(float(lower[nearest]), 3),
+                        'threshold': round(module['threshold'], 3),
+                        'anomaly': bool(state['rows'] and lower[nearest] > module['threshold'])})
+    votes = [dict(module, anom_days=[state['date']] if module['anomaly'] else []) for module in modules]
+    return {'date': state['date'], 'minutes': state['rows'], 'complete': state['rows'] == state['n_minutes'],
+            'modules': modules, 'anomaly': len(voting(votes, parameters)) > 0}
+
+# MAIN FUNCTION
+
+# Replay a day of the dataset of the user minute by minute - shows when the day is detected as an anomaly
+def main(user, date):
+    data = load_dataset(user)
+    dates = data.labels()
+    if date[5:] not in dates:
+        print("The day is not in the dataset of the user.")
+        return
+    id = dates.index(date[5:])
+    times = data.select([id]).times()[0]
+    state = start_day(user, date, first_minute=int((times[0] - times[0].astype('datetime64[D]')).astype(int)))
+    status = day_status(state)
+    for time, hr in zip(times, data['hr'][id]):
+        previous = status
+        status = add_minute(state, time, float(hr))
+        for module, module_previous in zip(status['modules'], previous['modules']):
+            if module['anomaly'] and not module_previous['anomaly']:
+                print(f"{str(time)[11:16]} Module {module['folder']} ({module['title']}): provisional anomaly")
+        if status['anomaly'] and not previous['anomaly']:
+            print(f"{str(time)[11:16]} FINAL SYSTEM: provisional anomaly")
+    print(json.dumps(status))
+
+if __name__ == '__main__':
+    # Arguments: user and day (e.g. 2016-04-07)
+    if len(sys.argv) > 2:
+        main(int(sys.argv[1]), sys.argv[2])
+    else:
+        print("The user and day arguments were not provided.")
+
+# -----------------------------------------------------------------------------------------------------------------
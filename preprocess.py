@@ -1,12 +1,15 @@
 # PROCESSING AND VISUALIZATION OF DATA ----------------------------------------------------------------------------
 
 # LIBRARIES
-import pickle
 import os
 import sys
+import json
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+from results import save_result, load_result
+from dataset import UserDays, save_dataset, save_days, load_days, stats_types
+from cache import cache_key
+from instrument import stage, stage_marks
 
 # FILE PATHS
 
@@ -22,34 +25,131 @@ file_min_int_2 = base_path + 'FitabaseData4.12.16-5.12.16/minuteIntensitiesNarro
 file_min_steps_2 = base_path + 'FitabaseData4.12.16-5.12.16/minuteStepsNarrow_merged.csv'
 
 
-# PREPROCESS FUNCTION
-
-def preprocess(user, file_hr_1, file_hr_2, file_min_int_1, file_min_int_2, file_min_steps_1, file_min_steps_2):
-
-    print('\n*DATA PREPROCESS*')
-
-    # Read the CSV files and create DataFrames
-    data_hr_1 = pd.read_csv(file_hr_1)
-    data_int_1 = pd.read_csv(file_min_int_1)
-    data_steps_1 = pd.read_csv(file_min_steps_1)
-
-    data_hr_2 = pd.read_csv(file_hr_2)
-    data_int_2 = pd.read_csv(file_min_int_2)
-    data_steps_2 = pd.read_csv(file_min_steps_2)
-
-    # Concat the 2 datasets
-    data_hr = pd.concat([data_hr_1, data_hr_2], ignore_index=True)
-    data_int = pd.concat([data_int_1, data_int_2], ignore_index=True)
-    data_steps = pd.concat([data_steps_1, data_steps_2], ignore_index=True)
+# LOAD THE DATA
+
+# Number of rows of each chunk read from the CSV files
+chunk_size = 1000000
+
+# Columns of the CSV files and their types (the times are read as text and only parsed for the selected users)
+hr_types = {'Id': np.int64, 'Time': str, 'Value': np.int16}
+int_types = {'Id': np.int64, 'ActivityMinute': str, 'Intensity': np.int8}
+steps_types = {'Id': np.int64, 'ActivityMinute': str, 'Steps': np.int16}
+
+# Read a CSV file in chunks and keep only the rows of the users (all the rows if users is None)
+# since: only the rows from this time (the times of the rows of the users are parsed in each chunk)
+def read_csv_users(file, columns_types, users=None, since=None):
+    time_column = 'Time' if 'Time' in columns_types else 'ActivityMinute'
+    chunks = []
+    try:
+        reader = pd.read_csv(file, usecols=list(columns_types), dtype=columns_types, chunksize=chunk_size)
+    except pd.errors.EmptyDataError:
+        # Empty file (without header)
+        reader = []
+    for chunk in reader:
+        if users is not None:
+            chunk = chunk[chunk['Id'].isin(users)]
+        if since is not None:
+            chunk = chunk.assign(**{time_column: parse_times(chunk[time_column])})
+            chunk = chunk[chunk[time_column] >= since]
+        chunks.append(chunk)
+    # No rows (empty file or no rows of the users) - empty DataFrame with the columns of the file
+    if not chunks:
+        return pd.DataFrame({column: pd.Series(dtype=object if dtype is str else dtype)
+                             for column, dtype in columns_types.items()})
+    return pd.concat(chunks, ignore_index=True)
+
+# Parse the times of the Fitabase files (format '%m/%d/%Y %I:%M:%S %p', with or without zeros on the left)
+# The digits are read directly from the bytes of the strings - if a time has other format, pandas is used
+def parse_times(times):
+
+    # Times already parsed (while the file was read)
+    if pd.api.types.is_datetime64_any_dtype(times):
+        return times
+
+    def parse_with_pandas():
+        return pd.to_datetime(times, format='%m/%d/%Y %I:%M:%S %p', errors='coerce')
+
+    try:
+        chars = times.to_numpy().astype('S23')
+    except (TypeError, UnicodeEncodeError):
+        return parse_with_pandas()
+    chars = chars.view(np.uint8).reshape(len(chars), 23).astype(np.int64)
+    rows = np.arange(len(chars))
+
+    # Positions of the separators of one type (each time must have 2 of each type: '/', ' ' and ':')
+    def positions(separator):
+        rows_found, columns = np.nonzero(chars == ord(separator))
+        if len(columns) != 2 * len(chars) or (np.bincount(rows_found, minlength=len(chars)) != 2).any():
+            return None
+        return columns.reshape(-1, 2).T
+
+    # Number of 1 or 2 digits between the positions (both included)
+    def number(first, last):
+        tens = np.where(last > first, chars[rows, first] - ord('0'), 0)
+        units = chars[rows, last] - ord('0')
+        return tens * 10 + units, (tens >= 0) & (tens <= 9) & (units >= 0) & (units <= 9) & (last - first <= 1)
+
+    separators = [positions(separator) for separator in '/ :']
+    if any(position is None for position in separators):
+        return parse_with_pandas()
+    (slash_1, slash_2), (space_1, space_2), (colon_1, colon_2) = separators
+
+    month, ok_month = number(np.zeros_like(rows), slash_1 - 1)
+    day, ok_day = number(slash_1 + 1, slash_2 - 1)
+    year_digits = chars[rows[:, None], np.minimum(slash_2[:, None] + 1 + np.arange(4), 22)] - ord('0')
+    year = year_digits @ np.array([1000, 100, 10, 1])
+    hour, ok_hour = number(space_1 + 1, colon_1 - 1)
+    minute, ok_minute = number(colon_1 + 1, colon_1 + 2)
+    second, ok_second = number(colon_2 + 1, colon_2 + 2)
+    am_pm = chars[rows, np.minimum(space_2 + 1, 22)]
+    length = (chars != 0).sum(axis=1)
+    ok = (ok_month & ok_day & ok_hour & ok_minute & ok_second & ((year_digits >= 0) & (year_digits <= 9)).all(axis=1)
+          & (space_1 == slash_2 + 5) & (colon_2 == colon_1 + 3) & (space_2 == colon_2 + 3) & (length == space_2 + 3)
+          & np.isin(am_pm, [ord('A'), ord('P')]) & (chars[rows, np.minimum(space_2 + 2, 22)] == ord('M'))
+          & (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31) & (hour >= 1) & (hour <= 12) & (minute <= 59)
+          & (second <= 59))
+    if not ok.all():
+        return parse_with_pandas()
+
+    # Hours in 24h format and number of seconds from 1970-01-01
+    hour = hour % 12 + np.where(am_pm == ord('P'), 12, 0)
+    months = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+    dates = months.astype('datetime64[D]') + (day - 1)
+    # The days that do not exist in the month (e.g. 02/30) are not valid
+    if (dates.astype('datetime64[M]') != months).any():
+        return parse_with_pandas()
+    seconds = dates.astype('datetime64[s]') + (hour * 3600 + minute * 60 + second)
+    return pd.Series(seconds.astype('datetime64[ns]'), index=times.index, name=times.name)
+
+# Read the CSV files and adjust the data (the same data for all the users, or only for the users requested)
+# since: only the samples from this time (incremental preprocess, see incremental_cutoff)
+def load_data(file_hr_1, file_hr_2, file_min_int_1, file_min_int_2, file_min_steps_1, file_min_steps_2, users=None,
+              since=None):
+
+    # Read the CSV files and create DataFrames (in chunks, only the rows of the users)
+    with stage('load_data.read_csv') as record:
+        data_hr_1 = read_csv_users(file_hr_1, hr_types, users, since)
+        data_int_1 = read_csv_users(file_min_int_1, int_types, users, since)
+        data_steps_1 = read_csv_users(file_min_steps_1, steps_types, users, since)
+
+        data_hr_2 = read_csv_users(file_hr_2, hr_types, users, since)
+        data_int_2 = read_csv_users(file_min_int_2, int_types, users, since)
+        data_steps_2 = read_csv_users(file_min_steps_2, steps_types, users, since)
+
+        # Concat the 2 datasets
+        data_hr = pd.concat([data_hr_1, data_hr_2], ignore_index=True)
+        data_int = pd.concat([data_int_1, data_int_2], ignore_index=True)
+        data_steps = pd.concat([data_steps_1, data_steps_2], ignore_index=True)
+        record.update(rows_hr=len(data_hr), rows_int=len(data_int), rows_steps=len(data_steps))
 
     def adjust_data(data_hr, data_int, data_steps):
         # Rename the column 'Value' to 'HeartRate'
         data_hr = data_hr.rename(columns={'Value': 'HeartRate'})
 
         # Adjust the format of the time column to the type datetime
-        data_hr['Time'] = pd.to_datetime(data_hr['Time'], format='%m/%d/%Y %I:%M:%S %p', errors='coerce')
-        data_int['ActivityMinute'] = pd.to_datetime(data_int['ActivityMinute'], format='%m/%d/%Y %I:%M:%S %p', errors='coerce')
-        data_steps['ActivityMinute'] = pd.to_datetime(data_steps['ActivityMinute'], format='%m/%d/%Y %I:%M:%S %p', errors='coerce')
+        data_hr['Time'] = parse_times(data_hr['Time'])
+        data_int['ActivityMinute'] = parse_times(data_int['ActivityMinute'])
+        data_steps['ActivityMinute'] = parse_times(data_steps['ActivityMinute'])
         
         # Round the ActivityMinute column to have the notation hh:min:00
         data_int['ActivityMinute'] = data_int['ActivityMinute'].dt.floor('T')
@@ -70,9 +170,178 @@ def preprocess(user, file_hr_1, file_hr_2, file_min_int_1, file_min_int_2, file_
 
         return data_hr, data_int, data_steps
 
-    data_hr, data_int, data_steps = adjust_data(data_hr, data_int, data_steps)
+    with stage('load_data.adjust_data', rows=len(data_hr) + len(data_int) + len(data_steps)):
+        data_hr, data_int, data_steps = adjust_data(data_hr, data_int, data_steps)
     ### In data_hr we have one value per sample (every x sec)
 
+    return data_hr, data_int, data_steps
+
+# Split the data by user - dictionary with the heart rate, intensities and steps data of each user
+def partition_data(data_hr, data_int, data_steps):
+
+    data_hr_users = dict(list(data_hr.groupby('Id')))
+    data_int_users = dict(list(data_int.groupby('Id')))
+    data_steps_users = dict(list(data_steps.groupby('Id')))
+
+    # Only the users with the three features
+    common_users = set(data_hr_users) & set(data_int_users) & set(data_steps_users)
+    return {int(user): (data_hr_users[user], data_int_users[user], data_steps_users[user]) for user in common_users}
+
+# First time preprocessed again in the incremental mode (the day of the last sample processed, that day can be
+# incomplete) - None if the user has no days stored
+def incremental_cutoff(user):
+    previous_days = load_days(user)
+    if previous_days is None:
+        return None
+    return pd.Timestamp(int(previous_days['last']) // (24 * 60 * 60), unit='D')
+
+
+# MISSING VALUES
+
+# Fill the missing minutes of each day (from its first to its last sample) with NaN, and the gaps of no more than
+# max_mins_missing consecutive minutes with the average of the previous and next values
+# minutes: minutes with samples (from 1970-01-01, sorted), hrs: heart rate of each minute
+# Returns the minutes of all the days, their heart rates and the position where each day starts (and the end)
+def fill_missing_values(minutes, hrs, max_mins_missing):
+
+    # Days of the samples and positions of the first and last sample of each day
+    days = minutes // (24 * 60)
+    firsts = np.flatnonzero(np.diff(days, prepend=days[:1] - 1))
+    lasts = np.append(firsts[1:], len(minutes))[:len(firsts)] - 1
+
+    # All the minutes between the first and last sample of each day
+    lens = minutes[lasts] - minutes[firsts] + 1
+    day_starts = np.concatenate([[0], np.cumsum(lens)])
+    all_minutes = np.arange(day_starts[-1]) + np.repeat(minutes[firsts] - day_starts[:-1], lens)
+    all_hrs = np.full(day_starts[-1], np.nan)
+    all_hrs[np.searchsorted(all_minutes, minutes)] = hrs
+
+    # Runs of consecutive missing values (they never include the first or last minute of a day)
+    changes = np.diff(np.isnan(all_hrs).astype(np.int8), prepend=0, append=0)
+    run_starts = np.flatnonzero(changes == 1)
+    run_lens = np.flatnonzero(changes == -1) - run_starts
+
+    # Fill the short runs with the average of the previous and next values
+    short = run_lens <= max_mins_missing
+    run_starts, run_lens = run_starts[short], run_lens[short]
+    fill_values = (all_hrs[run_starts - 1] + all_hrs[run_starts + run_lens]) / 2
+    run_offsets = np.repeat(run_starts - np.concatenate([[0], np.cumsum(run_lens)[:-1]]), run_lens)
+    all_hrs[run_offsets + np.arange(run_lens.sum())] = np.repeat(fill_values, run_lens)
+
+    return all_minutes, all_hrs, day_starts
+
+
+# STATISTICS OF HEART RATE
+
+# Each statistic is calculated for all the days at once from a padded array (one row for each day with its samples
+# from the first column, NaN after them), the mask of the samples, the minute of the day of each sample and the number
+# of samples of each day
+def stat_max(X, valid, M, counts):
+    return np.round(np.where(valid, X, -np.inf).max(axis=1))
+
+def stat_min(X, valid, M, counts):
+    return np.round(np.where(valid, X, np.inf).min(axis=1))
+
+def stat_mean(X, valid, M, counts):
+    return np.where(valid, X, 0).sum(axis=1) / counts
+
+def stat_median(X, valid, M, counts):
+    # The NaN values are sorted at the end of each row
+    X = np.sort(X, axis=1)
+    rows = np.arange(len(X))
+    return (X[rows, (counts - 1) // 2] + X[rows, counts // 2]) / 2
+
+def stat_std(X, valid, M, counts):
+    mean = stat_mean(X, valid, M, counts)
+    return np.sqrt((np.where(valid, X - mean[:, None], 0) ** 2).sum(axis=1) / counts)
+
+# Differences of successive RR intervals (ms) and their mask
+def rr_differences(X, valid):
+    rr = 60 * 1000 / X
+    return np.diff(rr, axis=1), valid[:, 1:]
+
+# RMSSD: Sqrt of the mean of the squared differences of successive RR intervals) - supposed to be 20-89 ms
+def stat_rmssd(X, valid, M, counts):
+    diffs, diffs_valid = rr_differences(X, valid)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.sqrt((np.where(diffs_valid, diffs, 0) ** 2).sum(axis=1) / (counts - 1))
+
+# pNN50: % of consecutive RR interval differences that are greater than 50 ms - supposed to be 3-43 %
+def stat_pnn50(X, valid, M, counts):
+    diffs, diffs_valid = rr_differences(X, valid)
+    return 100 * (diffs_valid & (np.abs(diffs) > 50)).sum(axis=1) / counts
+
+# Resting heart rate: lowest mean of resting_window consecutive samples of the day (rolling mean)
+resting_window = 5
+
+def stat_resting_hr(X, valid, M, counts):
+    sums = np.concatenate([np.zeros((len(X), 1)), np.cumsum(np.where(valid, X, 0), axis=1)], axis=1)
+    window_sums = sums[:, resting_window:] - sums[:, :-resting_window]
+    # Only the windows with all their samples in the day
+    complete = np.arange(window_sums.shape[1]) + resting_window <= counts[:, None]
+    with np.errstate(invalid='ignore'):
+        return np.where(complete, window_sums, np.inf).min(axis=1) / resting_window
+
+# Nightly heart rate: mean of the samples from 00:00 to 06:00 (NaN if the day has no samples at night)
+def stat_night_mean(X, valid, M, counts):
+    night = valid & (M < 6 * 60)
+    with np.errstate(invalid='ignore'):
+        return np.where(night, X, 0).sum(axis=1) / night.sum(axis=1)
+
+# Statistics available (the ones stored are the fields of stats_types in dataset.py - e.g. RestingHR or NightMean can
+# be added there)
+stats_functions = {'Max': stat_max, 'Min': stat_min, 'Mean': stat_mean, 'Median': stat_median, 'Std_dev': stat_std,
+                   'RMSSD': stat_rmssd, 'pNN50': stat_pnn50, 'RestingHR': stat_resting_hr, 'NightMean': stat_night_mean}
+
+# Statistics of heart rate of the days selected (days from 1970-01-01, sorted) - one row of the stats table for each day
+# minutes: minutes with samples (from 1970-01-01, sorted), hrs: heart rate of each minute
+def daily_statistics(minutes, hrs, days, types=stats_types):
+    days = np.asarray(days, dtype=np.int64)
+    # No days (e.g. an incremental preprocess without a complete new day)
+    if not len(days):
+        return np.zeros(0, dtype=types)
+    day_ids = minutes // (24 * 60)
+    keep = np.isin(day_ids, days)
+    # Row and column of each sample in the padded array
+    rows = np.searchsorted(days, day_ids[keep])
+    counts = np.bincount(rows, minlength=len(days))
+    firsts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    columns = np.arange(len(rows)) - firsts[rows]
+    X = np.full((len(days), counts.max() if len(days) else 0), np.nan)
+    M = np.full(X.shape, -1, dtype=np.int64)
+    X[rows, columns] = hrs[keep]
+    M[rows, columns] = minutes[keep] % (24 * 60)
+    valid = ~np.isnan(X)
+
+    stats = np.zeros(len(days), dtype=types)
+    for name in stats.dtype.names:
+        stats[name] = stats_functions[name](X, valid, M, counts)
+    return stats
+
+# PREPROCESS FUNCTION
+
+def preprocess(user, file_hr_1, file_hr_2, file_min_int_1, file_min_int_2, file_min_steps_1, file_min_steps_2, plots=False,
+               incremental=False):
+
+    print('\n*DATA PREPROCESS*')
+
+    # Read only the data of the user and preprocess it (in incremental mode, only the samples that are preprocessed)
+    since = incremental_cutoff(user) if incremental else None
+    data_hr, data_int, data_steps = load_data(file_hr_1, file_hr_2, file_min_int_1, file_min_int_2, file_min_steps_1, file_min_steps_2,
+                                              users=[user], since=since)
+    return preprocess_user(user, data_hr, data_int, data_steps, plots=plots, incremental=incremental)
+
+# Preprocess the data of one user (the data can contain all the users or only this one) - returns the dataset in JSON
+# format
+# incremental: only the days from the last sample processed are preprocessed (the rest are read from the stored days)
+def preprocess_user(user, data_hr, data_int, data_steps, plots=False, incremental=False):
+    return preprocess_days(user, data_hr, data_int, data_steps, plots=plots, incremental=incremental)[1]
+
+# Preprocess the data of one user - returns the days of the user (in memory, for the anomaly detection of the same
+# request) and the dataset in JSON format
+# write_dataset: 'sync' (the dataset is written before returning), 'async' (written in the background) or None (not
+# written)
+def preprocess_days(user, data_hr, data_int, data_steps, plots=False, incremental=False, write_dataset='sync'):
 
     # USERS ANALYSIS ----------------------------------------------------------------------------
 
@@ -114,6 +383,9 @@ def preprocess(user, file_hr_1, file_hr_2, file_min_int_1, file_min_int_2, file_
     # Analyze the data of one specific user -----------------------------------------------------
     print(f'\nUSER {user}')
 
+    # Time, cpu time and peak memory of each stage (recorded only if the instrumentation is configured)
+    mark = stage_marks('preprocess', user=user)
+
     def obtain_data_user(user):
         # Obtain heart rate, intensities and steps data
         data_hr_user = data_hr[data_hr['Id'] == user]
@@ -125,61 +397,17 @@ def preprocess(user, file_hr_1, file_hr_2, file_min_int_1, file_min_int_2, file_
     # Obtain a dataframe for each feature with the info of a specific user
     data_hr_user, data_int_user, data_steps_user = obtain_data_user(user)
 
-
-    # VISUALIZE DATA ----------------------------------------------------------------------------
-
-    # Visualize ALL the data
-    def visualize_all_data(user, data_hr_user):
-        
-        plt.figure(figsize=(20, 10))
-        x = data_hr_user['Time']
-        y = data_hr_user['HeartRate']
-        plt.scatter(x, y)
-
-        # The regular values are between 60 and 100
-        plt.axhline(y=60, color='red', linestyle='--', label='60 bpm')
-        plt.axhline(y=100, color='red', linestyle='--', label='100 bpm')
-        
-        plt.xlabel('\nTime')
-        plt.ylabel('bpm\n')
-        plt.title(f'HeartRate of user {user} from {x.iloc[0].date()} to {x.iloc[-1].date()}')
-        plt.ylim(30, 220)
-        # Verify if the folder exists
-        if not os.path.exists(f'figures/user{user}'):
-            os.makedirs(f'figures/user{user}')
-        # Save the figure
-        plt.savefig(f'figures/user{user}/all.png', bbox_inches='tight')
-        #plt.show()
-        plt.clf()
-
-    visualize_all_data(user, data_hr_user)
-
-    # Comparison between days for a user (all days)
-    def visualize_days_data(user, data_hr_user):
-        #days = [pd.to_datetime('2016-04-12'), pd.to_datetime('2016-04-13'), pd.to_datetime('2016-04-14'), pd.to_datetime('2016-04-15')]
-        days = data_hr_user['Time'].dt.date.unique().tolist()
-        plt.figure(figsize=(20, 10))
-        # Make a plot for each day
-        for day in days:
-            data_hr_user_1day = data_hr_user[data_hr_user['Time'].dt.date == day]
-            x = data_hr_user_1day['Time']
-            y = data_hr_user_1day['HeartRate']
-            plt.scatter(x, y)
-            plt.axhline(y=60, color='red', linestyle='--', label='60 bpm')
-            plt.axhline(y=100, color='red', linestyle='--', label='100 bpm')
-            plt.xlabel('\nTime')
-            plt.ylabel('bpm\n')
-            plt.title(f'HeartRate of user {user} on {day}')
-            plt.ylim(30, 220)
-            # Verify if the folder exists
-            if not os.path.exists(f'figures/user{user}'):
-                os.makedirs(f'figures/user{user}')
-            # Save the figure
-            plt.savefig(f'figures/user{user}/{day}.png', bbox_inches='tight')
-            #plt.show()
-            plt.clf()
-
-    visualize_days_data(user, data_hr_user)
+    # Incremental mode - only the samples from the day of the last sample processed (that day can be incomplete)
+    previous_days = load_days(user) if incremental else None
+    if previous_days is not None:
+        # First day to preprocess again (days from 1970-01-01)
+        cutoff_date = int(previous_days['last']) // (24 * 60 * 60)
+        cutoff_time = pd.Timestamp(cutoff_date, unit='D')
+        data_hr_user = data_hr_user[data_hr_user['Time'] >= cutoff_time]
+        data_int_user = data_int_user[data_int_user['ActivityMinute'] >= cutoff_time]
+        data_steps_user = data_steps_user[data_steps_user['ActivityMinute'] >= cutoff_time]
+        print(f"\nINCREMENTAL PREPROCESS FROM {cutoff_time.strftime('%Y-%m-%d')}")
+    mark('obtain_data_user', rows=len(data_hr_user))
 
 
     # OBTAIN VARIABLES FOR THE SYSTEM -----------------------------------------------------------
@@ -187,129 +415,48 @@ def preprocess(user, file_hr_1, file_hr_2, file_min_int_1, file_min_int_2, file_
     def obtain_variables():
         # Calculate an average value of heart rate for each minute
         min_hr = data_hr_user.groupby('ActivityMinute')['HeartRate'].mean().reset_index()
-        # Create a dataframe with each day and its array of heart rates
-        day_hr_df = min_hr.groupby(min_hr['ActivityMinute'].dt.date)['HeartRate'].apply(list).reset_index()
-        day_hr_df.columns = ['Day', 'HeartRates']
-        # List of vectors with the values of heart rate for each day
-        day_hr = day_hr_df['HeartRates'].tolist()
-
-        # Group the values of intensities and steps by days
-        day_int_df = data_int_user.groupby(data_int_user['ActivityMinute'].dt.date)['Intensity'].apply(list).reset_index()
-        day_int = day_int_df['Intensity'].tolist()
-        day_steps_df = data_steps_user.groupby(data_steps_user['ActivityMinute'].dt.date)['Steps'].apply(list).reset_index()
-        day_steps = day_steps_df['Steps'].tolist()
-        
-        # Obtain list with the sequence of time values for each day (for heart rate, intensities and steps)
-        day_time = min_hr.groupby(min_hr['ActivityMinute'].dt.date)['ActivityMinute'].apply(list).tolist()
-        day_int_time = data_int_user.groupby(data_int_user['ActivityMinute'].dt.date)['ActivityMinute'].apply(list).tolist()
-        day_steps_time = data_steps_user.groupby(data_steps_user['ActivityMinute'].dt.date)['ActivityMinute'].apply(list).tolist()
+        # Number of minutes with heart rate of each day (the days are split later, as arrays)
+        day_sizes = min_hr.groupby(min_hr['ActivityMinute'].dt.date).size()
 
         # Show the lengths of the vectors
         print("\nNumber of Days:")
-        print(len(day_hr))
+        print(len(day_sizes))
         print("Number of Samples for each day: HR")
-        print(*(len(day) for day in day_hr))
+        print(*day_sizes)
         ### Each day has a different number of samples
 
+        # The values of intensities and steps are only counted by days (they are aligned with the heart rates later)
         print("Number of Samples for each day: INT")
-        print(*(len(day) for day in day_int))
+        print(*data_int_user.groupby(data_int_user['ActivityMinute'].dt.date).size())
         print("Number of Samples for each day: STEPS")
-        print(*(len(day) for day in day_steps))
+        print(*data_steps_user.groupby(data_steps_user['ActivityMinute'].dt.date).size())
 
-        return day_hr, day_time, day_int, day_int_time, day_steps, day_steps_time
+        return min_hr
 
-    day_hr, day_time, day_int, day_int_time, day_steps, day_steps_time = obtain_variables()
+    min_hr = obtain_variables()
+    mark('obtain_variables', minutes=len(min_hr))
     ### Now in data_hr we have one value per minute
 
 
     # DEAL WITH MISSING VALUES ------------------------------------------------------------------
 
-    # First identify the times of the missing values - fill hrs with Nan values
-    def fill_missing_values_with_nan(day_time, day_hr):
+    # Identify the times of the missing values of each day (filled with NaN) and fill the ones of no more than 60
+    # consecutive minutes with the average of the previous and next values
+    minutes = min_hr['ActivityMinute'].to_numpy().astype('datetime64[m]').astype(np.int64)
+    all_minutes, all_hrs, day_starts = fill_missing_values(minutes, min_hr['HeartRate'].to_numpy(dtype=float),
+                                                           max_mins_missing=60)
 
-        # New variables for time and hr data
-        day_time_with_nan = []
-        day_hr_with_nan = []
-        
-        for day, hr in zip(day_time, day_hr):
-
-            # Create dataframe with values of time and hr
-            df = pd.DataFrame({'Time': day, 'HR': hr})
-
-            # Create a date range from the first sample to the last one
-            dates_range = pd.date_range(start=df['Time'].min(), end=df['Time'].max(), freq='T')
-
-            # Reindex the df to include all dates in the range
-            df = df.set_index('Time').reindex(dates_range).reset_index()
-            df.rename(columns={'index': 'Time'}, inplace=True)
-            
-            # Fill missing values with NaN
-            df = df.fillna(np.nan)
-
-            # Print new dataframe
-            pd.set_option('display.max_columns', None)
-            #print(df)
-
-            # Identify missing values (samples with Nan)
-            nan_rows = df[df.isna().any(axis=1)]
-            #print(nan_rows)
-
-            # Add vectors to the variables (new time and hr)
-            day_time_with_nan.append(df['Time'].tolist())
-            day_hr_with_nan.append(df['HR'].tolist())
-
-        return day_time_with_nan, day_hr_with_nan
-
-    day_time_with_nan, day_hr_with_nan = fill_missing_values_with_nan(day_time, day_hr)
-
-    # If there are less than x consecutive mins missing - fill with the average of previous and next values
-    def fill_missing_values_with_avg(max_mins_missing):
-        for hrs in day_hr_with_nan:
-            # Variable for counting the consecutive Nan values
-            num_nans = 0
-            for i, hr in enumerate(hrs):
-                # We increment the counter if Nan value (also check it's not the last value)
-                if np.isnan(hr) and i < len(hrs) - 1:
-                    num_nans += 1
-                # If not Nan or last value
-                else:
-                    # If we have no more than x consecutive nan values (no more than x min missing)
-                    if num_nans > 0 and num_nans <= max_mins_missing:
-                        # We fill the Nan values with the average of the previous and next values
-                        start_id = i - num_nans
-                        end_id = i - 1
-                        # If it's possible, add the previous and next values to a vector
-                        prev_next_val = []
-                        prev_next_val.append(hrs[start_id - 1]) if start_id - 1 >= 0 else None
-                        prev_next_val.append(hrs[end_id + 1]) if end_id + 1 <= len(hrs) - 1 else None
-                        # If we only have the previous or the next value
-                        if len(prev_next_val) == 1:
-                            fill_value = prev_next_val[0]
-                        # If we have both previous and next values
-                        if len(prev_next_val) == 2:
-                            fill_value = (prev_next_val[0] + prev_next_val[1]) / 2
-                        # Fill the missing values
-                        fill_values = [fill_value] * (end_id - start_id + 1)
-                        hrs[start_id:end_id+1] = fill_values
-                    # We restart the counter as there are no more consecutive Nan values
-                    num_nans = 0
-
-        return day_hr_with_nan  
-            
-    day_hr_with_nan = fill_missing_values_with_avg(max_mins_missing=60)
+    # Vectors of each day (time and hr)
+    all_times = pd.to_datetime(all_minutes, unit='m')
+    day_time_with_nan = [all_times[start:end] for start, end in zip(day_starts[:-1], day_starts[1:])]
+    day_hr_with_nan = np.split(all_hrs, day_starts[1:-1])
 
     # See the results
-    days_with_nan = []
-    for day, hrs in zip(day_time_with_nan, day_hr_with_nan):
-        for i, hr in enumerate(hrs):
-            if np.isnan(hrs[i]):
-                days_with_nan.append(day[0].strftime("%m-%d"))
-    days_with_nan = list(set(days_with_nan))
-    print(f'\nDays with many missing values: {len(days_with_nan)}')
-    #print(days_with_nan)
+    nans_day = np.add.reduceat(np.isnan(all_hrs).astype(int), day_starts[:-1]) if len(all_hrs) else np.zeros(0, dtype=int)
+    print(f'\nDays with many missing values: {np.count_nonzero(nans_day)}')
 
     # We remove the days that still have missing values:
-    ids = [i for i, hr in enumerate(day_hr_with_nan) if not np.isnan(hr).any()]
+    ids = np.flatnonzero(nans_day == 0)
     day_hr_updated = [day_hr_with_nan[i] for i in ids]
     day_time_updated = [day_time_with_nan[i] for i in ids]
 
@@ -331,71 +478,146 @@ def preprocess(user, file_hr_1, file_hr_2, file_min_int_1, file_min_int_2, file_
     day_time_updated = [day for id, day in enumerate(day_time_updated) if id in days_ids]
     day_hr_updated = [day for id, day in enumerate(day_hr_updated) if id in days_ids]
 
-    # 1 OPTION - Maintain only hours with data for all
-    def filter_range_time():
-        first_times = []
-        last_times = []
-        # Store the times of beggining and end of each day
-        for day in day_time_updated:
-            first_times.append(day[0].replace(year=2000, month=1, day=1))
-            last_times.append(day[-1].replace(year=2000, month=1, day=1))
-        # Select the range of time that is stored in all days
-        first_time = max(first_times)
-        last_time = min(last_times)
-        print(f"First time: {first_time.strftime('%H:%M')}")
-        print(f"Last time: {last_time.strftime('%H:%M')}")
-        # Maintain only the values between the range of dates
-        day_time_new = []
-        day_hr_new = []
-        for day,hr in zip(day_time_updated, day_hr_updated):
-            ids = np.where(((np.array([d.replace(year=2000, month=1, day=1) for d in day])) >= first_time) & ((np.array([d.replace(year=2000, month=1, day=1) for d in day])) <= last_time))[0]
-            day_time_new.append([day[id] for id in ids])
-            day_hr_new.append([hr[id] for id in ids])
-
-        return day_time_new, day_hr_new
-
-    day_time_new, day_hr_new = filter_range_time()
+    # Store the dates of the days that we are maintaining
+    dates = [day[0].date() for day in day_time_updated]
+    mark('fill_missing_values', minutes=len(all_minutes), days=len(day_starts) - 1, days_kept=len(dates))
+
+
+    # CALCULATE SOME STATISTICS -----------------------------------------------------------------
+
+    # We calculate statistics from the original data (to use the real information) - samples of each minute of the
+    # days that we are maintaining
+    stats = daily_statistics(minutes, min_hr['HeartRate'].to_numpy(dtype=float),
+                             np.array(dates, dtype='datetime64[D]').astype(np.int64))
+    mark('statistics', days=len(dates))
 
-    # 2 OPTION - Maintain only first x samples
 
-    # Function to only keep days with x samples or more (same length for all)
-    def equal_size_vectors(length, day_time_updated, day_hr_updated):
-        # Obtain days (hrs) with more than x samples
-        day_ids, day_hr_new = zip(*[(id, hr) for id, hr in enumerate(day_hr_updated) if len(hr) >= length])
-        # Maintain only the first x hr values
-        day_hr_new = [[hr for hr in arr[:length]] for arr in day_hr_new]
+    # ADD OTHER FEATURES - INTENSITIES AND STEPS ------------------------------------------------
+
+    # Minutes of the heart rates of the days we selected (all the samples of the day - the range of time is adjusted
+    # later)
+    day_minutes = [time.to_numpy().astype('datetime64[m]').astype(np.int64) for time in day_time_updated]
+    hr_minutes = np.concatenate(day_minutes) if day_minutes else np.zeros(0, dtype=np.int64)
+    day_firsts = np.cumsum([0] + [len(minutes) for minutes in day_minutes])[:-1]
+
+    # Values of a feature in the same minutes as the heart rates (the minutes without value are marked with -1)
+    def align_feature(data_feature, feature):
+        # Minutes of the feature sorted (if a minute is repeated, the first value is used)
+        data_feature = data_feature.sort_values('ActivityMinute', kind='stable')
+        feature_minutes = data_feature['ActivityMinute'].to_numpy().astype('datetime64[m]').astype(np.int64)
+        feature_values = data_feature[feature].to_numpy()
+        # Position of each minute of the heart rates in the minutes of the feature
+        ids = np.searchsorted(feature_minutes, hr_minutes).clip(max=max(len(feature_minutes) - 1, 0))
+        found = feature_minutes[ids] == hr_minutes if len(feature_minutes) else np.zeros(len(hr_minutes), dtype=bool)
+        values = np.where(found, feature_values[ids] if len(feature_values) else -1, -1)
+        # Number of minutes without value in each day
+        unmatched = np.add.reduceat(~found, day_firsts) if len(hr_minutes) else np.zeros(0, dtype=int)
+        return np.split(values, day_firsts[1:]), unmatched
+
+    day_int_new, int_unmatched = align_feature(data_int_user, 'Intensity')
+    day_steps_new, steps_unmatched = align_feature(data_steps_user, 'Steps')
+
+    # Report the minutes of heart rate without intensity or steps values
+    print("\nMinutes without value for each day: INT")
+    print(*int_unmatched)
+    print("Minutes without value for each day: STEPS")
+    print(*steps_unmatched)
+    mark('align_features', minutes=len(hr_minutes))
+
+
+    # STORE THE PROCESSED DAYS ------------------------------------------------------------------
+
+    # Each day in a row with one column for each minute of the day (00:00 to 23:59)
+    days = {'date': np.array([np.datetime64(date, 'D') for date in dates], dtype='datetime64[D]').astype(np.int64),
+            'hr': np.full((len(dates), 1440), np.nan),
+            'int': np.full((len(dates), 1440), -1),
+            'steps': np.full((len(dates), 1440), -1),
+            'stats': stats}
+    for id, minutes in enumerate(day_minutes):
+        first = minutes[0] % 1440
+        days['hr'][id, first:first + len(minutes)] = day_hr_updated[id]
+        days['int'][id, first:first + len(minutes)] = day_int_new[id]
+        days['steps'][id, first:first + len(minutes)] = day_steps_new[id]
+    days['last'] = np.datetime64(data_hr_user['Time'].max(), 's').astype(np.int64)
+
+    # Incremental mode - the days before the reprocessed ones are maintained
+    if previous_days is not None:
+        keep = previous_days['date'] < cutoff_date
+        for name in ['date', 'hr', 'int', 'steps', 'stats']:
+            days[name] = np.concatenate([previous_days[name][keep], np.asarray(days[name], dtype=previous_days[name].dtype)])
+        print(f'\nDays maintained from the previous preprocess: {keep.sum()}')
+        print(f'Days reprocessed: {len(dates)}')
+
+    save_days(user, days)
+    mark('save_days', days=len(days['date']))
+
+
+    # ADJUST THE RANGE OF TIME (THE SAME NUMBER OF SAMPLES FOR ALL THE DAYS) --------------------
+
+    # First and last minute with samples of each day
+    with_samples = ~np.isnan(days['hr'])
+    first_mins = with_samples.argmax(axis=1)
+    last_mins = 1440 - 1 - with_samples[:, ::-1].argmax(axis=1)
 
-        # Filter the days (times) with more than x samples
-        day_time_new = [day_time_updated[i] for i in day_ids]
-        # Maintain only first x time values
-        day_time_new = [[time for time in arr[:length]] for arr in day_time_new]
+    # 1 OPTION - Maintain only hours with data for all
+    def filter_range_time():
+        # Select the range of time that is stored in all days
+        first_time = first_mins.max()
+        last_time = last_mins.min()
+        print(f"First time: {first_time // 60:02d}:{first_time % 60:02d}")
+        print(f"Last time: {last_time // 60:02d}:{last_time % 60:02d}")
+        # Maintain only the values between the range of times (the same first minute for all the days)
+        return np.full(len(first_mins), first_time), max(last_time - first_time + 1, 0)
 
-        return day_time_new, day_hr_new
+    first_ids, num_samples = filter_range_time()
 
+    # 2 OPTION - Maintain only first x samples
     def filter_num_samples():
         # All days will have the length of the day with min length
-        lens = [len(hr) for hr in day_hr_updated]
-        min_len = min(lens)
-        # For all vectors take the x first values
-        day_time_new, day_hr_new = equal_size_vectors(min_len, day_time_updated, day_hr_updated)
-        return day_time_new, day_hr_new
+        min_len = (last_mins - first_mins + 1).min()
+        # For all days take the x first values
+        return first_mins, min_len
 
     # Use the second option if number of samples < 600
-    if len(day_hr_new[0]) < min_number_samples:
-        day_time_new, day_hr_new = filter_num_samples()
+    if num_samples < min_number_samples:
+        first_ids, num_samples = filter_num_samples()
         print('\nFILTERED BY NUMBER OF SAMPLES')
     else:
         print('\nFILTERED BY TIME RANGE')
 
-    # Check number of days and samples
-    print(f"\nNew number of Days: {len(day_hr_new)}")
-    print(f"New number of Samples for each day: {len(day_hr_new[0])}\n")
+    # Select the samples of each day
+    ids = first_ids[:, None] + np.arange(num_samples)
+    rows = np.arange(len(ids))[:, None]
+    day_hr_new = days['hr'][rows, ids]
+    day_int_new = days['int'][rows, ids]
+    day_steps_new = days['steps'][rows, ids]
+
+    # All the samples in the range of time must have intensity and steps values - the days with missing values are
+    # dropped (and returned in the JSON with the number of minutes missing)
+    missing_int = (day_int_new < 0).sum(axis=1)
+    missing_steps = (day_steps_new < 0).sum(axis=1)
+    complete = (missing_int == 0) & (missing_steps == 0)
+    dropped_dates = np.datetime_as_string(days['date'][~complete].astype('datetime64[D]'))
+    dropped_days = [{'Date': date, 'MissingIntensity': int(n_int), 'MissingSteps': int(n_steps)}
+                    for date, n_int, n_steps in zip(dropped_dates, missing_int[~complete], missing_steps[~complete])]
+    if not complete.any(): raise ValueError('Missing intensity or steps values in the range of time of all the days')
+    if dropped_days:
+        print(f"\nDays dropped (missing intensity or steps values): {[day['Date'] for day in dropped_days]}")
+
+    # Days of the user (the heart rate values rounded to integers)
+    user_days = UserDays({'hr': np.round(day_hr_new[complete]).astype(np.int16),
+                          'int': day_int_new[complete].astype(np.uint8),
+                          'steps': day_steps_new[complete].astype(np.int16),
+                          'start': (days['date'] * 1440 + first_ids)[complete], 'stats': days['stats'][complete]})
 
-    # Round the heart rate values and convert to integer
-    day_hr_new = [[int(round(hr)) for hr in day] for day in day_hr_new]
+    # Check number of days and samples
+    print(f"\nNew number of Days: {user_days.n_days}")
+    print(f"New number of Samples for each day: {user_days.n_minutes}\n")
+    mark('adjust_range_time', days=user_days.n_days, minutes=user_days.n_minutes)
 
     # Store the new days used
-    dates = [day[0].date() for day in day_time_new]
+    day_time_new = user_days.times()
+    dates = user_days.dates().tolist()
 
 
     # SMOOTHING ---------------------------------------------------------------------------------
@@ -471,229 +693,17 @@ def preprocess(user, file_hr_1, file_hr_2, file_min_int_1, file_min_int_2, file_
     plot_hr_smoothing(z)
     '''
 
-    # CALCULATE SOME STATISTICS -----------------------------------------------------------------
-
-    # Select the original data of the days that we are maintaining
-    data_ids = [id for id, day in enumerate(day_time) if day[0].date() in dates]
-    day_hr_statistics = [day for id, day in enumerate(day_hr) if id in data_ids]
-
-    # We calculate statistics from the original data (to use the real information)
-
-    def calculate_statistics(day_hr):
-        # Max, Min, Mean, Median, Standard Deviation of heart rate
-        max = []
-        min = []
-        mean = []
-        median = []
-        std_deviation = []
-        # RMSSD: Sqrt of the mean of the squared differences of successive RR intervals) - supposed to be 20-89 ms
-        rmssd = [] 
-        # pNN50: % of consecutive RR interval differences that are greater than 50 ms - supposed to be 3-43 %
-        pnn50 = []
-
-        for hrs in day_hr:
-            hrs = np.array(hrs)
-
-            # Metrics from heart rates
-            max.append(np.max(hrs).round().astype(int))
-            min.append(np.min(hrs).round().astype(int))
-            mean.append(np.mean(hrs))
-            median.append(np.median(hrs))
-            std_deviation.append(np.std(hrs))
-
-            # Convert heart rates to RR intervals
-            rr = 60 * 1000 / hrs
-
-            # Metrics from RR intervals
-            #rmssd_day = np.sqrt(np.mean(np.diff(day)**2))
-            rmssd_day = np.sqrt(np.mean(np.square(np.diff(rr))))
-            rmssd.append(rmssd_day)
-            nn50 = np.sum(np.abs(np.diff(rr)) > 50)
-            pnn50_day = 100 * nn50 / len(rr)
-            pnn50.append(pnn50_day)
-
-        return max, min, mean, median, std_deviation, rmssd, pnn50
-
-    maxx, minn, mean, median, std_deviation, rmssd, pnn50 = calculate_statistics(day_hr_statistics)
-
-
-    # ADD OTHER FEATURES - INTENSITIES AND STEPS ------------------------------------------------
-
-    # Only maintain the info of the days we selected
-    day_int_new = [day for day, time in zip(day_int, day_int_time) if time[0].date() in dates]
-    day_int_time_new = [time for time in day_int_time if time[0].date() in dates]
-    day_steps_new = [day for day, time in zip(day_steps, day_steps_time) if time[0].date() in dates]
-    day_steps_time_new = [time for time in day_steps_time if time[0].date() in dates]
-
-    # Keep only the values corresponding to the same times as the heart rates
-    # Find the ids of the time samples that we have to keep
-    int_ids = [[time_int.index(x) for x in time if x in time_int] for time, time_int in zip(day_time_new, day_int_time_new)]
-    steps_ids = [[time_steps.index(x) for x in time if x in time_steps] for time, time_steps in zip(day_time_new, day_steps_time_new)]
-
-    # Only maintain the values that correspond to the ids
-    day_int_new = [[day for id, day in enumerate(int_day) if id in ids] for ids, int_day in zip(int_ids, day_int_new)]
-    day_steps_new = [[day for id, day in enumerate(steps_day) if id in ids] for ids, steps_day in zip(steps_ids, day_steps_new)]
-
-    # Check if the lengths of the different features match
-    if len(day_time_new) != len(day_int_new): print('\n***MISSING INTENSITY VALUES')
-    if len(day_time_new) != len(day_steps_new): print('\n***MISSING STEPS VALUES')
-
-
-    # SEE RELATION BETWEEN FEATURES -------------------------------------------------------------
-
-    # Plot HeartRate / Intensity
-    def relation_hr_int():
-        plt.figure(figsize=(20, 10))
-        # Make a plot for each day
-        for id,day in enumerate(dates):
-            x = day_hr_new[id]
-            y = day_int_new[id]
-            # Check if the lengths of the features match
-            if len(x) != len(y): 
-                print(f'*Lengths of heart rates and intensities do not match - graphic not created')
-                return
-            plt.scatter(x, y, alpha=0.5)
-            plt.xlabel('\nHeartRate (bpm)')
-            plt.ylabel('Intensity (0: sedentary - 3: very active)\n')
-            plt.title(f'HeartRate/Intensity of user {user} on {day}')
-            plt.xlim(30, 220)
-            plt.ylim(-0.5, 3.5)
-            plt.yticks([0, 1, 2, 3])
-            plt.grid(True)
-            if not os.path.exists(f'figures/user{user}'):
-                os.makedirs(f'figures/user{user}')
-            # Save the figure
-            plt.savefig(f'figures/user{user}/hr_int_{day}.png', bbox_inches='tight')
-            #plt.show()
-            plt.clf()
-
-    relation_hr_int()
-
-    # Plot HeartRate and Intensity by Time
-    def relation_hr_int_time():
-        plt.figure(figsize=(20, 10))
-        # Make a plot for each day
-        for id,day in enumerate(dates):
-            # Intensity plot
-            plt.subplot(2, 1, 2)
-            x = day_time_new[id]
-            y = day_int_new[id]
-            # Check if the lengths of the features match
-            if len(x) != len(y): 
-                print(f'*Lengths of heart rates and intensities do not match - graphic not created')
-                return
-            plt.scatter(x, y, color='purple', label='Intensity', alpha=0.5)
-            plt.xlabel('\nTime')
-            plt.ylabel('Intensity (0: sedentary - 3: very active)\n')
-            plt.ylim(-0.5, 3.5)
-            plt.grid(True)
-            plt.legend()
-            # HeartRate plot
-            plt.subplot(2, 1, 1)
-            x = day_time_new[id]
-            y = day_hr_new[id]
-            plt.plot(x, y, label='HeartRate', alpha=0.5)
-            plt.xlabel('\nTime')
-            plt.ylabel('HeartRate (bpm)\n')
-            plt.title(f'HR and Intensity of user {user} on {day}')
-            plt.ylim(30, 220)
-            plt.grid(True)
-            plt.legend()
-            # Adjust space between subplots
-            plt.tight_layout()
-            if not os.path.exists(f'figures/user{user}'):
-                os.makedirs(f'figures/user{user}')
-            # Save the figure
-            plt.savefig(f'figures/user{user}/hr_int_time_{day}.png', bbox_inches='tight')
-            #plt.show()
-            plt.clf()
-
-    relation_hr_int_time()
-
-    # Plot HeartRate / Steps
-    def relation_hr_steps():
-        plt.figure(figsize=(20, 10))
-        # Make a plot for each day
-        for id,day in enumerate(dates):
-            x = day_hr_new[id]
-            y = day_steps_new[id]
-            # Check if the lengths of the features match
-            if len(x) != len(y): 
-                print(f'*Lengths of heart rates and steps do not match - graphic not created')
-                return
-            plt.scatter(x, y, alpha=0.5)
-            plt.xlabel('\nHeartRate (bpm)')
-            plt.ylabel('Steps\n')
-            plt.title(f'HeartRate/Steps of user {user} on {day}')
-            plt.xlim(30, 220)
-            plt.ylim(-5, 155)
-            plt.grid(True)
-            if not os.path.exists(f'figures/user{user}'):
-                os.makedirs(f'figures/user{user}')
-            # Save the figure
-            plt.savefig(f'figures/user{user}/hr_step_{day}.png', bbox_inches='tight')
-            #plt.show()
-            plt.clf()
-
-    relation_hr_steps()
-
-    # Plot HeartRate and Steps by Time
-    def relation_hr_steps_time():
-        plt.figure(figsize=(20, 10))
-        # Make a plot for each day
-        for id,day in enumerate(dates):
-            # Steps plot
-            plt.subplot(2, 1, 2)
-            x = day_time_new[id]
-            y = day_steps_new[id]
-            # Check if the lengths of the features match
-            if len(x) != len(y): 
-                print(f'*Lengths of heart rates and steps do not match - graphic not created')
-                return
-            plt.plot(x, y, label='Steps', color='purple', alpha=0.5)
-            plt.xlabel('\nTime')
-            plt.ylabel('Steps\n')
-            plt.ylim(-5, 155)
-            plt.grid(True)
-            plt.legend()
-            # HeartRate plot
-            plt.subplot(2, 1, 1)
-            x = day_time_new[id]
-            y = day_hr_new[id]
-            plt.plot(x, y, label='HeartRate', alpha=0.5)
-            plt.xlabel('\nTime')
-            plt.ylabel('HeartRate (bpm)\n')
-            plt.title(f'HR and Steps of user {user} on {day}')
-            plt.ylim(30, 220)
-            plt.grid(True)
-            plt.legend()
-            # Adjust space between subplots
-            plt.tight_layout()
-            if not os.path.exists(f'figures/user{user}'):
-                os.makedirs(f'figures/user{user}')
-            # Save the figure
-            plt.savefig(f'figures/user{user}/hr_step_time_{day}.png', bbox_inches='tight')
-            #plt.show()
-            plt.clf()
-
-    relation_hr_steps_time()
-
 
     # CREATE DATAFRAME WITH THE RELEVANT DATA ---------------------------------------------------
 
     data = pd.DataFrame()
     data['Date'] = dates
-    data['Time'] = day_time_new
-    data['HeartRate'] = day_hr_new
-    data['Intensity'] = day_int_new
-    data['Steps'] = day_steps_new
-    data['Max'] = maxx
-    data['Min'] = minn
-    data['Mean'] = mean
-    data['Median'] = median
-    data['Std_dev'] = std_deviation
-    data['RMSSD'] = rmssd
-    data['pNN50'] = pnn50
+    data['Time'] = list(day_time_new)
+    data['HeartRate'] = user_days['hr'].tolist()
+    data['Intensity'] = user_days['int'].tolist()
+    data['Steps'] = user_days['steps'].tolist()
+    for name, _ in stats_types:
+        data[name] = user_days['stats'][name]
 
     # Show all columns of the dataframe
     pd.set_option('display.max_columns', None)
@@ -701,18 +711,42 @@ def preprocess(user, file_hr_1, file_hr_2, file_min_int_1, file_min_int_2, file_
     print(data)
     print()
 
-    # Verify if the folder exists
-    if not os.path.exists(f'datasets'):
-        os.makedirs(f'datasets')
-    # Store the data maintaining the formats
-    with open(f'datasets/data_user{user}.pkl', 'wb') as f:
-        pickle.dump(data, f)
+    # Store the data (columnar format - one array for each feature)
+    mark('dataframe', days=user_days.n_days)
+    if write_dataset is not None:
+        save_dataset(user, user_days, wait=write_dataset == 'sync')
+        mark('save_dataset', days=user_days.n_days, write=write_dataset)
+
+    # Store the result object - the figures are rendered from it when they are requested
+    # (in incremental mode the samples of the days maintained are taken from the previous result)
+    data_hr_user = data_hr_user[['Time', 'HeartRate']]
+    if previous_days is not None:
+        previous_result = load_result('preprocess', user)
+        if previous_result is not None:
+            previous_hr = previous_result['data_hr_user']
+            data_hr_user = pd.concat([previous_hr[previous_hr['Time'] < cutoff_time], data_hr_user])
+    result = {'data_hr_user': data_hr_user, 'dates': dates, 'day_time': day_time_new,
+              'day_hr': user_days['hr'], 'day_int': user_days['int'], 'day_steps': user_days['steps']}
+    # (the figures of the previous result are kept if the samples and the days are the same)
+    key = cache_key({'time': data_hr_user['Time'].to_numpy(), 'samples': data_hr_user['HeartRate'].to_numpy(),
+                     'day_time': day_time_new, 'day_hr': user_days['hr'], 'day_int': user_days['int'],
+                     'day_steps': user_days['steps']}, {})
+    save_result('preprocess', user, result, key)
+    mark('save_result', rows=len(data_hr_user))
+
+    # Render all the figures only if they are requested
+    if plots:
+        from figures import plot_preprocess
+        plot_preprocess(user, result)
+        mark('plots', days=len(dates))
 
     # Return dataset in JSON format - adapt the time values
+    # ({"days": [one record for each day], "dropped_days": [days dropped for missing intensity or steps values]})
     data['Date'] = pd.to_datetime(data['Date']).dt.strftime('%Y-%m-%d')
     data['Time'] = data['Time'].apply(lambda times: [pd.to_datetime(t).strftime('%Y-%m-%d %H:%M:%S') for t in times])
-    data_json = data.to_json(orient='records')
-    return data_json
+    data_json = f'{{"days": {data.to_json(orient="records")}, "dropped_days": {json.dumps(dropped_days)}}}'
+    mark('json', days=len(dates))
+    return user_days, data_json
 
 # AVAILABLE USERS
 
@@ -721,7 +755,7 @@ users = [2022484408, 2026352035, 2347167796, 4020332650, 4388161847, 4558609924,
 
 # MAIN FUNCTION
 
-def main(user, show_output):
+def main(user, show_output, plots, incremental):
 
     # Change standard output:
     # Store the standard output
@@ -731,7 +765,8 @@ def main(user, show_output):
         sys.stdout = open(os.devnull, 'w')
 
     # Call preprocess function with the parameters user and data files
-    result_json = preprocess(user, file_hr_1, file_hr_2, file_min_int_1, file_min_int_2, file_min_steps_1, file_min_steps_2)
+    result_json = preprocess(user, file_hr_1, file_hr_2, file_min_int_1, file_min_int_2, file_min_steps_1, file_min_steps_2, plots=plots,
+                             incremental=incremental)
     
     # Restore standard output
     sys.stdout = original_stdout
@@ -749,12 +784,22 @@ if __name__ == '__main__':
         show_output_input = sys.argv[2].lower() == "true"
         show_output = show_output_input
         if show_output_input: show_output = show_output_input
+    # plots is predefined as False (only the results are computed, the figures are rendered on demand)
+    plots = False
+    # Verify if there is an argument for plots
+    if len(sys.argv) > 3:
+        plots = sys.argv[3].lower() == "true"
+    # incremental is predefined as False (all the data of the user is preprocessed)
+    incremental = False
+    # Verify if there is an argument for incremental
+    if len(sys.argv) > 4:
+        incremental = sys.argv[4].lower() == "true"
     # Verify if there is an argument for the user
     if len(sys.argv) > 1:
         # Convert the argument to type int
         user = int(sys.argv[1])
         # Verify if the user id is valid
-        if user in users: main(user, show_output)
+        if user in users: main(user, show_output, plots, incremental)
         else: print("The user argument provided is not valid.")
     else:
         print("No user argument was provided.")
@@ -0,0 +1,63 @@
+# RESULTS OF THE PHASES - STORED TO RENDER THE FIGURES ON DEMAND --------------------------------------------------
+
+# Libraries
+import pickle
+import shutil
+import os
+
+# Path of the result object of a phase ('preprocess' or 'anom_det')
+def result_path(phase, user):
+    return f'results/{phase}_user{user}.pkl'
+
+# Path of the key of the result object of a phase (hash of the data and parameters it was computed from)
+def result_key_path(phase, user):
+    return f'results/{phase}_user{user}.key'
+
+# Store the result object of a phase - if its key is not the key of the previous result (the result changed), the
+# figures of the phase rendered from the previous result are removed (they are rendered again from the new one when
+# they are requested)
+# key: hash of the content of the result, without the fields of each execution (e.g. the time of the modules) - if it
+# is None the figures are always removed
+def save_result(phase, user, result, key=None):
+    # Verify if the folder exists
+    if not os.path.exists('results'):
+        os.makedirs('results')
+    with open(result_path(phase, user), 'wb') as f:
+        pickle.dump(result, f)
+    key_path = result_key_path(phase, user)
+    previous_key = None
+    if os.path.exists(key_path):
+        with open(key_path) as f:
+            previous_key = f.read()
+    if key is None or key != previous_key:
+        remove_figures(phase, user)
+    if key is None:
+        if os.path.exists(key_path):
+            os.remove(key_path)
+    else:
+        with open(key_path, 'w') as f:
+            f.write(key)
+
+# Remove the figures of a phase of a user (the anomaly detection figures are in the folders of the modules or their
+# names start with '_', the rest are preprocess figures)
+def remove_figures(phase, user):
+    folder = f'figures/user{user}'
+    if not os.path.exists(folder):
+        return
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if (os.path.isdir(path) or name.startswith('_')) != (phase == 'anom_det'):
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+
+# Read the result object of a phase (None if the phase has not been executed for the user)
+def load_result(phase, user):
+    if not os.path.exists(result_path(phase, user)):
+        return None
+    with open(result_path(phase, user), 'rb') as f:
+        return pickle.load(f)
+
+# -----------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,69 @@
+# COMBINED EXECUTION - PREPROCESS AND ANOMALY DETECTION OF A USER IN THE SAME PROCESS -----------------------------
+
+# The days of the user produced by the preprocess are passed in memory to the anomaly detection (the processes of
+# the modules read them from shared memory blocks), without writing and reading the dataset between both phases.
+# The dataset is written in the background while the anomalies are detected (or not written, optionally)
+
+# Libraries
+import os
+import sys
+import preprocess as pre
+from anom_det import anom_det
+from dataset import wait_dataset
+from instrument import stage
+
+# Preprocess and anomaly detection of a user - returns the days of the user and the results of both phases in JSON
+# format ({"preprocess": [...], "anom_days": [...]})
+# data_user: heart rate, intensities and steps data of the user (read from the CSV files if it is not given - in
+# incremental mode only the samples that are preprocessed again)
+# write_dataset: 'async' (written in the background), 'sync' or None (not written)
+def run(user, data_user=None, plots=False, incremental=False, write_dataset='async', n_jobs=None):
+
+    if data_user is None:
+        since = pre.incremental_cutoff(user) if incremental else None
+        data_user = pre.load_data(pre.file_hr_1, pre.file_hr_2, pre.file_min_int_1, pre.file_min_int_2,
+                                  pre.file_min_steps_1, pre.file_min_steps_2, users=[user], since=since)
+    data_hr, data_int, data_steps = data_user
+
+    with stage('run', user=user, write=write_dataset):
+        user_days, preprocess_json = pre.preprocess_days(user, data_hr, data_int, data_steps, plots=plots,
+                                                         incremental=incremental, write_dataset=write_dataset)
+        anom_days_json = anom_det(user, plots=plots, data=user_days, n_jobs=n_jobs)
+
+    return user_days, f'{{"preprocess": {preprocess_json}, "anom_days": {anom_days_json}}}'
+
+# MAIN FUNCTION
+
+def main(user, show_output, plots, incremental):
+
+    # Change standard output:
+    # Store the standard output
+    original_stdout = sys.stdout
+    # If we don't want to show the output (prints), output changes to null
+    if not show_output:
+        sys.stdout = open(os.devnull, 'w')
+
+    _, result_json = run(user, plots=plots, incremental=incremental)
+    # The dataset is written before the end of the process
+    wait_dataset(user)
+
+    # Restore standard output
+    sys.stdout = original_stdout
+
+    # Return the json
+    if not show_output:
+        print(result_json)
+
+if __name__ == '__main__':
+    # Arguments: user, show_output, plots and incremental (the same as preprocess.py)
+    show_output = len(sys.argv) > 2 and sys.argv[2].lower() == 'true'
+    plots = len(sys.argv) > 3 and sys.argv[3].lower() == 'true'
+    incremental = len(sys.argv) > 4 and sys.argv[4].lower() == 'true'
+    if len(sys.argv) > 1:
+        user = int(sys.argv[1])
+        if user in pre.users: main(user, show_output, plots, incremental)
+        else: print("The user argument provided is not valid.")
+    else:
+        print("No user argument was provided.")
+
+# -----------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,17 @@
+# TESTS - CONFIGURATION -------------------------------------------------------------------------------------------
+
+# The tests import the modules of the main folder and write the datasets and results in a temporary folder
+
+# Libraries
+import os
+import sys
+import pytest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Execute each test in its own temporary folder (datasets/, results/ and figures/ are created there)
+@pytest.fixture(autouse=True)
+def work_folder(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+# -----------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,35 @@
+# TESTS OF THE MODELS OF THE USERS --------------------------------------------------------------------------------
+
+# Libraries
+import os
+import shutil
+import pytest
+import anom_det as ad
+from dataset import load_dataset
+from model import fit_model, score
+
+main_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules of the registry and modules with a reduction of the features and with a fixed anomaly threshold
+modules_registry = ad.modules_registry + [
+    {'folder': '6_hr_pca', 'title': 'HR vectors (PCA)', 'features': 'hr', 'reduction': 'pca', 'dims': 5,
+     'clustering': 'ward', 'k': 4, 'threshold': None, 'weight': 1, 'enabled': True, 'resolution': 1},
+    {'folder': '7_hr_sax', 'title': 'HR vectors (SAX)', 'features': 'hr', 'reduction': 'sax', 'dims': 24,
+     'clustering': 'ward', 'k': 4, 'threshold': 2000, 'weight': 1, 'enabled': True, 'resolution': 15},
+    {'folder': '8_steps_paa', 'title': 'STEPS vectors (PAA)', 'features': 'steps', 'reduction': 'paa', 'dims': 48,
+     'clustering': 'minibatch_kmeans', 'k': 3, 'threshold': None, 'weight': 1, 'enabled': True, 'resolution': 1},
+]
+
+# Scoring the days used to fit the model gives the same anomalies as the anomaly detection (each module and voting)
+@pytest.mark.parametrize('user', [2347167796, 8877689391])
+def test_score_fitted_days_reproduces_detect(user, monkeypatch):
+    monkeypatch.setattr(ad, 'modules_registry', modules_registry)
+    shutil.copytree(os.path.join(main_folder, 'datasets', f'user{user}'), f'datasets/user{user}')
+    data = load_dataset(user)
+
+    model = fit_model(user, data, n_jobs=1)
+    result = ad.detect(data, n_jobs=1)
+    anom_days, module_days = score(model, data)
+
+    assert anom_days == result['anom_days'] == model['anom_days']
+    assert module_days == {module['folder']: module['anom_days'] for module in result['modules']}
@@ -0,0 +1,46 @@
+# TESTS OF THE PREPROCESS -----------------------------------------------------------------------------------------
+
+# Libraries
+import json
+import numpy as np
+import pandas as pd
+import preprocess as pre
+from dataset import load_dataset
+
+user = 2022484408
+
+# Data of the user in the format of load_data - one heart rate sample per minute from 06:00 to 21:59 of each day,
+# and the intensity and steps of the same minutes
+def user_data(n_days=5):
+    rng = np.random.default_rng(0)
+    minutes = (pd.Timestamp('2016-04-01 06:00') + pd.to_timedelta(np.arange(n_days), unit='D').values[:, None]
+               + pd.to_timedelta(np.arange(16 * 60), unit='min').values).ravel()
+    minutes = pd.Series(pd.to_datetime(minutes))
+    data_hr = pd.DataFrame({'Id': user, 'Time': minutes, 'ActivityMinute': minutes,
+                            'HeartRate': rng.integers(55, 120, len(minutes)).astype(np.int16)})
+    data_int = pd.DataFrame({'Id': user, 'ActivityMinute': minutes,
+                             'Intensity': rng.integers(0, 4, len(minutes)).astype(np.int8)})
+    data_steps = pd.DataFrame({'Id': user, 'ActivityMinute': minutes,
+                               'Steps': rng.integers(0, 100, len(minutes)).astype(np.int16)})
+    return data_hr, data_int, data_steps
+
+# A day without intensity values in some minutes of the range of time is dropped and reported (the rest are kept)
+def test_missing_intensity_drops_the_day():
+    data_hr, data_int, data_steps = user_data()
+    gap = data_int['ActivityMinute'].between(pd.Timestamp('2016-04-03 12:00'), pd.Timestamp('2016-04-03 12:04'))
+    data_int = data_int[~gap]
+
+    user_days, data_json = pre.preprocess_days(user, data_hr, data_int, data_steps)
+    result = json.loads(data_json)
+
+    assert result['dropped_days'] == [{'Date': '2016-04-03', 'MissingIntensity': 5, 'MissingSteps': 0}]
+    assert [day['Date'] for day in result['days']] == ['2016-04-01', '2016-04-02', '2016-04-04', '2016-04-05']
+    assert user_days.n_days == 4
+    assert load_dataset(user).n_days == 4
+
+# Without gaps no day is dropped
+def test_complete_days_are_kept():
+    user_days, data_json = pre.preprocess_days(user, *user_data())
+    result = json.loads(data_json)
+    assert result['dropped_days'] == []
+    assert len(result['days']) == user_days.n_days == 5
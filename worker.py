@@ -0,0 +1,156 @@
+# PERSISTENT WORKER - PREPROCESS AND ANOMALY DETECTION WITHOUT STARTING PYTHON FOR EACH REQUEST -------------------
+
+# The worker reads one request for each line of the standard input (JSON):
+#   {"id": 1, "method": "anom_det", "params": {"user": 2022484408}}
+# and writes one response for each line of the standard output (JSON):
+#   {"id": 1, "result": ["04-19"]} or {"id": 1, "error": "..."}
+
+# Libraries
+import os
+import sys
+import json
+import traceback
+import numpy as np
+from contextlib import redirect_stdout
+import preprocess as pre
+from anom_det import anom_det
+from run import run
+from figures import render_figure, figures_status, renderer
+import online
+from dataset import load_dataset, dataset_path, dataset_pending, wait_dataset, arrays_marker
+from instrument import stage
+
+# DATA KEPT IN MEMORY
+
+# Data of all the users read from the CSV files (and the modification times of the files)
+csv_data = {'mtimes': None, 'users': None}
+
+# Data of each user from the CSV files - the files are only read again if they change
+def get_data_users():
+    files = [pre.file_hr_1, pre.file_hr_2, pre.file_min_int_1, pre.file_min_int_2, pre.file_min_steps_1, pre.file_min_steps_2]
+    mtimes = [os.path.getmtime(file) for file in files]
+    if csv_data['mtimes'] != mtimes:
+        data_hr, data_int, data_steps = pre.load_data(*files)
+        csv_data['users'] = pre.partition_data(data_hr, data_int, data_steps)
+        csv_data['mtimes'] = mtimes
+    return csv_data['users']
+
+# Datasets of the users (and the modification times of the files) - read again only if the preprocess changes them
+# The days preprocessed by the worker are kept in memory (modification time None until their files are written)
+datasets = {}
+
+def get_dataset(user):
+    if user in datasets and datasets[user][0] is None:
+        if dataset_pending(user):
+            return datasets[user][1]
+        # The files are written (the errors of the write are raised here)
+        wait_dataset(user)
+        datasets[user] = (os.path.getmtime(arrays_marker(dataset_path(user))), datasets[user][1])
+    mtime = os.path.getmtime(arrays_marker(dataset_path(user)))
+    if user not in datasets or datasets[user][0] != mtime:
+        datasets[user] = (mtime, load_dataset(user))
+    return datasets[user][1]
+
+# OPERATIONS
+
+# Verify if the user id is valid
+def check_user(params):
+    user = int(params['user'])
+    if user not in pre.users:
+        raise ValueError('The user argument provided is not valid.')
+    return user
+
+def op_preprocess(params):
+    user = check_user(params)
+    data_users = get_data_users()
+    if user not in data_users:
+        raise ValueError('No data for the user in the CSV files.')
+    data_hr_user, data_int_user, data_steps_user = data_users[user]
+    # The dataset is written in the background - the anomaly detection of the user uses the days in memory
+    user_days, data_json = pre.preprocess_days(user, data_hr_user, data_int_user, data_steps_user,
+                                               plots=params.get('plots', False),
+                                               incremental=params.get('incremental', False), write_dataset='async')
+    datasets[user] = (None, user_days)
+    return json.loads(data_json)
+
+def op_anom_det(params):
+    user = check_user(params)
+    return json.loads(anom_det(user, plots=params.get('plots', False), data=get_dataset(user)))
+
+# Preprocess and anomaly detection in the same request (the days are passed in memory)
+def op_run(params):
+    user = check_user(params)
+    data_users = get_data_users()
+    if user not in data_users:
+        raise ValueError('No data for the user in the CSV files.')
+    user_days, result_json = run(user, data_users[user], plots=params.get('plots', False),
+                                 incremental=params.get('incremental', False))
+    datasets[user] = (None, user_days)
+    return json.loads(result_json)
+
+def op_figure(params):
+    user = check_user(params)
+    return render_figure(user, params['figure'])
+
+# Figures of a user rendered in the background (requested with plots) - the web app asks for them until none is pending
+def op_figures_status(params):
+    user = check_user(params)
+    return figures_status(user)
+
+# Current day of each user scored online (a new day starts when a minute of another date arrives)
+online_days = {}
+
+def op_online(params):
+    user = check_user(params)
+    time = params['time']
+    date = str(np.datetime64(time, 'D'))
+    if user not in online_days or online_days[user]['date'] != date:
+        online_days[user] = online.start_day(user, date)
+    return online.add_minute(online_days[user], time, float(params['hr']))
+
+operations = {'preprocess': op_preprocess, 'anom_det': op_anom_det, 'run': op_run, 'figure': op_figure,
+              'figures_status': op_figures_status, 'online': op_online}
+
+# Execute one request and obtain its response
+def handle(request):
+    response = {'id': request.get('id')}
+    try:
+        operation = operations.get(request.get('method'))
+        if operation is None:
+            raise ValueError(f"Unknown method: {request.get('method')}")
+        # Time and memory of each request (on the standard error or in a file, never with the responses)
+        with stage(f"worker.{request.get('method')}", id=request.get('id')):
+            response['result'] = operation(request.get('params', {}))
+    except Exception as error:
+        # The worker keeps running - the error is returned to the caller
+        traceback.print_exc(file=sys.stderr)
+        response['error'] = f'{type(error).__name__}: {error}'
+    return response
+
+# MAIN FUNCTION
+
+def main():
+
+    # The standard output is only used for the responses
+    responses = sys.stdout
+    # The figures of the phases are rendered in the background (the response does not wait for them)
+    renderer['wait'] = False
+    with open(os.devnull, 'w') as devnull:
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as error:
+                response = {'id': None, 'error': f'Invalid request: {error}'}
+            else:
+                # The comments of the phases are not shown
+                with redirect_stdout(devnull):
+                    response = handle(request)
+            responses.write(json.dumps(response) + '\n')
+            responses.flush()
+
+if __name__ == '__main__':
+    main()
+
+# -----------------------------------------------------------------------------------------------------------------